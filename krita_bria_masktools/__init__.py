@@ -1 +1,8 @@
+import time
+
+_import_started = time.perf_counter()
+
 from .krita_bria_masktools import *
+from . import startup as _startup
+
+_startup.record("import", _import_started)
@@ -0,0 +1,100 @@
+"""
+Atlas packing for Bria Mask Tools.
+Batches of small layers (icons, sprites) are packed into one padded composite image so a
+single API call serves all of them; the result is sliced back into one piece per layer.
+"""
+
+from collections import namedtuple
+
+# Layers whose longer side is at most this are packed into atlases
+ATLAS_MAX_CELL = 512
+# A cell is at most this fraction of the atlas side, so several fit per shelf
+ATLAS_CELLS_PER_SIDE = 4
+# Longest side of an atlas sent to background removal
+ATLAS_MAX_SIZE = 2048
+# Gap around every cell so objects in neighbouring cells stay apart
+ATLAS_PADDING = 16
+
+Cell = namedtuple('Cell', 'index x y width height')
+
+
+class AtlasGroup:
+    """Batch item standing for several small layers sent as one atlas; collects per-layer results."""
+
+    def __init__(self, nodes, max_size):
+        self.nodes = list(nodes)
+        self.max_size = max_size
+        self.results = []
+        self.density = 0.0
+
+
+class Atlas:
+    """One composite image under construction, filled shelf by shelf."""
+
+    def __init__(self, max_size, padding):
+        self.max_size = max_size
+        self.padding = padding
+        self.cells = []
+        self.width = self.height = padding
+        self._shelves = []  # [y, height, next free x]
+
+    def add(self, index, width, height):
+        """Place a width x height cell; returns False if it does not fit."""
+        pad = self.padding
+        for shelf in self._shelves:
+            y, shelf_height, x = shelf
+            if height <= shelf_height and x + width + pad <= self.max_size:
+                self._place(shelf, index, width, height)
+                return True
+        y = self.height
+        if y + height + pad > self.max_size or pad + width + pad > self.max_size:
+            return False
+        shelf = [y, height, pad]
+        self._shelves.append(shelf)
+        self.height = y + height + pad
+        self._place(shelf, index, width, height)
+        return True
+
+    def _place(self, shelf, index, width, height):
+        y, _, x = shelf
+        self.cells.append(Cell(index, x, y, width, height))
+        shelf[2] = x + width + self.padding
+        self.width = max(self.width, shelf[2])
+
+    def density(self):
+        """Fraction of the atlas covered by layer pixels."""
+        used = sum(cell.width * cell.height for cell in self.cells)
+        return used / float(max(1, self.width * self.height))
+
+
+def max_cell_size(max_size=ATLAS_MAX_SIZE):
+    """
+    Longest side of a layer packed into an atlas of max_size: ATLAS_MAX_CELL, capped at a quarter of
+    the atlas side. Mask atlases are limited to the largest resolution rung (800px by default), where
+    512px cells would sit one per shelf and their groups would be dropped as single-cell atlases.
+    """
+    return min(ATLAS_MAX_CELL, max_size // ATLAS_CELLS_PER_SIDE)
+
+
+def is_small(width, height, max_cell=ATLAS_MAX_CELL):
+    return 0 < max(width, height) <= max_cell
+
+
+def pack(sizes, max_size=ATLAS_MAX_SIZE, padding=ATLAS_PADDING):
+    """
+    Pack [(width, height), ...] into as few atlases as possible (shelf packing, tallest first).
+    Returns (atlases, leftovers); leftovers are the indices of sizes that fit in no atlas.
+    """
+    atlases = []
+    leftovers = []
+    order = sorted(range(len(sizes)), key=lambda i: (sizes[i][1], sizes[i][0]), reverse=True)
+    for index in order:
+        width, height = sizes[index]
+        if any(atlas.add(index, width, height) for atlas in atlases):
+            continue
+        atlas = Atlas(max_size, padding)
+        if atlas.add(index, width, height):
+            atlases.append(atlas)
+        else:
+            leftovers.append(index)
+    return atlases, leftovers
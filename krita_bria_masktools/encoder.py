@@ -0,0 +1,91 @@
+"""
+Upload encoder for Bria Mask Tools.
+Picks the codec and quality for each uploaded image from a fast trial encode of a small
+downsample: flat-colour artwork usually compresses far better losslessly as PNG, while
+photographic content is sent as JPEG at the highest quality that fits the
+bytes-per-megapixel budget.
+"""
+
+import time
+from collections import namedtuple
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, Qt
+
+# Default upload budget in KiB per megapixel of the uploaded image
+DEFAULT_BUDGET_KB_PER_MP = 1024
+MIN_BUDGET_KB_PER_MP = 64
+MAX_BUDGET_KB_PER_MP = 8192
+# Long side of the downsample used for trial encodes
+TRIAL_SIZE = 256
+# JPEG qualities tried for photographic content, best first
+JPEG_QUALITIES = (85, 75, 65, 55)
+# PNG is kept when its estimate is at most this multiple of the best JPEG estimate
+PNG_PREFERENCE = 1.25
+
+Encoding = namedtuple('Encoding', 'format quality estimate')
+Encoded = namedtuple('Encoded', 'data format quality mime suffix elapsed_ms')
+
+_MIME = {"PNG": ("image/png", ".png"), "JPEG": ("image/jpeg", ".jpg")}
+
+
+def _encode_bytes(image, fmt, quality=-1):
+    array = QByteArray()
+    buffer = QBuffer(array)
+    buffer.open(QIODevice.WriteOnly)
+    ok = image.save(buffer, fmt, quality)
+    buffer.close()
+    return bytes(array) if ok else None
+
+
+def encode_png(image):
+    """Lossless PNG bytes of image, or None if it cannot be encoded."""
+    return _encode_bytes(image, "PNG")
+
+
+def choose_encoding(image, budget_kb_per_mp=DEFAULT_BUDGET_KB_PER_MP, allow_png=True):
+    """
+    Return an Encoding for image within budget_kb_per_mp.
+    Sizes are estimated by scaling trial encodes of a TRIAL_SIZE downsample to the full pixel count.
+    """
+    pixels = max(1, image.width() * image.height())
+    budget = budget_kb_per_mp * 1024.0 * pixels / 1e6
+    trial = image
+    if max(image.width(), image.height()) > TRIAL_SIZE:
+        trial = image.scaled(TRIAL_SIZE, TRIAL_SIZE, Qt.KeepAspectRatio, Qt.FastTransformation)
+    scale = pixels / float(max(1, trial.width() * trial.height()))
+
+    def estimate(fmt, quality=-1):
+        data = _encode_bytes(trial, fmt, quality)
+        return len(data) * scale if data is not None else float('inf')
+
+    # Highest JPEG quality within budget, or the lowest one tried
+    tried = []
+    for quality in JPEG_QUALITIES:
+        tried.append(Encoding("JPEG", quality, estimate("JPEG", quality)))
+        if tried[-1].estimate <= budget:
+            break
+    if allow_png:
+        # Flat artwork: lossless costs little more than (or less than) the best-quality JPEG
+        png = Encoding("PNG", -1, estimate("PNG"))
+        if png.estimate <= budget and png.estimate <= tried[0].estimate * PNG_PREFERENCE:
+            return png
+    return tried[-1]
+
+
+def encode(image, budget_kb_per_mp=DEFAULT_BUDGET_KB_PER_MP, allow_png=True):
+    """Choose an encoding for image and encode it; returns an Encoded, or None if encoding fails."""
+    started = time.perf_counter()
+    choice = choose_encoding(image, budget_kb_per_mp, allow_png)
+    data = _encode_bytes(image, choice.format, choice.quality)
+    if data is None:
+        return None
+    mime, suffix = _MIME[choice.format]
+    return Encoded(data, choice.format, choice.quality, mime, suffix, (time.perf_counter() - started) * 1000.0)
+
+
+def describe(encoded, width, height):
+    """Format an Encoded as 'JPEG q85, 412 KiB (310 KiB/MP), 38 ms' for the log."""
+    codec = encoded.format if encoded.quality < 0 else f"{encoded.format} q{encoded.quality}"
+    kib = len(encoded.data) / 1024.0
+    per_mp = kib / max(1e-6, width * height / 1e6)
+    return f"{codec}, {kib:.0f} KiB ({per_mp:.0f} KiB/MP), {encoded.elapsed_ms:.0f} ms"
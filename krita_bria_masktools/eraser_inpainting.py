@@ -6,7 +6,6 @@ This module contains the masked removal (inpainting) logic that was removed from
 import os
 import sys
 import json
-import tempfile
 import urllib.request
 import uuid
 import base64
@@ -14,6 +13,8 @@ from PyQt5.QtGui import QImage, qRgb
 from PyQt5.QtCore import Qt
 from krita import InfoObject
 
+from . import scratch
+
 
 def process_masked_removal(node, api_key, document, context, mask, mask_type, 
                           preserve_alpha=True, prompt_text="", debug_callback=None):
@@ -48,10 +49,10 @@ def process_masked_removal(node, api_key, document, context, mask, mask_type,
         log_debug(f"Mask bounds: {bounds.x()}, {bounds.y()}, {bounds.width()}, {bounds.height()}")
 
     # Prepare temporary files
-    temp_dir = tempfile.gettempdir()
+    space = scratch.session()
     unique_id = str(uuid.uuid4())[:8]
-    temp_image_file = os.path.join(temp_dir, f"temp_image_{unique_id}.png")
-    temp_mask_file = os.path.join(temp_dir, f"temp_mask_{unique_id}.png")
+    temp_image_file = space.allocate(f"temp_image_{unique_id}", ".png")
+    temp_mask_file = space.allocate(f"temp_mask_{unique_id}", ".png")
     result_file = None
 
     try:
@@ -199,7 +200,7 @@ def process_masked_removal(node, api_key, document, context, mask, mask_type,
 
                         if result_url:
                             # Download result
-                            result_file = os.path.join(temp_dir, f"result_masked_{unique_id}.png")
+                            result_file = space.allocate(f"result_masked_{unique_id}", ".png")
                             try:
                                 urllib.request.urlretrieve(result_url, result_file)
                             except Exception as e:
@@ -227,14 +228,6 @@ def process_masked_removal(node, api_key, document, context, mask, mask_type,
                             ptr.setsize(image.byteCount())
                             new_layer.setPixelData(bytes(ptr), 0, 0, image.width(), image.height())
 
-                            # Clean up temp files
-                            for f in [temp_image_file, temp_mask_file, result_file]:
-                                if f and os.path.exists(f):
-                                    try:
-                                        os.remove(f)
-                                    except:
-                                        pass
-
                             # Return success with the new layer
                             result_msg = f"Eraser completed successfully for {node.name()}"
                             if prompt_text:
@@ -267,10 +260,7 @@ def process_masked_removal(node, api_key, document, context, mask, mask_type,
         return "Error: Failed after retry attempts"
 
     finally:
-        # Clean up temp files
-        for f in [temp_image_file, temp_mask_file]:
-            if f and os.path.exists(f):
-                try:
-                    os.remove(f)
-                except:
-                    pass
\ No newline at end of file
+        # Release temp files, including the result when loading it failed
+        for f in [temp_image_file, temp_mask_file, result_file]:
+            if f:
+                space.release(f)
\ No newline at end of file
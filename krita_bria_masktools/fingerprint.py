@@ -0,0 +1,169 @@
+"""
+Layer fingerprints for Bria Mask Tools result caches.
+A fingerprint combines one digest per tile of a layer's pixels, read tile by tile through
+node.pixelData, so the layer is never exported, encoded or held in memory as a whole. A tile is
+only re-hashed when its CRC-32 differs from the one stored with its digest.
+Reading the tiles is still O(layer pixels), so it is skipped for layers that are known clean:
+the docker marks a layer dirty when a stroke or key press lands on the canvas while it is the
+active layer (mark_dirty), and everything dirty when it could not watch (mark_all_dirty). A
+clean layer whose cheap sample (bounds, colour space, a grid of small tiles and the thumbnail)
+still matches returns its stored fingerprint in milliseconds; the sample catches edits made
+without the canvas, such as filters and scripts, when they touch the sampled pixels.
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict, namedtuple
+
+from PyQt5.QtCore import QUuid
+
+from .mask_utils import qimage_to_bytes
+
+# Edge of the tiles read for a fingerprint (1 MiB per tile at 8-bit RGBA)
+TILE_SIZE = 512
+# Sampled change hint: SAMPLE_GRID x SAMPLE_GRID tiles of SAMPLE_TILE pixels, plus a thumbnail
+SAMPLE_GRID = 8
+SAMPLE_TILE = 32
+THUMBNAIL_SIZE = 64
+MAX_ENTRIES = 512
+
+# tiles: (crc32, digest) per tile in row-major order; sample: sample_digest() when they were read
+Entry = namedtuple('Entry', 'key tiles digest sample')
+
+
+def layer_key(node):
+    """Bounds and colour space; any change to them changes the fingerprint."""
+    bounds = node.bounds()
+    return (bounds.x(), bounds.y(), bounds.width(), bounds.height(),
+            node.colorModel(), node.colorDepth(), node.colorProfile())
+
+
+def sample_digest(node, key=None):
+    """Digest of a sparse grid of small tiles and the layer thumbnail; a change hint only."""
+    key = key or layer_key(node)
+    x, y, width, height = key[:4]
+    digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16)
+    if width <= 0 or height <= 0:
+        return digest.hexdigest()
+    tile_w, tile_h = min(SAMPLE_TILE, width), min(SAMPLE_TILE, height)
+    for row in range(SAMPLE_GRID):
+        ty = y + (height - tile_h) * row // max(1, SAMPLE_GRID - 1)
+        for col in range(SAMPLE_GRID):
+            tx = x + (width - tile_w) * col // max(1, SAMPLE_GRID - 1)
+            digest.update(bytes(node.pixelData(tx, ty, tile_w, tile_h)))
+    thumbnail = node.thumbnail(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    if not thumbnail.isNull():
+        digest.update(qimage_to_bytes(thumbnail))
+    return digest.hexdigest()
+
+
+def tile_rects(key, tile=TILE_SIZE):
+    """(x, y, w, h) of the layer's tiles in row-major order."""
+    x, y, width, height = key[:4]
+    for ty in range(y, y + height, tile):
+        tile_h = min(tile, y + height - ty)
+        for tx in range(x, x + width, tile):
+            yield tx, ty, min(tile, x + width - tx), tile_h
+
+
+def combine(key, tiles):
+    """Layer digest from its key and tile digests."""
+    digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=20)
+    for _, tile_digest in tiles:
+        digest.update(tile_digest)
+    return digest.hexdigest()
+
+
+def hash_tiles(node, key, previous=None, tile=TILE_SIZE):
+    """
+    Return ([(crc32, digest), ...], rehashed): the layer's tile digests, reusing those in previous
+    (from the same key) whose CRC still matches.
+    """
+    tiles = []
+    rehashed = 0
+    for idx, rect in enumerate(tile_rects(key, tile)):
+        data = bytes(node.pixelData(*rect))
+        check = zlib.crc32(data)
+        if previous is not None and previous[idx][0] == check:
+            tiles.append(previous[idx])
+            continue
+        rehashed += 1
+        tiles.append((check, hashlib.blake2b(data, digest_size=16).digest()))
+    return tiles, rehashed
+
+
+class LayerFingerprints:
+    """Tile digests by node id with dirty flags, reused for the tiles that did not change; GUI thread only."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dirty = set()      # Node ids that may have been edited since their tiles were read
+        self.hits = 0            # Lookups where the layer had not changed
+        self.misses = 0
+        self.sampled = 0         # Hits answered from the sample alone, without reading the tiles
+        self.rehashed_tiles = 0
+
+    def mark_dirty(self, node_id):
+        """The node may have been edited; its next lookup reads its tiles again."""
+        if node_id in self._entries:
+            self._dirty.add(node_id)
+
+    def mark_all_dirty(self):
+        self._dirty.update(self._entries)
+
+    def fingerprint(self, node):
+        """Return the node's fingerprint, or None for an empty layer."""
+        key = layer_key(node)
+        if key[2] <= 0 or key[3] <= 0:
+            return None
+        node_id = node.uniqueId().toString()
+        entry = self._entries.get(node_id)
+        sample = sample_digest(node, key)
+        if entry is not None and entry.key == key:
+            if node_id not in self._dirty and entry.sample == sample:
+                self.hits += 1
+                self.sampled += 1
+                self._entries.move_to_end(node_id)
+                return entry.digest
+            previous = entry.tiles
+        else:
+            previous = None
+        tiles, rehashed = hash_tiles(node, key, previous)
+        self._dirty.discard(node_id)
+        self.rehashed_tiles += rehashed
+        if previous is not None and not rehashed:
+            self.hits += 1
+            self._entries[node_id] = entry._replace(sample=sample)
+            self._entries.move_to_end(node_id)
+            return entry.digest
+        self.misses += 1
+        digest = combine(key, tiles)
+        self._entries[node_id] = Entry(key, tiles, digest, sample)
+        self._entries.move_to_end(node_id)
+        while len(self._entries) > self.max_entries:
+            self._dirty.discard(self._entries.popitem(last=False)[0])
+        return digest
+
+    def invalidate(self, node_id):
+        self._entries.pop(node_id, None)
+        self._dirty.discard(node_id)
+
+    def invalidate_changed(self, document):
+        """
+        Drop the entries of document's layers whose bounds or colour space changed (their tiles no
+        longer line up); returns how many. Pixel edits need no sweep: they are flagged with
+        mark_dirty, and the next lookup re-hashes the tiles they touched. Entries of layers not in
+        document are kept, they may belong to another open document.
+        """
+        changed = 0
+        for node_id, entry in list(self._entries.items()):
+            try:
+                node = document.nodeByUniqueID(QUuid(node_id))
+                if node is None or layer_key(node) == entry.key:
+                    continue
+            except Exception:
+                pass
+            self.invalidate(node_id)
+            changed += 1
+        return changed
@@ -0,0 +1,130 @@
+"""
+Edge-aware upsampling of low-resolution masks for Bria Mask Tools.
+The mask generator works on an 800px proxy; instead of blowing each mask up with plain
+smooth scaling, a guided filter (He et al.) uses the full-resolution layer as a guide so
+upscaled edges snap to real image edges.
+
+Work is done tile by tile (with a halo wide enough for the two box-filter passes), so the
+floating-point working set stays at a few tile-sized arrays regardless of canvas size, and
+iter_guided_bands hands the result out one row of tiles at a time so a mask can be written
+into Krita without ever holding it at full resolution.
+Requires NumPy; without it callers fall back to QImage smooth scaling.
+"""
+
+import importlib.util
+
+from PyQt5.QtGui import QImage
+
+from .mask_utils import load_numpy
+
+np = None  # Bound on the first upsample
+
+TILE_SIZE = 1024
+DEFAULT_EPS = 1e-3
+
+
+def is_available():
+    """True if NumPy is installed; checked without importing it."""
+    return np is not None or importlib.util.find_spec("numpy") is not None
+
+
+def default_radius(mask_width, guide_width):
+    """Filter radius in guide pixels: a couple of proxy pixels' worth of full-resolution pixels."""
+    return max(2, int(round(2.0 * guide_width / max(1, mask_width))))
+
+
+def _view(img: QImage, writable=False):
+    """Return a (h, w) uint8 NumPy view of a Grayscale8 QImage without copying."""
+    ptr = img.bits() if writable else img.constBits()
+    ptr.setsize(img.byteCount())  # type: ignore
+    return np.frombuffer(ptr, dtype=np.uint8).reshape(img.height(), img.bytesPerLine())[:, :img.width()]
+
+
+def _box_mean(values, radius):
+    """
+    Mean over a (2r+1)^2 window with edge replication, via cumulative sums.
+    The integral image is taken in float64: in float32 the running sums over a large tile lose the
+    low bits that the window differences depend on.
+    """
+    n = 2 * radius + 1
+    padded = np.pad(values, radius + 1, mode='edge')
+    sums = np.cumsum(np.cumsum(padded, axis=0, dtype=np.float64), axis=1)
+    window = sums[n:, n:] - sums[:-n, n:] - sums[n:, :-n] + sums[:-n, :-n]
+    return (window[:values.shape[0], :values.shape[1]] / float(n * n)).astype(values.dtype)
+
+
+def _bilinear(mask, xs, ys):
+    """Sample mask (float array) at fractional pixel coordinates xs (columns) and ys (rows)."""
+    mh, mw = mask.shape
+    xs = np.clip(xs, 0, mw - 1)
+    ys = np.clip(ys, 0, mh - 1)
+    x0 = np.floor(xs).astype(np.int64)
+    y0 = np.floor(ys).astype(np.int64)
+    x1 = np.minimum(x0 + 1, mw - 1)
+    y1 = np.minimum(y0 + 1, mh - 1)
+    fx = (xs - x0)[np.newaxis, :]
+    fy = (ys - y0)[:, np.newaxis]
+    top = mask[np.ix_(y0, x0)] * (1 - fx) + mask[np.ix_(y0, x1)] * fx
+    bottom = mask[np.ix_(y1, x0)] * (1 - fx) + mask[np.ix_(y1, x1)] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def iter_guided_bands(mask: QImage, guide: QImage, radius=None, eps=DEFAULT_EPS, tile=TILE_SIZE):
+    """
+    Yield (y, rows, bytes) for mask upsampled to guide's size with a guided filter, one row of
+    tiles at a time as unpadded 8-bit grayscale (the band contract of mask_utils.iter_scaled_bands).
+    guide is the full-resolution layer (any format; converted to grayscale once).
+    """
+    global np
+    if np is None:
+        np = load_numpy()
+    guide = guide.convertToFormat(QImage.Format_Grayscale8)
+    mask = mask.convertToFormat(QImage.Format_Grayscale8)
+    gw, gh = guide.width(), guide.height()
+    mw, mh = mask.width(), mask.height()
+    if radius is None:
+        radius = default_radius(mw, gw)
+
+    guide_px = _view(guide)
+    mask_px = _view(mask).astype(np.float32) / 255.0
+
+    halo = 2 * radius
+    sx, sy = mw / float(gw), mh / float(gh)
+    for ty in range(0, gh, tile):
+        rows = min(tile, gh - ty)
+        band = np.empty((rows, gw), dtype=np.uint8)
+        for tx in range(0, gw, tile):
+            # Tile plus halo, clamped to the image
+            x0, y0 = max(0, tx - halo), max(0, ty - halo)
+            x1, y1 = min(gw, tx + tile + halo), min(gh, ty + tile + halo)
+
+            guide_tile = guide_px[y0:y1, x0:x1].astype(np.float32) / 255.0
+            # Pixel-centre mapping from guide to mask coordinates
+            xs = (np.arange(x0, x1, dtype=np.float32) + 0.5) * sx - 0.5
+            ys = (np.arange(y0, y1, dtype=np.float32) + 0.5) * sy - 0.5
+            p = _bilinear(mask_px, xs, ys)
+
+            mean_i = _box_mean(guide_tile, radius)
+            mean_p = _box_mean(p, radius)
+            cov_ip = _box_mean(guide_tile * p, radius) - mean_i * mean_p
+            var_i = _box_mean(guide_tile * guide_tile, radius) - mean_i * mean_i
+            a = cov_ip / (var_i + eps)
+            b = mean_p - a * mean_i
+            q = _box_mean(a, radius) * guide_tile + _box_mean(b, radius)
+
+            # Keep only the tile interior
+            iy0, ix0 = ty - y0, tx - x0
+            ix1 = ix0 + min(tile, gw - tx)
+            band[:, tx:tx + (ix1 - ix0)] = np.clip(q[iy0:iy0 + rows, ix0:ix1] * 255.0 + 0.5, 0, 255).astype(np.uint8)
+        yield ty, rows, band.tobytes()
+
+
+def guided_upsample(mask: QImage, guide: QImage, radius=None, eps=DEFAULT_EPS, tile=TILE_SIZE) -> QImage:
+    """Upsample mask to guide's size with a guided filter and return a Grayscale8 QImage."""
+    result = QImage(guide.width(), guide.height(), QImage.Format_Grayscale8)
+    out = None
+    for y, rows, raw in iter_guided_bands(mask, guide, radius, eps, tile):
+        if out is None:
+            out = _view(result, writable=True)
+        out[y:y + rows] = np.frombuffer(raw, dtype=np.uint8).reshape(rows, -1)
+    return result
@@ -0,0 +1,96 @@
+"""
+Time-sliced import scheduler for Bria Mask Tools.
+Apply stages may be generators that yield (done, total) after each unit of work (usually
+one mask), or None after a step with no progress to report (one band of a canvas-sized
+pixel write), so a single step stays well inside the frame budget even on huge canvases.
+The scheduler advances them from a zero-interval QTimer and hands control back
+to the event loop once the frame budget is spent, so painting stays responsive.
+A generator that is waiting for more data yields WAIT and is parked until wake() is called.
+Tasks run in lanes: interactive tasks (the active layer) always step before bulk batch tasks.
+"""
+
+import time
+import types
+from collections import deque
+
+from PyQt5.QtCore import QObject, QTimer
+
+DEFAULT_FRAME_BUDGET_MS = 12
+
+# Yielded by a task that has nothing to do until more data arrives
+WAIT = object()
+
+# Lanes, in the order they are served
+INTERACTIVE = 0
+BULK = 1
+
+
+class ImportScheduler(QObject):
+    """Runs queued import tasks on the GUI thread in slices of at most frame_budget_ms."""
+
+    def __init__(self, frame_budget_ms=DEFAULT_FRAME_BUDGET_MS, parent=None):
+        super().__init__(parent)
+        self._lanes = (deque(), deque())  # Indexed by lane
+        self._waiting = []
+        self._frame_budget = frame_budget_ms / 1000.0
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._run_slice)
+        self.last_slice_ms = 0.0
+        self.max_slice_ms = 0.0
+
+    def set_frame_budget(self, frame_budget_ms):
+        self._frame_budget = max(1, frame_budget_ms) / 1000.0
+
+    def pending(self):
+        return sum(len(lane) for lane in self._lanes) + len(self._waiting)
+
+    def wake(self):
+        """Resume tasks parked on WAIT; call on the GUI thread when new data has arrived."""
+        for entry in self._waiting:
+            self._lanes[entry[3]].append(entry)
+        self._waiting = []
+        if any(self._lanes) and not self._timer.isActive():
+            self._timer.start()
+
+    def submit(self, task, on_done, on_progress=None, lane=BULK):
+        """
+        Queue a task. task is either a generator yielding (done, total) progress tuples and
+        returning its result, or a plain value that is passed straight to on_done.
+        """
+        if not isinstance(task, types.GeneratorType):
+            on_done(task)
+            return
+        self._lanes[lane].append((task, on_done, on_progress, lane))
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _run_slice(self):
+        start = time.perf_counter()
+        deadline = start + self._frame_budget
+        # Always make progress on at least one step, even if it alone exceeds the budget
+        while any(self._lanes):
+            # Re-checked after every step so interactive work preempts a running bulk import
+            tasks = next(lane for lane in self._lanes if lane)
+            task, on_done, on_progress, _ = tasks[0]
+            try:
+                step = next(task)
+            except StopIteration as stop:
+                tasks.popleft()
+                on_done(stop.value)
+            except Exception as e:
+                tasks.popleft()
+                on_done(f"Error applying result: {str(e)}")
+            else:
+                if step is WAIT:
+                    self._waiting.append(tasks.popleft())
+                    continue
+                if on_progress and step:
+                    on_progress(*step)
+            if time.perf_counter() >= deadline:
+                break
+
+        self.last_slice_ms = (time.perf_counter() - start) * 1000.0
+        self.max_slice_ms = max(self.max_slice_ms, self.last_slice_ms)
+        if not any(self._lanes):
+            self._timer.stop()
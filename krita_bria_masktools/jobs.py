@@ -0,0 +1,373 @@
+"""
+Background job execution for Bria Mask Tools.
+Network and decode work runs on worker threads; anything that touches the Krita API
+is posted back to the GUI thread through MainThreadQueue.
+"""
+
+import heapq
+import itertools
+import threading
+import types
+import weakref
+
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+
+from .import_scheduler import BULK
+
+# Workers a bulk batch leaves free so an interactive job never queues behind it
+RESERVED_INTERACTIVE_WORKERS = 1
+
+
+class JobCancelled(Exception):
+    """Raised inside worker code once the user has cancelled the batch."""
+
+
+class CancelToken:
+    """Thread-safe cancel flag that also aborts the HTTP connections registered with it."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakSet()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        from .net import abort_connection
+        for conn in connections:
+            abort_connection(conn)
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Raise JobCancelled if the token has been cancelled."""
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def sleep(self, seconds):
+        """Wait for seconds, returning early with JobCancelled if the token is cancelled."""
+        if self._event.wait(seconds):
+            raise JobCancelled()
+
+    def register(self, conn):
+        """Track an open connection; aborts it right away if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._connections.add(conn)
+                return
+        from .net import abort_connection
+        abort_connection(conn)
+        raise JobCancelled()
+
+
+class ResultStream:
+    """
+    Thread-safe hand-off of partial results from a worker to a streaming apply stage.
+    take() returns the highest-priority item received so far; notify() is called (from the
+    producing thread) whenever new items arrive or the stream is closed.
+    """
+
+    def __init__(self, notify=None):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._counter = itertools.count()
+        self._notify = notify
+        self.closed = False
+        self.error = None
+        self.received = 0
+
+    def put(self, item, priority=0):
+        with self._lock:
+            # heapq is a min-heap; negate so larger priorities come out first
+            heapq.heappush(self._heap, (-priority, next(self._counter), item))
+            self.received += 1
+        if self._notify:
+            self._notify()
+
+    def close(self, error=None):
+        with self._lock:
+            self.closed = True
+            self.error = error
+        if self._notify:
+            self._notify()
+
+    def take(self):
+        with self._lock:
+            if self._heap:
+                return heapq.heappop(self._heap)[2]
+        return None
+
+    def replace(self, old, new, priority=0):
+        """Swap a not-yet-taken item for new; returns False if old was already taken."""
+        with self._lock:
+            for i, (_, order, item) in enumerate(self._heap):
+                if item is old:
+                    self._heap[i] = (-priority, order, new)
+                    heapq.heapify(self._heap)
+                    return True
+        return False
+
+    def pending(self):
+        with self._lock:
+            return len(self._heap)
+
+    def exhausted(self):
+        with self._lock:
+            return self.closed and not self._heap
+
+
+# ------------------------------------------------------------
+# GUI-thread apply queue
+# ------------------------------------------------------------
+
+class MainThreadQueue(QObject):
+    """Runs callables posted from any thread on the GUI thread, one event-loop iteration later."""
+
+    _posted = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._posted.connect(self._run, Qt.QueuedConnection)
+
+    def post(self, fn, *args):
+        """Queue fn(*args) to run on the GUI thread. Safe to call from worker threads."""
+        self._posted.emit((fn, args))
+
+    def _run(self, item):
+        fn, args = item
+        fn(*args)
+
+
+# ------------------------------------------------------------
+# Batch runner: prepare (GUI) -> work (worker) -> apply (GUI)
+# ------------------------------------------------------------
+
+class BatchRunner:
+    """
+    Drive a batch of items through three stages:
+      prepare(item)         GUI thread, Krita export; returns a job or an error string
+      work(job, token)      worker thread, network/decode; returns a payload or an error string
+      apply(job, payload)   GUI thread, Krita node creation; returns a result string
+    apply may instead return a generator, which is then driven by the ImportScheduler in
+    time-budgeted slices; its (done, total) yields are forwarded to on_progress(item, done, total).
+    If a prepared job carries a ResultStream under 'stream' and a scheduler is available, apply
+    is started immediately with the stream as payload and consumes results while work is still
+    running; work's return value then only closes the stream (None, or an error string).
+    cleanup(job) runs on the GUI thread once a prepared job is finished, whatever the outcome,
+    right after on_job_result(job, result).
+    An item is only prepared when a worker is free, so at most max_workers exports wait for or
+    run their work stage; the next item is dispatched as soon as a work stage returns.
+    With a memory budget (see memory.MemoryBudget), estimate(item) bytes are reserved before an
+    item is prepared and released when its job finishes; while the budget is exhausted no new
+    item is exported until a job finishes. The budget may be shared with another runner; a lone
+    item is always admitted.
+    lane (INTERACTIVE or BULK) decides the ImportScheduler lane of the apply stage; pause() stops
+    exporting and sending new items until resume(), while jobs already in flight finish.
+    Results are reported through on_result(item, result) and on_finished(cancelled).
+    """
+
+    def __init__(self, queue, items, prepare, work, apply, cleanup=None,
+                 on_result=None, on_finished=None, max_workers=1,
+                 scheduler=None, on_progress=None, on_job_result=None, budget=None, estimate=None,
+                 lane=BULK):
+        self._queue = queue
+        self._scheduler = scheduler
+        self._on_progress = on_progress
+        self._items = list(items)
+        self._prepare = prepare
+        self._work = work
+        self._apply = apply
+        self._cleanup = cleanup
+        self._on_result = on_result
+        self._on_job_result = on_job_result
+        self._on_finished = on_finished
+        self._max_workers = max(1, max_workers)
+        self._budget = budget
+        self._estimate = estimate
+        self._costs = {}            # id(job) -> bytes reserved for it
+        self._admission_blocked = False
+        self._slot_blocked = False
+        self.lane = lane
+        self._paused = False
+        self._pause_blocked = False
+        self._executor = None
+        self._next_index = 0
+        self._in_flight = 0         # Prepared jobs not finished yet, including their apply stage
+        self._working = 0           # Jobs submitted to a worker whose work stage has not returned
+        self._finished = False
+        self.token = CancelToken()
+
+    def start(self):
+        from concurrent.futures import ThreadPoolExecutor  # Deferred to keep plugin import light
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                            thread_name_prefix="bria-worker")
+        self._queue.post(self._dispatch_next)
+
+    def cancel(self):
+        """Stop dispatching, abort in-flight requests; already finished results are still applied."""
+        if self.token.is_cancelled():
+            return
+        self.token.cancel()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._queue.post(self._check_finished)
+
+    def is_cancelled(self):
+        return self.token.is_cancelled()
+
+    def pause(self):
+        """Stop exporting new items; jobs already in flight still finish."""
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+        if self._pause_blocked:
+            self._pause_blocked = False
+            self._queue.post(self._dispatch_next)
+
+    def is_paused(self):
+        return self._paused
+
+    def _dispatch_next(self):
+        # Export one item per event-loop iteration so the UI stays responsive between exports
+        if self.token.is_cancelled() or self._next_index >= len(self._items):
+            self._check_finished()
+            return
+        if self._paused:
+            self._pause_blocked = True  # resume() dispatches again
+            return
+        if self._working >= self._max_workers:
+            self._slot_blocked = True  # _complete dispatches again once a worker is free
+            return
+        item = self._items[self._next_index]
+        cost = 0
+        if self._budget is not None:
+            cost = self._estimate(item) if self._estimate else 0
+            if not self._budget.try_acquire(cost, force=self._in_flight == 0):
+                # Resumed once a job of this or another runner sharing the budget releases its share
+                if not self._admission_blocked:
+                    self._admission_blocked = True
+                    self._budget.notify_on_release(self._admission_released)
+                return
+        self._next_index += 1
+
+        try:
+            job = self._prepare(item)
+        except Exception as e:
+            job = f"Error preparing job: {str(e)}"
+        if isinstance(job, str):
+            self._release(cost)
+            self._report(item, job)
+        else:
+            self._costs[id(job)] = cost
+            self._in_flight += 1
+            self._working += 1
+            try:
+                future = self._executor.submit(self._work, job, self.token)
+            except RuntimeError:
+                # Executor already shut down by cancel()
+                self._in_flight -= 1
+                self._working -= 1
+                self._finish_job(item, job, "Cancelled")
+            else:
+                future.add_done_callback(
+                    lambda f, item=item, job=job: self._queue.post(self._complete, item, job, f))
+                if self._streams(job):
+                    self._start_apply(item, job, job['stream'])
+        self._queue.post(self._dispatch_next)
+
+    def _streams(self, job):
+        return self._scheduler is not None and isinstance(job, dict) and job.get('stream') is not None
+
+    def _complete(self, item, job, future):
+        from concurrent.futures import CancelledError
+        self._working -= 1
+        if self._slot_blocked:
+            self._slot_blocked = False
+            self._queue.post(self._dispatch_next)
+        try:
+            payload = future.result()
+        except (JobCancelled, CancelledError):
+            payload = "Cancelled"
+        except Exception as e:
+            payload = f"Error: {str(e)}"
+
+        if self._streams(job):
+            # The streaming apply is already running; it finishes once the stream is drained
+            job['stream'].close(payload if isinstance(payload, str) else None)
+            return
+        if isinstance(job, dict) and job.get('stream') is not None:
+            job['stream'].close(payload if isinstance(payload, str) else None)
+            payload = job['stream']
+        if isinstance(payload, str):
+            self._applied(item, job, payload)
+            return
+        self._start_apply(item, job, payload)
+
+    def _start_apply(self, item, job, payload):
+        try:
+            result = self._apply(job, payload)
+        except Exception as e:
+            result = f"Error applying result: {str(e)}"
+
+        if self._scheduler is not None:
+            on_progress = None
+            if self._on_progress:
+                on_progress = lambda done, total, item=item: self._on_progress(item, done, total)
+            self._scheduler.submit(result, lambda r, item=item, job=job: self._applied(item, job, r),
+                                   on_progress, lane=self.lane)
+        else:
+            # Without a scheduler, run a generator apply to completion right away
+            while isinstance(result, types.GeneratorType):
+                try:
+                    next(result)
+                except StopIteration as stop:
+                    result = stop.value
+                except Exception as e:
+                    result = f"Error applying result: {str(e)}"
+            self._applied(item, job, result)
+
+    def _applied(self, item, job, result):
+        self._in_flight -= 1
+        self._finish_job(item, job, result)
+        self._check_finished()
+
+    def _finish_job(self, item, job, result):
+        if self._on_job_result:
+            try:
+                self._on_job_result(job, result)
+            except Exception:
+                pass
+        if self._cleanup:
+            try:
+                self._cleanup(job)
+            except Exception:
+                pass
+        self._release(self._costs.pop(id(job), 0))
+        self._report(item, result)
+
+    def _release(self, cost):
+        if self._budget is not None:
+            self._budget.release(cost)
+
+    def _admission_released(self):
+        self._admission_blocked = False
+        self._queue.post(self._dispatch_next)
+
+    def _report(self, item, result):
+        if self._on_result:
+            self._on_result(item, result)
+
+    def _check_finished(self):
+        if self._finished or self._in_flight > 0:
+            return
+        if not self.token.is_cancelled() and self._next_index < len(self._items):
+            return
+        self._finished = True
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        if self._on_finished:
+            self._on_finished(self.token.is_cancelled())
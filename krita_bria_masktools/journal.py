@@ -0,0 +1,146 @@
+"""
+Crash-safe job journal for Bria Mask Tools.
+Each batch and each of its items is recorded in a small SQLite database with the item's
+fingerprint (a digest of the exported pixels), its state and where its downloaded result is
+kept. Downloaded results are stored next to the database, outside the session scratch space,
+so they survive a crash. When the same batch is started again, finished items are skipped,
+downloaded-but-unapplied results are re-applied without a new request, and only items that
+failed or never got a result are submitted again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+SUBMITTED = "submitted"
+DOWNLOADED = "downloaded"
+APPLIED = "applied"
+FAILED = "failed"
+
+# Unfinished batches (and their stored results) are dropped after this long
+BATCH_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE NOT NULL,
+    started REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    batch_id INTEGER NOT NULL REFERENCES batches(id) ON DELETE CASCADE,
+    item_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result_path TEXT,
+    outputs TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (batch_id, item_key)
+);
+"""
+
+
+def fingerprint_file(path, extra=""):
+    """Return a hex digest of a file's bytes plus an optional string (e.g. the job mode)."""
+    digest = hashlib.sha1(extra.encode('utf-8'))
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def batch_key(*parts):
+    """Stable key for a batch from JSON-serializable parts (document, mode, node ids...)."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class JobJournal:
+    """SQLite-backed journal; safe to use from the GUI thread and worker threads."""
+
+    def __init__(self, directory):
+        import sqlite3  # Only needed once a batch runs, not at Krita startup
+        self.directory = directory
+        self.results_dir = os.path.join(directory, "results")
+        os.makedirs(self.results_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, "journal.sqlite3"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        self.prune()
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def begin_batch(self, key):
+        """Return (batch_id, resumed); resumed is True when an unfinished batch with this key exists."""
+        now = time.time()
+        rows = self._execute("SELECT id FROM batches WHERE key = ?", (key,))
+        if rows:
+            self._execute("UPDATE batches SET updated = ? WHERE id = ?", (now, rows[0][0]))
+            return rows[0][0], True
+        self._execute("INSERT INTO batches (key, started, updated) VALUES (?, ?, ?)", (key, now, now))
+        return self._execute("SELECT id FROM batches WHERE key = ?", (key,))[0][0], False
+
+    def lookup(self, batch_id, item_key):
+        """Return the item's record as a dict, or None."""
+        rows = self._execute("SELECT fingerprint, state, result_path, outputs FROM items "
+                             "WHERE batch_id = ? AND item_key = ?", (batch_id, item_key))
+        if not rows:
+            return None
+        fingerprint, state, result_path, outputs = rows[0]
+        return {
+            'fingerprint': fingerprint,
+            'state': state,
+            'result_path': result_path if result_path and os.path.exists(result_path) else None,
+            'outputs': json.loads(outputs) if outputs else [],
+        }
+
+    def record(self, batch_id, item_key, fingerprint, state, result_path=None, outputs=None):
+        """Insert or update an item; result_path and outputs keep their stored value when None."""
+        self._execute(
+            "INSERT INTO items (batch_id, item_key, fingerprint, state, result_path, outputs, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (batch_id, item_key) DO UPDATE SET fingerprint = excluded.fingerprint, "
+            "state = excluded.state, result_path = COALESCE(excluded.result_path, items.result_path), "
+            "outputs = COALESCE(excluded.outputs, items.outputs), updated = excluded.updated",
+            (batch_id, item_key, fingerprint, state, result_path,
+             json.dumps(outputs) if outputs is not None else None, time.time()))
+
+    def result_path(self, batch_id, item_key, suffix):
+        """Path under the journal where an item's downloaded result is kept."""
+        name = hashlib.sha1(item_key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.results_dir, f"{batch_id}_{name}{suffix}")
+
+    def finish_batch(self, batch_id):
+        """Forget a completed batch and delete its stored results."""
+        self._remove_results(batch_id)
+        self._execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+
+    def prune(self, max_age=BATCH_MAX_AGE_SECONDS):
+        """Drop batches that were not touched for max_age seconds."""
+        for (batch_id,) in self._execute("SELECT id FROM batches WHERE updated < ?", (time.time() - max_age,)):
+            self.finish_batch(batch_id)
+
+    def _remove_results(self, batch_id):
+        prefix = f"{batch_id}_"
+        for name in os.listdir(self.results_dir):
+            if name.startswith(prefix):
+                path = os.path.join(self.results_dir, name)
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def close(self):
+        """Close the database at exit, which folds the write-ahead log back into it."""
+        with self._lock:
+            self._db.close()
@@ -1,30 +1,67 @@
 import os
 import sys
-import ssl
 import json
 import time
-import tempfile
-import urllib.request
-import urllib.error
 import threading
-import multiprocessing
-import subprocess
 import uuid
-import zipfile
-import shutil
-import base64
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import types
+import atexit
+# Network, archive and encoding modules (ssl, urllib, zipfile, base64, ...) are imported inside
+# the functions that use them so loading the plugin adds little to Krita's startup time
 
 import krita  # type: ignore
 from krita import Krita, DockWidgetFactory, DockWidgetFactoryBase, InfoObject, Selection  # type: ignore
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QPushButton, QLineEdit, QLabel, QDockWidget,
                              QApplication, QCheckBox, QSpinBox, QTextEdit, QProgressDialog,
                              QHBoxLayout, QMessageBox, QGroupBox, QRadioButton, QButtonGroup,
-                             QDialog, QFormLayout, QDialogButtonBox, QComboBox, QSizePolicy, QScrollArea)
-from PyQt5.QtGui import QImage, QClipboard, qRgb
-from PyQt5.QtCore import QRect, Qt
-from .mask_utils import prepare_mask_bytes, qimage_to_bytes, create_transparency_mask_from_qimage, create_selection_mask_from_qimage
+                             QDialog, QFormLayout, QDialogButtonBox, QComboBox, QSizePolicy, QScrollArea,
+                             QDoubleSpinBox)
+from PyQt5.QtGui import QImage, QClipboard, qRgb, QCursor
+from PyQt5.QtCore import QRect, Qt, QUuid, QStandardPaths, QTimer, QEvent, QPointF
+from .mask_utils import (create_transparency_mask_from_qimage, create_selection_mask_from_qimage,
+                         create_selection_from_qimage, iter_scaled_bands)
+from .mask_analysis import analyze_mask, find_duplicate, union_masks
+from .mask_picker import MaskPickerWidget
+from .mask_morphology import MorphologySettings, postprocess_mask, backend_name
+from . import guided_upsample
+from . import encoder
+from .pixel_convert import pixel_data, write_pixels
+from .mutations import DocumentBatch
+from .fingerprint import LayerFingerprints, sample_digest
+from .label_map import LabelMap, LabelMaps
+from .metrics import MetricsRegistry
+from .atlas import AtlasGroup, ATLAS_MAX_CELL, ATLAS_MAX_SIZE, is_small, max_cell_size, pack
+from . import scratch
+from . import memory
+from .journal import JobJournal, batch_key, fingerprint_file, SUBMITTED, DOWNLOADED, APPLIED, FAILED
+from .resolution_ladder import (DEFAULT_LADDER, REFINE_MATCH_IOU, RungCache, parse_ladder, format_ladder,
+                                proxy_size, describe_timings)
+from .jobs import BatchRunner, JobCancelled, MainThreadQueue, ResultStream, RESERVED_INTERACTIVE_WORKERS
+from .import_scheduler import ImportScheduler, DEFAULT_FRAME_BUDGET_MS, WAIT, INTERACTIVE, BULK
+from . import startup
+from .prefetch import IdleTracker, RequestBudget, DEFAULT_IDLE_SECONDS, DEFAULT_HOURLY_LIMIT, POLL_INTERVAL_MS
+
+# Concurrent downloads for a mask_generator response that lists one URL per mask
+MASK_DOWNLOAD_WORKERS = 6
+# Size limits for downloaded masks: one file, and all entries of a masks ZIP inflated
+MAX_MASK_FILE_BYTES = 50 * 1024 * 1024
+MAX_MASKS_ZIP_BYTES = 100 * 1024 * 1024
+
+# Label of each mode in the metrics
+MODE_METRIC_NAMES = {0: "remove_background", 1: "generate_masks"}
+
+# Krita node type created for each mask import mode
+MASK_NODE_TYPES = {
+    "layers": "paintlayer",
+    "transparency": "transparencymask",
+    "selection": "selectionmask",
+    "labels": None,  # One label map per layer, no nodes
+}
+
+# Widget classes Krita draws the canvas with (OpenGL and software rendering)
+CANVAS_WIDGET_CLASSES = ("KisOpenGLCanvas2", "KisQPainterCanvas")
+
 
 class BriaAISettingsDialog(QDialog):
     """Settings dialog for BriaAI API configuration"""
@@ -61,10 +98,53 @@ class BriaAISettingsDialog(QDialog):
 
 class BriaMaskTools(QDockWidget):
     def __init__(self):
+        started = time.perf_counter()
         try:
             super().__init__()
             self.setWindowTitle("Bria Mask Tools")
 
+            # Worker threads hand Krita API calls back to the GUI thread through this queue
+            self._gui_thread = threading.current_thread()
+            self._main_queue = MainThreadQueue(self)
+            self._import_scheduler = ImportScheduler(parent=self)
+            self._runner = None              # Bulk lane: batches of selected layers
+            self._interactive_runner = None  # Interactive lane: the active layer, refinements
+            self._memory_budget = None       # Shared by both lanes, see memory_budget()
+            self._rung_cache = RungCache()
+            self._fingerprints = LayerFingerprints()
+            # Label-map imports by layer node id, and the canvas widgets watched for edits and click-to-select
+            self._label_maps = LabelMaps()
+            self._canvas_widgets = []
+            # Opt-in speculative mask request for the idle active layer
+            self._prefetch_timer = None
+            self._prefetch_runner = None
+            self._prefetch_node_id = None
+            self._prefetch_state = None  # Sampled content digest of the layer being prefetched
+            self._prefetch_pending = {}  # node id -> Event set when its prefetch request is over
+            self._prefetched = {}        # node id -> (sampled digest, rung cache key) of prefetched masks
+            self._prefetch_idle = IdleTracker()
+            self._prefetch_budget = RequestBudget()
+            self.scratch = scratch.session()
+            self._journal = None
+            # Latency, transfer and cache figures, accumulated across sessions
+            self.metrics = MetricsRegistry(self.data_directory())
+            # Widgets are built when the docker is first shown, so a hidden docker costs nothing at launch
+            self._ui_built = False
+            self._settings_built = False       # Settings group, on first expand
+            self._debug_buttons_built = False  # Debug and test buttons, on first use of debug mode
+        except Exception as e:
+            import traceback
+            QMessageBox.critical(None, "Error",
+                                f"Failed to initialize Bria Mask Tools:\n{str(e)}\n\n{traceback.format_exc()}")
+            raise
+        startup.record("docker", started)
+        startup.check_budget()
+
+    def build_ui(self):
+        """Create the docker's widgets (called once, on first show)"""
+        started = time.perf_counter()
+        self._ui_built = True
+        try:
             widget = QWidget()
             # Main vertical layout with compact margins and spacing
             layout = QVBoxLayout()
@@ -106,7 +186,8 @@ class BriaMaskTools(QDockWidget):
             self.mask_import_combo.addItems([
                 "Selection masks (default)",
                 "Transparency masks",
-                "Separate layers"
+                "Separate layers",
+                "Label map (click to select)"
             ])
             self.mask_import_combo.setCurrentIndex(0)
             self.mask_import_combo.setToolTip("Choose how downloaded masks should be imported into Krita")
@@ -121,6 +202,87 @@ class BriaMaskTools(QDockWidget):
             self.add_to_new_layer_checkbox.setVisible(False)
             layout.addWidget(self.add_to_new_layer_checkbox)
 
+            # Label maps: clicks on the canvas select the object under the cursor
+            self.click_select_checkbox = QCheckBox("Click to select objects")
+            self.click_select_checkbox.setToolTip("While checked, a click on the canvas selects the object under "
+                                                  "the cursor from the layer's label map instead of painting")
+            self.click_select_checkbox.setVisible(False)
+            layout.addWidget(self.click_select_checkbox)
+
+            # Lazy materialization: preview thumbnails and/or drop small fragments
+            self.pick_masks_checkbox = QCheckBox("Preview and pick masks")
+            self.pick_masks_checkbox.setToolTip("Show thumbnails first and only import the masks you tick")
+            self.pick_masks_checkbox.setVisible(False)
+            layout.addWidget(self.pick_masks_checkbox)
+
+            self.progressive_checkbox = QCheckBox("Progressive (preview small, refine picked)")
+            self.progressive_checkbox.setToolTip("Preview masks at the first ladder size; importing the picked "
+                                                 "masks requests them again at the next size")
+            self.progressive_checkbox.setVisible(False)
+            layout.addWidget(self.progressive_checkbox)
+
+            self.min_area_widget = QWidget()
+            min_area_layout = QHBoxLayout()
+            min_area_layout.setContentsMargins(0, 0, 0, 0)
+            self.min_area_widget.setLayout(min_area_layout)
+            min_area_layout.addWidget(QLabel("Min area %"))
+            self.min_area_spinbox = QDoubleSpinBox()
+            self.min_area_spinbox.setRange(0.0, 100.0)
+            self.min_area_spinbox.setDecimals(2)
+            self.min_area_spinbox.setSingleStep(0.1)
+            self.min_area_spinbox.setValue(0.0)
+            self.min_area_spinbox.setToolTip("Skip masks covering less than this share of the layer")
+            min_area_layout.addWidget(self.min_area_spinbox)
+            self.min_area_widget.setVisible(False)
+            layout.addWidget(self.min_area_widget)
+
+            # Near-duplicate merging (e.g. a person and their torso returned as separate masks)
+            self.dedupe_widget = QWidget()
+            dedupe_layout = QHBoxLayout()
+            dedupe_layout.setContentsMargins(0, 0, 0, 0)
+            self.dedupe_widget.setLayout(dedupe_layout)
+            self.dedupe_checkbox = QCheckBox("Merge duplicates, IoU ≥")
+            self.dedupe_checkbox.setChecked(True)
+            self.dedupe_checkbox.setToolTip("Merge masks that overlap another mask by at least this much")
+            dedupe_layout.addWidget(self.dedupe_checkbox)
+            self.dedupe_spinbox = QDoubleSpinBox()
+            self.dedupe_spinbox.setRange(0.1, 1.0)
+            self.dedupe_spinbox.setDecimals(2)
+            self.dedupe_spinbox.setSingleStep(0.05)
+            self.dedupe_spinbox.setValue(0.85)
+            dedupe_layout.addWidget(self.dedupe_spinbox)
+            self.dedupe_widget.setVisible(False)
+            layout.addWidget(self.dedupe_widget)
+
+            # Clean-up applied to every mask before it is scaled to the document
+            self.cleanup_group = QGroupBox("Mask Cleanup")
+            cleanup_layout = QFormLayout()
+            self.cleanup_group.setLayout(cleanup_layout)
+            self.grow_spinbox = QSpinBox()
+            self.grow_spinbox.setRange(0, 500)
+            self.grow_spinbox.setSuffix(" px")
+            cleanup_layout.addRow("Grow", self.grow_spinbox)
+            self.shrink_spinbox = QSpinBox()
+            self.shrink_spinbox.setRange(0, 500)
+            self.shrink_spinbox.setSuffix(" px")
+            cleanup_layout.addRow("Shrink", self.shrink_spinbox)
+            self.feather_spinbox = QDoubleSpinBox()
+            self.feather_spinbox.setRange(0.0, 200.0)
+            self.feather_spinbox.setDecimals(1)
+            self.feather_spinbox.setSuffix(" px")
+            cleanup_layout.addRow("Feather", self.feather_spinbox)
+            self.fill_holes_checkbox = QCheckBox("Fill holes")
+            cleanup_layout.addRow(self.fill_holes_checkbox)
+            self.edge_aware_checkbox = QCheckBox("Edge-aware upscale")
+            if guided_upsample.is_available():
+                self.edge_aware_checkbox.setToolTip("Snap upscaled mask edges to the full-resolution layer")
+            else:
+                self.edge_aware_checkbox.setEnabled(False)
+                self.edge_aware_checkbox.setToolTip("Requires NumPy")
+            cleanup_layout.addRow(self.edge_aware_checkbox)
+            self.cleanup_group.setVisible(False)
+            layout.addWidget(self.cleanup_group)
+
             # Connect mode changes to update batch checkbox state
             self.mode_button_group.buttonClicked.connect(self.on_mode_changed)
 
@@ -139,47 +301,10 @@ class BriaMaskTools(QDockWidget):
 
             layout.addLayout(batch_layout)
 
-            self.advanced_group = QGroupBox("Settings")
-            advanced_layout = QVBoxLayout()
-            self.advanced_group.setLayout(advanced_layout)
-            self.advanced_group.setVisible(False)
-
-            thread_layout = QHBoxLayout()
-            self.auto_thread_checkbox = QCheckBox("Threads (AUTO)")
-            self.auto_thread_checkbox.setChecked(True)  # Default is auto
-            self.auto_thread_checkbox.stateChanged.connect(self.toggle_thread_count)
-            thread_layout.addWidget(self.auto_thread_checkbox)
-
-            self.thread_count_spinbox = QSpinBox()
-            self.thread_count_spinbox.setMinimum(1)
-            self.thread_count_spinbox.setValue(os.cpu_count() or multiprocessing.cpu_count())
-            self.thread_count_spinbox.setVisible(False)
-            thread_layout.addWidget(self.thread_count_spinbox)
-
-            advanced_layout.addLayout(thread_layout)
-
-            # Row for API Key and Debug Mode
-            row_layout = QHBoxLayout()
-            self.api_key_button = QPushButton("API Key")
-            self.api_key_button.clicked.connect(self.show_settings_dialog)
-            row_layout.addWidget(self.api_key_button)
-            self.debug_checkbox = QCheckBox("Debug Mode")
-            self.debug_checkbox.stateChanged.connect(self.toggle_debug_mode)
-            row_layout.addWidget(self.debug_checkbox)
-            advanced_layout.addLayout(row_layout)
-
-            # Test mask buttons (visible in debug mode)
-            test_layout = QHBoxLayout()
-            self.test_transparency_button = QPushButton("Test Transparency Mask")
-            self.test_transparency_button.clicked.connect(self.test_transparency_mask)
-            test_layout.addWidget(self.test_transparency_button)
-
-            self.test_selection_button = QPushButton("Test Selection Mask")
-            self.test_selection_button.clicked.connect(self.test_selection_mask)
-            test_layout.addWidget(self.test_selection_button)
-            advanced_layout.addLayout(test_layout)
-
-            layout.addWidget(self.advanced_group)
+            # The Settings group is built the first time it is expanded
+            self._settings_layout = QVBoxLayout()
+            self._settings_layout.setContentsMargins(0, 0, 0, 0)
+            layout.addLayout(self._settings_layout)
 
             button_layout = QHBoxLayout()
             # Compact button-layout spacing
@@ -189,18 +314,49 @@ class BriaMaskTools(QDockWidget):
             self.action_button.clicked.connect(self.remove_background)
             button_layout.addWidget(self.action_button)
 
-            self.open_temp_dir_button = QPushButton("Open Dir")
-            self.open_temp_dir_button.clicked.connect(self.open_temp_directory)
-            self.open_temp_dir_button.setVisible(False)
-            button_layout.addWidget(self.open_temp_dir_button)
-
-            self.copy_text_button = QPushButton("Copy Text")
-            self.copy_text_button.clicked.connect(self.copy_status_text)
-            self.copy_text_button.setVisible(False)
-            button_layout.addWidget(self.copy_text_button)
+            # Pauses exporting new layers of a running batch; the active layer can still be processed
+            self.pause_button = QPushButton("Pause Batch")
+            self.pause_button.clicked.connect(self.toggle_batch_pause)
+            self.pause_button.setVisible(False)
+            button_layout.addWidget(self.pause_button)
 
+            # Debug buttons are added the first time debug mode is turned on
+            self._button_layout = button_layout
             layout.addLayout(button_layout)
 
+            self.mask_picker = MaskPickerWidget()
+            self.mask_picker.import_requested.connect(self.import_picked_masks)
+            self.mask_picker.discarded.connect(self.release_picked_masks)
+            layout.addWidget(self.mask_picker)
+
+            # Collapsible performance figures, kept across sessions
+            self.stats_group = QGroupBox("Performance Stats")
+            self.stats_group.setCheckable(True)
+            self.stats_group.setChecked(False)
+            stats_layout = QVBoxLayout()
+            self.stats_group.setLayout(stats_layout)
+            self.stats_widget = QWidget()
+            stats_inner = QVBoxLayout(self.stats_widget)
+            stats_inner.setContentsMargins(0, 0, 0, 0)
+            self.stats_label = QLabel()
+            self.stats_label.setWordWrap(True)
+            self.stats_label.setTextInteractionFlags(Qt.TextSelectableByMouse)  # type: ignore
+            stats_inner.addWidget(self.stats_label)
+            stats_buttons = QHBoxLayout()
+            self.export_stats_button = QPushButton("Export Prometheus...")
+            self.export_stats_button.setToolTip("Write the metrics as a Prometheus text file; "
+                                                "it is rewritten after every run")
+            self.export_stats_button.clicked.connect(self.export_metrics)
+            stats_buttons.addWidget(self.export_stats_button)
+            self.reset_stats_button = QPushButton("Reset")
+            self.reset_stats_button.clicked.connect(self.reset_metrics)
+            stats_buttons.addWidget(self.reset_stats_button)
+            stats_inner.addLayout(stats_buttons)
+            stats_layout.addWidget(self.stats_widget)
+            self.stats_widget.setVisible(False)
+            self.stats_group.toggled.connect(self.toggle_stats_panel)
+            layout.addWidget(self.stats_group)
+
             self.status_label = QTextEdit()
             self.status_label.setReadOnly(True)
             self.status_label.setLineWrapMode(QTextEdit.WidgetWidth)
@@ -237,22 +393,145 @@ class BriaMaskTools(QDockWidget):
             # Initialize UI state based on current mode (after all controls are set up)
             self.on_mode_changed()
 
-            # Register this widget with the current canvas to receive canvasChanged events
-            try:
-                window = Krita.instance().activeWindow()
-                view = window.activeView() if window else None
-                canvas = view.canvas() if view else None
-                if canvas:
-                    canvas.addObserver(self)
-                    self._canvas = canvas
-            except Exception:
-                pass
-
         except Exception as e:
             import traceback
             QMessageBox.critical(None, "Error",
                                 f"Failed to initialize Bria Mask Tools:\n{str(e)}\n\n{traceback.format_exc()}")
             raise
+        startup.record("ui", started)
+
+    def build_settings_group(self):
+        """Create the Settings group (called once, when it is first expanded)"""
+        self._settings_built = True
+        self.advanced_group = QGroupBox("Settings")
+        advanced_layout = QVBoxLayout()
+        self.advanced_group.setLayout(advanced_layout)
+
+        thread_layout = QHBoxLayout()
+        self.auto_thread_checkbox = QCheckBox("Threads (AUTO)")
+        self.auto_thread_checkbox.setChecked(True)  # Default is auto
+        self.auto_thread_checkbox.stateChanged.connect(self.toggle_thread_count)
+        thread_layout.addWidget(self.auto_thread_checkbox)
+
+        self.thread_count_spinbox = QSpinBox()
+        self.thread_count_spinbox.setMinimum(1)
+        self.thread_count_spinbox.setValue(os.cpu_count() or 1)
+        self.thread_count_spinbox.setVisible(False)
+        thread_layout.addWidget(self.thread_count_spinbox)
+
+        advanced_layout.addLayout(thread_layout)
+
+        # Cap on pixel data held by in-flight jobs; Auto derives it from available memory
+        memory_layout = QHBoxLayout()
+        memory_layout.addWidget(QLabel("Memory budget (MiB)"))
+        self.memory_budget_spinbox = QSpinBox()
+        self.memory_budget_spinbox.setRange(0, memory.MAX_BUDGET_BYTES // (1024 * 1024))
+        self.memory_budget_spinbox.setSingleStep(256)
+        self.memory_budget_spinbox.setSpecialValueText("Auto")
+        self.memory_budget_spinbox.setValue(0)
+        self.memory_budget_spinbox.setToolTip("New layers are exported only while the estimated memory of "
+                                              "running jobs stays below this")
+        memory_layout.addWidget(self.memory_budget_spinbox)
+        advanced_layout.addLayout(memory_layout)
+
+        # Small layers of a batch share one request
+        self.atlas_checkbox = QCheckBox("Pack small layers into one request")
+        self.atlas_checkbox.setChecked(True)
+        self.atlas_checkbox.setToolTip(f"Batch layers up to {ATLAS_MAX_CELL}px (a quarter of the largest rung for "
+                                       "masks) are combined into one padded image, sent once and sliced back per layer")
+        self.atlas_checkbox.setVisible(False)
+        advanced_layout.addWidget(self.atlas_checkbox)
+
+        # Time budget per event-loop slice while importing masks
+        budget_layout = QHBoxLayout()
+        budget_layout.addWidget(QLabel("Import frame budget (ms)"))
+        self.frame_budget_spinbox = QSpinBox()
+        self.frame_budget_spinbox.setRange(1, 200)
+        self.frame_budget_spinbox.setValue(DEFAULT_FRAME_BUDGET_MS)
+        self.frame_budget_spinbox.setToolTip("Maximum time spent importing masks before Krita gets to redraw")
+        self.frame_budget_spinbox.valueChanged.connect(self._import_scheduler.set_frame_budget)
+        budget_layout.addWidget(self.frame_budget_spinbox)
+        advanced_layout.addLayout(budget_layout)
+
+        # Proxy sizes sent to the mask generator, smallest first
+        ladder_layout = QHBoxLayout()
+        ladder_layout.addWidget(QLabel("Mask resolution ladder (px)"))
+        self.ladder_edit = QLineEdit(format_ladder(DEFAULT_LADDER))
+        self.ladder_edit.setToolTip("Comma-separated long-side sizes; the largest is used unless "
+                                    "progressive mode is on")
+        ladder_layout.addWidget(self.ladder_edit)
+        advanced_layout.addLayout(ladder_layout)
+
+        # Upload size budget; the codec and quality are picked per layer to fit it
+        upload_layout = QHBoxLayout()
+        upload_layout.addWidget(QLabel("Upload budget (KiB/MP)"))
+        self.upload_budget_spinbox = QSpinBox()
+        self.upload_budget_spinbox.setRange(encoder.MIN_BUDGET_KB_PER_MP, encoder.MAX_BUDGET_KB_PER_MP)
+        self.upload_budget_spinbox.setSingleStep(128)
+        self.upload_budget_spinbox.setValue(encoder.DEFAULT_BUDGET_KB_PER_MP)
+        self.upload_budget_spinbox.setToolTip("Flat artwork is sent as PNG and photos as JPEG at the highest "
+                                              "quality that fits this size per megapixel")
+        upload_layout.addWidget(self.upload_budget_spinbox)
+        advanced_layout.addLayout(upload_layout)
+
+        # Speculative mask request for the active layer once it has stayed active for a while
+        prefetch_layout = QHBoxLayout()
+        self.prefetch_checkbox = QCheckBox("Prefetch masks after idle (s)")
+        self.prefetch_checkbox.setToolTip("Send the mask request for the active layer in the background, "
+                                          "so Generate imports without waiting for the server")
+        self.prefetch_checkbox.stateChanged.connect(self.toggle_prefetch)
+        prefetch_layout.addWidget(self.prefetch_checkbox)
+        self.prefetch_idle_spinbox = QSpinBox()
+        self.prefetch_idle_spinbox.setRange(1, 60)
+        self.prefetch_idle_spinbox.setValue(DEFAULT_IDLE_SECONDS)
+        prefetch_layout.addWidget(self.prefetch_idle_spinbox)
+        self.prefetch_limit_spinbox = QSpinBox()
+        self.prefetch_limit_spinbox.setRange(1, 100)
+        self.prefetch_limit_spinbox.setSuffix(" /h")
+        self.prefetch_limit_spinbox.setValue(DEFAULT_HOURLY_LIMIT)
+        self.prefetch_limit_spinbox.setToolTip("Maximum speculative requests per hour")
+        prefetch_layout.addWidget(self.prefetch_limit_spinbox)
+        advanced_layout.addLayout(prefetch_layout)
+
+        # Row for API Key and Debug Mode
+        row_layout = QHBoxLayout()
+        self.api_key_button = QPushButton("API Key")
+        self.api_key_button.clicked.connect(self.show_settings_dialog)
+        row_layout.addWidget(self.api_key_button)
+        self.debug_checkbox = QCheckBox("Debug Mode")
+        self.debug_checkbox.stateChanged.connect(self.toggle_debug_mode)
+        row_layout.addWidget(self.debug_checkbox)
+        self.profiling_checkbox = QCheckBox("Profile Jobs")
+        self.profiling_checkbox.setToolTip("Write CPU profiles and an allocation summary for every job "
+                                           "to the temp directory")
+        row_layout.addWidget(self.profiling_checkbox)
+        advanced_layout.addLayout(row_layout)
+
+        # Test mask buttons (visible in debug mode), added by build_debug_buttons
+        self._test_layout = QHBoxLayout()
+        advanced_layout.addLayout(self._test_layout)
+
+        self._settings_layout.addWidget(self.advanced_group)
+
+    def build_debug_buttons(self):
+        """Create the debug and test buttons (called once, when debug mode is first turned on)"""
+        self._debug_buttons_built = True
+        self.open_temp_dir_button = QPushButton("Open Dir")
+        self.open_temp_dir_button.clicked.connect(self.open_temp_directory)
+        self._button_layout.addWidget(self.open_temp_dir_button)
+
+        self.copy_text_button = QPushButton("Copy Text")
+        self.copy_text_button.clicked.connect(self.copy_status_text)
+        self._button_layout.addWidget(self.copy_text_button)
+
+        # Test mask buttons (visible in debug mode)
+        self.test_transparency_button = QPushButton("Test Transparency Mask")
+        self.test_transparency_button.clicked.connect(self.test_transparency_mask)
+        self._test_layout.addWidget(self.test_transparency_button)
+
+        self.test_selection_button = QPushButton("Test Selection Mask")
+        self.test_selection_button.clicked.connect(self.test_selection_mask)
+        self._test_layout.addWidget(self.test_selection_button)
 
     def create_settings_menu(self):
         """Create menu action for BriaAI settings"""
@@ -264,6 +543,11 @@ class BriaMaskTools(QDockWidget):
 
         # Show or hide mask import selector based on mode
         self.mask_import_combo.setVisible(mode == 1)
+        self.pick_masks_checkbox.setVisible(mode == 1)
+        self.progressive_checkbox.setVisible(mode == 1)
+        self.min_area_widget.setVisible(mode == 1)
+        self.dedupe_widget.setVisible(mode == 1)
+        self.cleanup_group.setVisible(mode == 1)
         # Enable batch for all modes
         self.batch_checkbox.setEnabled(True)
 
@@ -282,8 +566,10 @@ class BriaMaskTools(QDockWidget):
         if self.generate_mask_radio.isChecked():
             idx = self.mask_import_combo.currentIndex()
             self.add_to_new_layer_checkbox.setVisible(idx == 0)
+            self.click_select_checkbox.setVisible(idx == 3)
         else:
             self.add_to_new_layer_checkbox.setVisible(False)
+            self.click_select_checkbox.setVisible(False)
 
     def show_settings_dialog(self):
         """Show settings dialog for API key configuration"""
@@ -295,9 +581,16 @@ class BriaMaskTools(QDockWidget):
 
     def toggle_advanced_options(self):
         is_advanced = self.advanced_checkbox.isChecked()
-        self.advanced_group.setVisible(is_advanced)
+        if is_advanced and not self._settings_built:
+            self.build_settings_group()
+        if self._settings_built:
+            self.advanced_group.setVisible(is_advanced)
         self.toggle_batch_mode()  # Update thread visibility
 
+    def mask_ladder(self):
+        """Proxy sizes from the Settings group, the default ones until it is built; raises ValueError"""
+        return parse_ladder(self.ladder_edit.text()) if self._settings_built else list(DEFAULT_LADDER)
+
     def toggle_thread_count(self):
         self.thread_count_spinbox.setVisible(not self.auto_thread_checkbox.isChecked())
 
@@ -307,28 +600,76 @@ class BriaMaskTools(QDockWidget):
         QMessageBox.information(self, "Copied", "Status text copied to clipboard.", QMessageBox.Ok)
 
     def toggle_batch_mode(self):
+        if not self._settings_built:
+            return
         is_batch = self.batch_checkbox.isChecked()
         is_advanced = self.advanced_checkbox.isChecked()
         self.auto_thread_checkbox.setVisible(is_batch and is_advanced)
         self.thread_count_spinbox.setVisible(is_batch and is_advanced and not self.auto_thread_checkbox.isChecked())
+        self.atlas_checkbox.setVisible(is_batch and is_advanced)
+
+    def toggle_stats_panel(self, expanded):
+        self.stats_widget.setVisible(expanded)
+        if expanded:
+            self.refresh_stats_panel()
+
+    def refresh_stats_panel(self):
+        if self._ui_built and self.stats_group.isChecked():
+            self.stats_label.setText("\n".join(self.metrics.summary()))
+
+    def save_metrics(self):
+        """Persist the metrics after a run and show them in the stats panel (GUI thread)"""
+        try:
+            self.metrics.save()
+        except Exception as e:
+            self.log_error(f"Could not save metrics: {str(e)}")
+        self.refresh_stats_panel()
+
+    def export_metrics(self):
+        """Choose a Prometheus text file for the metrics; it is refreshed whenever they are saved"""
+        from PyQt5.QtWidgets import QFileDialog
+        path, _ = QFileDialog.getSaveFileName(self, "Export Metrics", self.metrics.prometheus_path or
+                                              "bria_masktools.prom", "Prometheus text (*.prom);;All files (*)")
+        if not path:
+            return
+        self.metrics.prometheus_path = path
+        try:
+            self.metrics.save()
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Error exporting metrics: {str(e)}", QMessageBox.Ok)
+
+    def reset_metrics(self):
+        self.metrics.reset()
+        self.save_metrics()
 
     def toggle_debug_mode(self):
         self.update_debug_buttons_visibility()
+        if self.debug_enabled():
+            self.log_error(f"Startup cost: {startup.describe()}")
+
+    def debug_enabled(self):
+        """True in debug mode; its checkbox is in the Settings group, which may not be built yet"""
+        return self._settings_built and self.debug_checkbox.isChecked()
 
     def update_debug_buttons_visibility(self):
         is_advanced = self.advanced_checkbox.isChecked()
-        debug_mode = self.debug_checkbox.isChecked()
+        debug_mode = self.debug_enabled()
+        if debug_mode and not self._debug_buttons_built:
+            self.build_debug_buttons()
+        # Show or hide status log based on debug mode
+        if hasattr(self, 'status_label'):
+            self.status_label.setVisible(is_advanced and debug_mode)
+        if not self._debug_buttons_built:
+            return
         self.open_temp_dir_button.setVisible(is_advanced and debug_mode)
         self.copy_text_button.setVisible(is_advanced and debug_mode)
         # Show test mask buttons only in debug and advanced mode
         self.test_transparency_button.setVisible(is_advanced and debug_mode)
         self.test_selection_button.setVisible(is_advanced and debug_mode)
-        # Show or hide status log based on debug mode
-        if hasattr(self, 'status_label'):
-            self.status_label.setVisible(is_advanced and debug_mode)
 
     def open_temp_directory(self):
-        temp_dir = tempfile.gettempdir()
+        import subprocess
+        temp_dir = self.scratch.directory(memory=True)
         if sys.platform.startswith('darwin'):  # macOS
             subprocess.call(['open', temp_dir])
         elif sys.platform.startswith('win'):  # Windows
@@ -410,7 +751,15 @@ class BriaMaskTools(QDockWidget):
 
     def remove_background(self):
         try:
-            self.status_label.setText("Processing...")
+            # While a batch runs in the bulk lane, the action processes the active layer in the interactive lane
+            bulk = self.batch_checkbox.isChecked() and self._runner is None
+            if not bulk and self._interactive_runner is not None:
+                return  # The active layer is already being processed
+            lane = BULK if bulk else INTERACTIVE
+            # Keep the log of a running batch; a one-off job on the active layer appends to it
+            show_status = self.status_label.append if self._runner is not None else self.status_label.setText
+
+            show_status("Processing...")
 
             start_time = time.time()
 
@@ -423,8 +772,11 @@ class BriaMaskTools(QDockWidget):
             try:
                 progress = QProgressDialog(f"{mode_name}...", "Cancel", 0, 100,
                                           Krita.instance().activeWindow().qwindow())  # type: ignore
-                progress.setWindowModality(Qt.WindowModal)  # type: ignore
+                # Non-modal so the canvas stays usable while requests are in flight
+                progress.setWindowModality(Qt.NonModal)  # type: ignore
                 progress.setMinimumDuration(0)
+                progress.setAutoClose(False)
+                progress.setAutoReset(False)
                 progress.setValue(0)
                 progress.show()
             except Exception as e:
@@ -432,7 +784,7 @@ class BriaMaskTools(QDockWidget):
                 return
 
             # Clear the status_label field
-            self.status_label.setText("Preparing file(s) and request(s)...")
+            show_status("Preparing file(s) and request(s)...")
 
             # Disable UI during processing to prevent re-entrancy issues
             self.action_button.setEnabled(False)
@@ -462,7 +814,7 @@ class BriaMaskTools(QDockWidget):
                 return
 
             # Log API key info in debug mode
-            if self.debug_checkbox and self.debug_checkbox.isChecked():
+            if self.debug_enabled():
                 self.log_error(f"Using API key starting with: {self.api_key[:5]}...")
                 self.log_error(f"API key length: {len(self.api_key)}")
 
@@ -491,56 +843,54 @@ class BriaMaskTools(QDockWidget):
                 self.enable_ui()
                 return
 
-            nodes = [document.activeNode()] if not self.batch_checkbox.isChecked() else view.selectedNodes()
+            nodes = view.selectedNodes() if bulk else [document.activeNode()]
             if not nodes:
                 self.status_label.setText("No active layer or no layers selected")
                 progress.close()
                 self.enable_ui()
                 return
 
-            # Mode validation removed
-            if False:  # Removed mode
-                mask, mask_type = self.detect_mask(document, nodes[0])
-                if not mask:
-                    self.status_label.setText(
-                        "No mask found. Please:\n"
-                        "• Create a selection, or\n"
-                        "• Add a mask to your layer, or\n"
-                        "• Select both image and mask layers")
-                    progress.close()
-                    self.enable_ui()
-                    return
-
-            # Check if we're on a Unix-like system (macOS or Linux)
-            if sys.platform.startswith('darwin') or sys.platform.startswith('linux'):
-                # Set the SSL certificate file path for macOS and Linux
-                cert_file = '/etc/ssl/cert.pem'
-
-                # Check if the certificate file exists
-                if os.path.exists(cert_file):
-                    os.environ['SSL_CERT_FILE'] = cert_file
-                else:
-                    self.status_label.setText(f"Warning: Certificate file {cert_file} not found.")
-
+            # One SSL context per session; the certificate bundle is configured on first use
             try:
-                context = ssl.create_default_context()
+                from . import net
+                context, cert_warning = net.session_ssl_context()
+                if cert_warning:
+                    self.status_label.setText(cert_warning)
             except Exception as e:
                 self.status_label.setText(f"Error creating SSL context: {str(e)}")
                 progress.close()
                 self.enable_ui()
                 return
 
+            # Journal the batch so a rerun after a crash only resubmits what did not finish
+            batch_id = self.begin_journal_batch(document, nodes, mode)
+
+            # Small layers are packed into atlases, one request each
+            items = nodes
+            if bulk and (not self._settings_built or self.atlas_checkbox.isChecked()):
+                items = self.plan_atlases(nodes, mode)
+
             # Setup for error handling
             processed_count = 0
             success_count = 0
             total_count = len(nodes)
             error_messages = []
+            first_mask_ms = None
 
             # Determine max_workers based on user selection
             if self.advanced_checkbox.isChecked() and not self.auto_thread_checkbox.isChecked():
                 max_workers = self.thread_count_spinbox.value()
             else:
-                max_workers = os.cpu_count() or multiprocessing.cpu_count()
+                max_workers = os.cpu_count() or 1
+            if bulk and max_workers > RESERVED_INTERACTIVE_WORKERS:
+                # Leave workers free for one-off jobs on the active layer
+                max_workers -= RESERVED_INTERACTIVE_WORKERS
+
+            # Exports wait while the jobs in flight of both lanes would exceed the memory budget
+            budget = self.memory_budget()
+
+            # Node inserts, pixel writes and visibility changes of the whole batch end in one refresh
+            mutations = DocumentBatch(document, log_error=self.log_error)
 
             # Set batch mode
             try:
@@ -551,46 +901,124 @@ class BriaMaskTools(QDockWidget):
 
             progress.setValue(10)
 
-            # Process without threading to avoid QThread issues
-            for node in nodes:
-                try:
-                    result = self.process_node(node, self.api_key, document, context, mode)
+            api_key = self.api_key
+
+            # Profiling mode: tracemalloc runs until the run finishes, each job is profiled on its own
+            profiled = self._settings_built and self.profiling_checkbox.isChecked()
+            if profiled:
+                from . import profiling  # Only loaded in profiling mode
+                profiling.start_tracing()
+
+            def on_result(item, result):
+                nonlocal processed_count, success_count
+                results = [result]
+                if isinstance(item, AtlasGroup):
+                    # One result per layer; layers that never got their own report the atlas result
+                    results = item.results + [result] * (len(item.nodes) - len(item.results))
+                    if item.density:
+                        self.status_label.append(f"Atlas of {len(item.nodes)} layers: {item.density:.0%} packing "
+                                                 f"density, 1 request instead of {len(item.nodes)}")
+                for result in results:
                     processed_count += 1
-                    if not result.startswith("Error"):
+                    if not result.startswith("Error") and result != "Cancelled":
                         success_count += 1
-                    else:
+                    elif result.startswith("Error"):
                         error_messages.append(result)
                     self.status_label.append(f"Processed {processed_count}/{total_count}: {result}")
-                    progress.setValue(10 + int(90 * processed_count / total_count))
-                except Exception as e:
-                    processed_count += 1
-                    error_msg = f"Error processing node: {str(e)}"
-                    error_messages.append(error_msg)
-                finally:
-                    pass  # Removed processEvents to prevent re-entrancy issues
-
-            # Unset batch mode
-            try:
-                document.setBatchmode(False)
-            except:
-                pass
-
-            # End timing the process
-            end_time = time.time()
+                progress.setValue(10 + int(90 * processed_count / total_count))
+
+            def on_progress(node, done, total):
+                nonlocal first_mask_ms
+                if first_mask_ms is None:
+                    # Time-to-first-mask: what the user perceives as latency
+                    first_mask_ms = int((time.time() - start_time) * 1000)
+                # Incremental progress while the masks of one layer are imported slice by slice
+                fraction = (processed_count + done / max(total, 1)) / total_count
+                progress.setValue(10 + int(90 * fraction))
+                progress.setLabelText(f"{mode_name}... importing mask {done}/{total}")
+
+            def on_finished(cancelled):
+                if bulk:
+                    self._runner = None
+                    self.pause_button.setVisible(False)
+                else:
+                    self._interactive_runner = None
+                mutations.commit()
+                if profiled:
+                    profiling.stop_tracing()
 
-            # Calculate the total time taken in milliseconds
-            total_time_ms = int((end_time - start_time) * 1000)
+                # Unset batch mode unless the other lane is still working on the document
+                if self._runner is None and self._interactive_runner is None:
+                    try:
+                        document.setBatchmode(False)
+                    except:
+                        pass
 
-            # Final status update
-            final_status = f"Completed. Processed {success_count}/{total_count} successfully. ({total_time_ms}ms)"
-            if error_messages:
-                final_status += f"\nErrors:\n" + "\n".join(error_messages)
+                # End timing the process
+                end_time = time.time()
+
+                # Calculate the total time taken in milliseconds
+                total_time_ms = int((end_time - start_time) * 1000)
+
+                # Final status update
+                final_status = "Cancelled." if cancelled else "Completed."
+                final_status += f" Processed {success_count}/{total_count} successfully. ({total_time_ms}ms)"
+                if first_mask_ms is not None:
+                    final_status += f"\nFirst mask imported after {first_mask_ms}ms"
+                if self.debug_enabled():
+                    final_status += f"\nLongest import slice: {self._import_scheduler.max_slice_ms:.1f}ms"
+                    final_status += (f"\nDocument changes: {mutations.applied}, "
+                                     f"projection refreshes: {mutations.refreshes}")
+                    final_status += f"\nMemory: {budget.describe()}"
+                    scratch_files, scratch_bytes = self.scratch.usage()
+                    final_status += (f"\nScratch space: {scratch_files} files, "
+                                     f"{scratch_bytes / (1024 * 1024):.1f} MiB")
+                if error_messages:
+                    final_status += f"\nErrors:\n" + "\n".join(error_messages)
+
+                self.status_label.append(final_status)
+                if batch_id is not None and not cancelled and not error_messages:
+                    self._journal.finish_batch(batch_id)
+                self.save_metrics()
+                progress.setValue(100)
+                progress.close()
 
-            self.status_label.append(final_status)
-            progress.setValue(100)
-            progress.close()
+                # Re-enable UI after processing
+                self.enable_ui()
 
-            # Re-enable UI after processing
+            # Krita calls stay on the GUI thread; network and decode run on the worker pool
+            stages = (lambda node: self.prepare_node(node, document, mode, batch_id, mutations),
+                      lambda job, token: self.request_node(job, api_key, context, token),
+                      lambda job, payload: self.apply_node(job, payload, document),
+                      self.cleanup_job)
+            if profiled:
+                stages = self.profiled_stages(*stages)
+            prepare, work, apply, cleanup = stages
+            runner = BatchRunner(
+                self._main_queue, items,
+                prepare=prepare,
+                work=work,
+                apply=apply,
+                cleanup=cleanup,
+                on_result=on_result,
+                on_finished=on_finished,
+                max_workers=min(max_workers, len(items)),
+                scheduler=self._import_scheduler,
+                on_progress=on_progress,
+                on_job_result=self.record_job_result,
+                budget=budget,
+                estimate=lambda item: self.estimate_job_bytes(item, mode),
+                lane=lane)
+            if bulk:
+                self._runner = runner
+                self.pause_button.setText("Pause Batch")
+                self.pause_button.setVisible(True)
+            else:
+                self._interactive_runner = runner
+            self._import_scheduler.max_slice_ms = 0.0
+            progress.canceled.connect(runner.cancel)
+            runner.start()
+            # A running batch leaves the action available for the active layer
             self.enable_ui()
         except Exception as e:
             import traceback
@@ -602,51 +1030,658 @@ class BriaMaskTools(QDockWidget):
                 pass
 
             # Re-enable UI after error
+            if bulk:
+                self._runner = None
+            else:
+                self._interactive_runner = None
             self.enable_ui()
 
-    def process_node(self, node, api_key, document, context, mode):
-        """Process node based on selected mode"""
-        if mode == 0:  # Remove Background
-            return self.process_background_removal(node, api_key, document, context)
-        elif mode == 1:  # Generate Mask
-            return self.process_mask_generation(node, api_key, document, context)
-
-    def process_background_removal(self, node, api_key, document, context):
-        """Process standard background removal"""
-        # Prepare the temporary file path
-        temp_dir = tempfile.gettempdir()
+    # ------------------------------------------------------------
+    # Profiling mode: cProfile and tracemalloc per job
+    # ------------------------------------------------------------
+    def profiled_stages(self, prepare, work, apply, cleanup):
+        """Wrap a runner's stages so every job is profiled and its report written at cleanup"""
+        from . import profiling
+        directory = os.path.join(self.scratch.directory(memory=True), "profiles")
+
+        def profiled_prepare(item):
+            name = item.name() if hasattr(item, 'name') else f"atlas of {len(item.nodes)} layers"
+            profiler = profiling.JobProfiler(directory, name)
+            with profiler.stage("prepare"):
+                job = prepare(item)
+            if isinstance(job, dict):
+                job['profiler'] = profiler
+            else:
+                self.write_profile(profiler)
+            return job
+
+        def profiled_work(job, token):
+            with job['profiler'].stage("work"):
+                return work(job, token)
+
+        def profiled_apply(job, payload):
+            profiler = job['profiler']
+            with profiler.stage("apply"):
+                result = apply(job, payload)
+            return profiler.steps(result, "apply")
+
+        def profiled_cleanup(job):
+            profiler = job.pop('profiler', None)
+            if profiler is not None:
+                self.write_profile(profiler)
+            cleanup(job)
+
+        return profiled_prepare, profiled_work, profiled_apply, profiled_cleanup
+
+    def write_profile(self, profiler):
+        try:
+            path = profiler.write()
+        except Exception as e:
+            self.log_error(f"Could not write profile for {profiler.name}: {str(e)}")
+            return
+        self.status_label.append(f"Profile for {profiler.name}: {path}")
+
+    # ------------------------------------------------------------
+    # Speculative prefetch: mask request for the idle active layer
+    # ------------------------------------------------------------
+    def toggle_prefetch(self):
+        """Watch the active layer while prefetch is enabled and the docker is visible"""
+        enabled = self._settings_built and self.prefetch_checkbox.isChecked() and self.isVisible()
+        if enabled:
+            if self._prefetch_timer is None:
+                self._prefetch_timer = QTimer(self)
+                self._prefetch_timer.setInterval(POLL_INTERVAL_MS)
+                self._prefetch_timer.timeout.connect(self.poll_prefetch)
+            self._prefetch_timer.start()
+            return
+        if self._prefetch_timer is not None:
+            self._prefetch_timer.stop()
+        self._prefetch_idle.update(None)
+        if self._prefetch_runner is not None:
+            self._prefetch_runner.cancel()
+
+    def poll_prefetch(self):
+        """Start a speculative mask request once the active layer has been idle long enough (GUI timer)"""
+        try:
+            document = Krita.instance().activeDocument()
+            node = document.activeNode() if document else None
+            node_id = node.uniqueId().toString() if node else None
+            # Cheap content hint, so idle means unedited rather than merely still active
+            state = sample_digest(node) if node is not None else None
+        except Exception:
+            return
+        if self._prefetch_runner is not None and (node_id, state) != (self._prefetch_node_id, self._prefetch_state):
+            # The user moved on or kept painting; finishing the request would only spend quota on stale pixels
+            self._prefetch_runner.cancel()
+        prefetched = self._prefetched.get(node_id)
+        if prefetched is not None and prefetched[0] != state:
+            # Masks of the old pixels can no longer be used; free their cache space
+            self._rung_cache.discard(prefetched[1])
+            del self._prefetched[node_id]
+        self._prefetch_idle.idle_seconds = self.prefetch_idle_spinbox.value()
+        if not self._prefetch_idle.update(node_id, state):
+            return
+        # Only in mask mode, and never competing with work the user started
+        if (self.mode_button_group.checkedId() != 1 or self._prefetch_runner is not None
+                or self._runner is not None or self._interactive_runner is not None):
+            return
+        if node.type().endswith("mask") or node.bounds().isEmpty():
+            return
+        self._prefetch_budget.per_hour = self.prefetch_limit_spinbox.value()
+        if not self._prefetch_budget.allow():
+            return
+        self.load_api_key()
+        if not self.api_key or len(self.api_key) < 10:
+            return
+        try:
+            from . import net
+            context, _ = net.session_ssl_context()
+        except Exception:
+            return
+        self._prefetch_idle.done()
+        self.start_prefetch(document, node, node_id, state, context)
+
+    def start_prefetch(self, document, node, node_id, state, context):
+        """Request the masks of node in the background and keep them in the rung cache"""
+        api_key = self.api_key
+        pending = threading.Event()
+        self._prefetch_pending[node_id] = pending
+
+        def work(job, token):
+            try:
+                return self.request_mask_generation(job, api_key, context, token)
+            finally:
+                pending.set()
+
+        def on_result(item, result):
+            if self.debug_enabled():
+                self.log_error(f"Prefetch: {result} ({self._prefetch_budget.used()}/"
+                               f"{self._prefetch_budget.per_hour} this hour)")
+
+        def on_finished(cancelled):
+            self._prefetch_runner = None
+            self._prefetch_node_id = self._prefetch_state = None
+            pending.set()
+            if self._prefetch_pending.get(node_id) is pending:
+                del self._prefetch_pending[node_id]
+            self.save_metrics()
+
+        self._prefetch_node_id, self._prefetch_state = node_id, state
+        self._prefetch_runner = BatchRunner(
+            self._main_queue, [node],
+            prepare=lambda node: self.prepare_prefetch(node, document, state),
+            work=work,
+            apply=self.apply_prefetch,
+            cleanup=self.finish_prefetch,
+            on_result=on_result,
+            on_finished=on_finished,
+            max_workers=1,
+            lane=BULK)
+        self._prefetch_runner.start()
+
+    def prepare_prefetch(self, node, document, state):
+        """Export the layer like Generate would, so the rung cache key matches (GUI thread)"""
+        job = self.prepare_mask_generation(node, document)
+        if isinstance(job, dict):
+            job['prefetch'] = True
+            job['prefetch_state'] = state
+            job['keep_export'] = False
+            job.pop('stream')  # Nothing is imported; the runner hands the request result to apply
+        return job
+
+    def apply_prefetch(self, job, payload):
+        if isinstance(payload, str):
+            return payload
+        return f"{job['decoded']} masks ready for {job['node_name']}"
+
+    def finish_prefetch(self, job):
+        """Count a request that reached the server against the quota, then release the export"""
+        if job.get('sent'):
+            self._prefetch_budget.spend()
+        if job.get('export_digest') is not None:
+            cache_key = (job['export_digest'], job['ladder'][job['rung']])
+            if self._rung_cache.get(cache_key) is not None:
+                # Remembered so the masks can be dropped once the layer is edited
+                self._prefetched[job['node_id']] = (job['prefetch_state'], cache_key)
+        self.cleanup_job(job)
+
+    # ------------------------------------------------------------
+    # Atlas batching: many small layers per request
+    # ------------------------------------------------------------
+    def plan_atlases(self, nodes, mode):
+        """Group small layers into atlases (GUI thread); returns the batch items, AtlasGroups first"""
+        max_size = ATLAS_MAX_SIZE
+        if mode == 1:
+            if self.pick_masks_checkbox.isChecked() or self.progressive_checkbox.isChecked():
+                return nodes  # Picking works per layer
+            try:
+                # The atlas is sent at the largest rung so its cells are not downscaled
+                max_size = min(max_size, max(self.mask_ladder()))
+            except ValueError:
+                return nodes  # Reported by prepare_mask_generation
+        max_cell = max_cell_size(max_size)
+        small = [node for node in nodes if is_small(node.bounds().width(), node.bounds().height(), max_cell)]
+        atlases, _ = pack([(node.bounds().width(), node.bounds().height()) for node in small], max_size)
+        groups = [AtlasGroup([small[cell.index] for cell in atlas.cells], max_size)
+                  for atlas in atlases if len(atlas.cells) > 1]
+        packed = {id(node) for group in groups for node in group.nodes}
+        return groups + [node for node in nodes if id(node) not in packed]
+
+    def prepare_atlas(self, group, document, mode, mutations=None, batch_id=None):
+        """
+        Export a group of small layers and compose them into one padded atlas image (GUI thread).
+        Each layer's job is journaled under batch_id like a layer sent on its own.
+        """
+        from PyQt5.QtGui import QPainter
+        exported = []
+        for node in group.nodes:
+            sub = self.prepare_node(node, document, mode, batch_id=batch_id, mutations=mutations,
+                                    require_export=True)
+            if isinstance(sub, str):
+                group.results.append(sub)
+                continue
+            image = QImage(sub['temp_file'])
+            if image.isNull():
+                group.results.append(f"Error: Failed to load exported image for {sub['node_name']}")
+                self.cleanup_job(sub)
+                continue
+            sub['guided'] = False  # Cells are scaled to their layers by the plain import path
+            exported.append((sub, image))
+        if not exported:
+            return "Error: No layer of the atlas could be exported"
+
+        atlases, leftovers = pack([(image.width(), image.height()) for _, image in exported], group.max_size)
+        if len(atlases) != 1 or leftovers:
+            for sub, _ in exported:
+                self.cleanup_job(sub)
+            return "Error: Layers no longer fit in one atlas"
+        atlas = atlases[0]
+        group.density = atlas.density()
+
+        canvas = QImage(atlas.width, atlas.height, QImage.Format_RGB32)
+        canvas.fill(Qt.white)  # type: ignore
+        painter = QPainter(canvas)
+        cells = []
+        for cell in atlas.cells:
+            sub, image = exported[cell.index]
+            painter.drawImage(cell.x, cell.y, image)
+            cells.append((sub, QRect(cell.x, cell.y, cell.width, cell.height)))
+        painter.end()
+
+        unique_id = str(uuid.uuid4())[:8]
+        temp_file = self.scratch.allocate(f"atlas_{unique_id}", ".png", size_hint=atlas.width * atlas.height * 4)
+        if not canvas.save(temp_file, "PNG"):
+            for sub, _ in cells:
+                self.cleanup_job(sub)
+            return "Error: Failed to save atlas image"
+
+        # Settings are the same for every layer of the batch; take them from the first
+        first = cells[0][0]
+        job = {key: first[key] for key in ('mode', 'debug', 'upload_budget', 'ladder', 'morphology', 'pick')
+               if key in first}
+        job.update({
+            'node_name': f"atlas of {len(cells)} layers",
+            'unique_id': unique_id,
+            'temp_file': temp_file,
+            'temp_files': [temp_file],
+            'temp_dir': os.path.dirname(temp_file),
+            'started': time.time(),
+            'atlas': cells,
+            'group': group,
+            'layer_width': atlas.width,
+            'layer_height': atlas.height,
+        })
+        if mode == 1:
+            job.update({'rung': len(job['ladder']) - 1, 'guided': False, 'rung_timings': [], 'decoded': 0})
+        if job['debug']:
+            self.log_error(f"Packed {len(cells)} layers into a {atlas.width}x{atlas.height} atlas "
+                           f"({group.density:.0%} density)")
+        return job
+
+    def atlas_cell(self, job, rect, image):
+        """Map a cell of the atlas to the matching rectangle of a result of image's size"""
+        sx = image.width() / float(job['layer_width'])
+        sy = image.height() / float(job['layer_height'])
+        return QRect(int(round(rect.x() * sx)), int(round(rect.y() * sy)),
+                     max(1, int(round(rect.width() * sx))), max(1, int(round(rect.height() * sy))))
+
+    def request_atlas(self, job, api_key, context, token):
+        """Send the atlas as one request and slice the result back per layer (worker thread)"""
+        # Layers with a result journaled by an interrupted run of the batch reuse it
+        resumed = {}
+        for sub, _ in job['atlas']:
+            if sub.get('batch_id') is not None:
+                payload = self.resume_from_journal(sub, token)
+                if sub.get('resumed'):
+                    resumed[id(sub)] = payload
+        job['resumed_cells'] = resumed
+        if len(resumed) == len(job['atlas']):
+            if job['debug']:
+                self.log_error(f"Every layer of the {job['node_name']} was resumed from the journal")
+            return {} if job['mode'] == 1 else {'cells': [(sub, resumed[id(sub)]) for sub, _ in job['atlas']]}
+        pending = [sub for sub, _ in job['atlas'] if id(sub) not in resumed]
+
+        if job['mode'] == 1:
+            for sub in pending:
+                if sub.get('batch_id') is not None:
+                    sub['pieces'] = []  # Each layer's slices are journaled as its own result
+            # Masks are sliced into each layer's stream as they are decoded (see slice_atlas_mask)
+            result = self.request_mask_generation(job, api_key, context, token)
+            if isinstance(result, str):
+                return result
+            for sub in pending:
+                pieces = sub.pop('pieces', None)
+                if pieces:  # A layer no mask reached is requested again on resume
+                    self.journal_downloaded(sub, pieces=pieces)
+            return {}
+        payload = self.request_background_removal(job, api_key, context, token)
+        if isinstance(payload, str):
+            return payload
+        image = payload['image']
+        cells = []
+        for sub, rect in job['atlas']:
+            if id(sub) in resumed:
+                cells.append((sub, resumed[id(sub)]))
+                continue
+            cell = image.copy(self.atlas_cell(job, rect, image))
+            if sub.get('batch_id') is not None:
+                self.journal_downloaded(sub, data=encoder.encode_png(cell))
+            cells.append((sub, self.background_payload(sub, cell)))
+        return {'cells': cells}
+
+    def slice_atlas_mask(self, job, mask_name, data, info):
+        """Hand the part of an atlas mask that covers each layer to that layer's stream (worker thread)"""
+        if info is None:
+            return False
+        job['decoded'] += 1
+        if job.get('pieces') is not None:
+            job['pieces'].append((mask_name, data))
+        if info.bbox is None:
+            return True
+        x, y, w, h = info.bbox
+        # The analysis bbox is coarse; widen it by one analysis cell before testing for overlap
+        slack = max(info.image.width(), info.image.height()) // 64 + 1
+        coverage = QRect(x - slack, y - slack, w + 2 * slack, h + 2 * slack)
+        resumed = job.get('resumed_cells', {})
+        for sub, rect in job['atlas']:
+            cell = self.atlas_cell(job, rect, info.image)
+            if id(sub) in resumed or not coverage.intersects(cell):
+                continue
+            cell_info = analyze_mask(mask_name, info.image.copy(cell))
+            if cell_info.area > 0:
+                # Journaled layers keep the encoded slice so a resumed batch can re-import it
+                data = encoder.encode_png(cell_info.image) if sub.get('pieces') is not None else None
+                self.submit_mask(sub, mask_name, data, cell_info)
+        return True
+
+    def apply_atlas(self, job, payload, document):
+        """Apply every layer of an atlas in turn (GUI thread generator); returns a summary"""
+        results = job['group'].results
+        first = len(results)
+        if job['mode'] == 1:
+            for sub, _ in job['atlas']:
+                sub['stream'].close()
+            cells = [(sub, sub['stream']) for sub, _ in job['atlas']]
+        else:
+            cells = payload['cells']
+        for sub, sub_payload in cells:
+            result = self.apply_node(sub, sub_payload, document)
+            if isinstance(result, types.GeneratorType):
+                result = yield from result
+            self.journal_job_result(sub, result)
+            results.append(result)
+        failed = sum(1 for result in results[first:] if result.startswith("Error"))
+        return f"Atlas of {len(cells)} layers applied" + (f", {failed} failed" if failed else "")
+
+    def memory_budget(self):
+        """The MemoryBudget shared by both lanes; sized afresh whenever neither lane is running"""
+        if self._memory_budget is None or (self._runner is None and self._interactive_runner is None):
+            budget_mib = self.memory_budget_spinbox.value() if self._settings_built else 0
+            self._memory_budget = memory.MemoryBudget(budget_mib * 1024 * 1024 if budget_mib
+                                                      else memory.default_budget())
+        return self._memory_budget
+
+    def estimate_job_bytes(self, item, mode):
+        """Rough peak memory of a batch item while in flight, from its layer bounds (GUI thread)"""
+        nodes = item.nodes if isinstance(item, AtlasGroup) else [item]
+        pixels = sum(node.bounds().width() * node.bounds().height() for node in nodes)
+        if isinstance(item, AtlasGroup):
+            pixels *= 2  # Per-layer exports plus the atlas itself
+        return pixels * (memory.BACKGROUND_BYTES_PER_PIXEL if mode == 0 else memory.MASK_BYTES_PER_PIXEL)
+
+    # ------------------------------------------------------------
+    # Per-node pipeline: prepare (GUI) -> request (worker) -> apply (GUI)
+    # ------------------------------------------------------------
+    def prepare_node(self, node, document, mode, batch_id=None, mutations=None, require_export=False):
+        """
+        Export the node on the GUI thread; returns a job dict or an error string.
+        mutations is the DocumentBatch shared by the batch, committed once when it finishes.
+        require_export exports even a layer whose masks are cached (atlas cells are read from the export).
+        """
+        if isinstance(node, AtlasGroup):
+            return self.prepare_atlas(node, document, mode, mutations, batch_id)
+        with self.metrics.timer('stage', stage='prepare'):
+            if mode == 0:  # Remove Background
+                job = self.prepare_background_removal(node, document)
+            elif mode == 1:  # Generate Mask
+                job = self.prepare_mask_generation(node, document, require_export)
+        # Masks waiting in the picker are not journaled; nothing is applied until the user picks
+        if isinstance(job, dict):
+            job['mutations'] = mutations
+        if isinstance(job, dict) and batch_id is not None and not job.get('pick'):
+            job['batch_id'] = batch_id
+            job['item_key'] = node.uniqueId().toString()
+        return job
+
+    def request_node(self, job, api_key, context, token):
+        """Run the network and decode part of a job on a worker thread"""
+        if job.get('atlas') is not None:
+            return self.request_atlas(job, api_key, context, token)
+        if job.get('batch_id') is not None:
+            resumed = self.resume_from_journal(job, token)
+            if resumed is not None:
+                return resumed
+        with self.metrics.timer('stage', stage='work'):
+            if job['mode'] == 0:
+                payload = self.request_background_removal(job, api_key, context, token)
+                if isinstance(payload, dict):
+                    self.journal_downloaded(job, data=payload.pop('data'))
+                return payload
+            return self.request_mask_generation(job, api_key, context, token)
+
+    # ------------------------------------------------------------
+    # Job journal: resume interrupted batches without new requests
+    # ------------------------------------------------------------
+    def data_directory(self):
+        """Directory for the plugin's persistent files (journal, metrics)"""
+        try:
+            base = Krita.instance().getAppDataLocation()
+        except AttributeError:
+            base = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+        return os.path.join(base, "bria_masktools")
+
+    def get_journal(self):
+        """Open the persistent job journal on first use; None if it cannot be created"""
+        if self._journal is None:
+            try:
+                self._journal = JobJournal(self.data_directory())
+            except Exception as e:
+                self.log_error(f"Job journal unavailable: {str(e)}")
+                self._journal = False
+            else:
+                atexit.register(self._journal.close)
+        return self._journal or None
+
+    def begin_journal_batch(self, document, nodes, mode):
+        """Record the batch about to run; returns its id, or None without a journal"""
+        journal = self.get_journal()
+        if journal is None:
+            return None
+        key = batch_key(document.fileName(), mode,
+                        self.get_selected_mask_import_mode() if mode == 1 else None,
+                        [node.uniqueId().toString() for node in nodes])
+        batch_id, resumed = journal.begin_batch(key)
+        if resumed:
+            self.status_label.append("Resuming interrupted batch: finished layers are skipped")
+        return batch_id
+
+    def resume_from_journal(self, job, token):
+        """
+        Reuse a result stored by an interrupted run of the same batch (worker thread).
+        Returns the payload for a background removal, None for streamed masks or when the
+        item has to be requested again; job['resumed'] tells them apart.
+        """
+        import zipfile
+        journal = self._journal
+        batch_id, item_key = job['batch_id'], job['item_key']
+        if job.get('layer_fingerprint') is not None:
+            # Masks found in the rung cache were not exported; the pixel fingerprint stands in for the file
+            job['fingerprint'] = batch_key(job['layer_fingerprint'], job['mode'])
+        else:
+            job['fingerprint'] = fingerprint_file(job['temp_file'], str(job['mode']))
+        entry = journal.lookup(batch_id, item_key)
+        if entry is None or entry['fingerprint'] != job['fingerprint'] or entry['result_path'] is None:
+            # New, changed or never downloaded: submit and forget any stale result
+            journal.record(batch_id, item_key, job['fingerprint'], SUBMITTED, result_path="", outputs=[])
+            return None
+
+        if entry['state'] == APPLIED:
+            # The apply stage skips the item if its nodes are still in the document
+            job['resume_outputs'] = entry['outputs']
+        if job['debug']:
+            self.log_error(f"Reusing journaled result for {job['node_name']} ({entry['state']})")
+
+        if job['mode'] == 0:
+            image = QImage(entry['result_path'])
+            if image.isNull():
+                journal.record(batch_id, item_key, job['fingerprint'], SUBMITTED, result_path="", outputs=[])
+                return None
+            job['result_file'] = entry['result_path']
+            job['resumed'] = True
+            return self.background_payload(job, image)
+
+        if job['guided']:
+            job['guide'] = QImage(job['temp_file']).convertToFormat(QImage.Format_Grayscale8)
+        with zipfile.ZipFile(entry['result_path']) as archive:
+            for name in archive.namelist():
+                token.check()
+                self.emit_mask(job, name, archive.read(name))
+        job['resumed'] = True
+        return None
+
+    def journal_downloaded(self, job, data=None, pieces=None):
+        """Keep a downloaded result outside the scratch space so it survives a crash (worker thread)"""
+        import zipfile
+        if job.get('batch_id') is None or 'fingerprint' not in job:
+            return
+        journal = self._journal
+        try:
+            if pieces is not None:
+                path = journal.result_path(job['batch_id'], job['item_key'], ".zip")
+                with zipfile.ZipFile(path + ".part", 'w', zipfile.ZIP_STORED) as archive:
+                    for name, data in pieces:
+                        archive.writestr(name, data)
+            else:
+                path = journal.result_path(job['batch_id'], job['item_key'], ".png")
+                with open(path + ".part", 'wb') as f:
+                    f.write(data)
+            os.replace(path + ".part", path)
+            journal.record(job['batch_id'], job['item_key'], job['fingerprint'], DOWNLOADED, result_path=path)
+        except Exception as e:
+            self.log_error(f"Could not journal result for {job['node_name']}: {str(e)}")
+
+    def record_job_result(self, job, result):
+        """Journal a finished job and record its duration and outcome (GUI thread)"""
+        self.journal_job_result(job, result)
+        outcome = "cancelled" if result == "Cancelled" else "error" if result.startswith("Error") else "ok"
+        self.metrics.increment('jobs', outcome=outcome, mode=MODE_METRIC_NAMES[job['mode']])
+        if outcome == "ok":
+            self.metrics.observe('job', (time.time() - job['started']) * 1000.0, mode=MODE_METRIC_NAMES[job['mode']])
+
+    def journal_job_result(self, job, result):
+        """Mark a journaled job applied or failed once the runner reports it (GUI thread)"""
+        if job.get('batch_id') is None or 'fingerprint' not in job:
+            return
+        if result.startswith("Error"):
+            self._journal.record(job['batch_id'], job['item_key'], job['fingerprint'], FAILED)
+        elif result != "Cancelled":
+            self._journal.record(job['batch_id'], job['item_key'], job['fingerprint'], APPLIED,
+                                 outputs=job.get('outputs', []))
+
+    def outputs_present(self, document, outputs):
+        """True if every node id in outputs still exists in the document"""
+        return bool(outputs) and all(document.nodeByUniqueID(QUuid(uid)) for uid in outputs)
+
+    def apply_node(self, job, payload, document):
+        """Apply a finished job to the document on the GUI thread"""
+        if job.get('atlas') is not None:
+            return self.apply_atlas(job, payload, document)
+        if job['mode'] == 0:
+            return self.apply_background_removal(job, payload, document)
+        return self.apply_mask_generation(job, payload, document)
+
+    def cleanup_job(self, job):
+        """
+        Release a job's scratch files. Debug mode keeps them for inspection until Krita exits,
+        when the session directory is removed.
+        """
+        for sub, _ in job.pop('atlas', None) or ():
+            self.cleanup_job(sub)
+        if not job.get('pick'):
+            # Masks are upsampled as they are imported; picked ones keep the guide until the picker imports them
+            job.pop('guide', None)
+        if job.get('debug') or job.get('keep_export'):
+            return  # A progressive preview keeps its export for the refine request
+        for path in job.pop('temp_files', []):
+            self.scratch.release(path)
+
+    def new_job(self, node, mode, suffix):
+        """Create the bookkeeping dict shared by the three pipeline stages"""
         unique_id = str(uuid.uuid4())[:8]
-        temp_file = os.path.join(temp_dir, f"temp_layer_{unique_id}.jpg")
-        result_file = None
+        bounds = node.bounds()
+        # Size hint lets the scratch space keep exports of huge layers off the memory-backed filesystem
+        temp_file = self.scratch.allocate(f"temp_layer_{unique_id}", f".{suffix}",
+                                          size_hint=bounds.width() * bounds.height() * 4)
+        temp_dir = os.path.dirname(temp_file)
+        upload_budget = (self.upload_budget_spinbox.value() if self._settings_built
+                         else encoder.DEFAULT_BUDGET_KB_PER_MP)
+        return {
+            'node': node,
+            'node_id': node.uniqueId().toString(),
+            'node_name': node.name(),
+            'mode': mode,
+            'debug': self.debug_enabled(),
+            'temp_dir': temp_dir,
+            'unique_id': unique_id,
+            'temp_file': temp_file,
+            'temp_files': [temp_file],
+            'upload_budget': upload_budget,
+            'started': time.time(),
+        }
+
+    def encode_upload(self, job, image):
+        """Encode an image for upload with the codec and quality chosen for its content (worker thread)"""
+        encoded = encoder.encode(image, job['upload_budget'])
+        if encoded is not None:
+            self.log_error(f"Upload for {job['node_name']}: {image.width()}x{image.height()} "
+                           f"{encoder.describe(encoded, image.width(), image.height())}")
+        return encoded
+
+    def prepare_background_removal(self, node, document):
+        """Export the node losslessly for standard background removal; the upload codec is picked later"""
+        job = self.new_job(node, 0, "png")
+        job['color_model'] = document.colorModel()
+        job['color_depth'] = document.colorDepth()
+        job['color_profile'] = document.colorProfile()
+        bounds = node.bounds()
+        job['origin'] = (bounds.x(), bounds.y())  # The export covers the layer's bounds
 
         # Create an InfoObject for export configuration
         export_params = InfoObject()
-        export_params.setProperty("quality", 100)  # Use maximum quality for JPEG
+        export_params.setProperty("compression", 1)  # Fast, lossless; this file is re-encoded for upload
         export_params.setProperty("forceSRGB", True)  # Force sRGB color space
         export_params.setProperty("saveProfile", False)  # Don't save color profile
         export_params.setProperty("alpha", False)  # No alpha
-        export_params.setProperty("flatten", True)  # Flatten the image for JPEG export
+        export_params.setProperty("flatten", True)  # Flatten the image for export
 
-        # Save the active node as JPG
+        # Save the active node as PNG
         try:
             # Simply save without checking return value like the original
-            node.save(temp_file, 1.0, 1.0, export_params, node.bounds())
+            node.save(job['temp_file'], 1.0, 1.0, export_params, node.bounds())
         except Exception as e:
+            self.cleanup_job(job)
             return f"Error exporting image: {str(e)}"
+        return job
+
+    def request_background_removal(self, job, api_key, context, token):
+        """Upload the exported layer and download the cutout (worker thread)"""
+        import ssl
+        import urllib.error
+        import urllib.request
+        from . import net
+        temp_file = job['temp_file']
+        debug = job['debug']
 
         # Prepare the API request
         url = "https://engine.prod.bria-api.com/v1/background/remove"
 
+        export_img = QImage(temp_file)
+        if export_img.isNull():
+            return "Error: Failed to load exported image"
+        encoded = self.encode_upload(job, export_img)
+        del export_img
+        if encoded is None:
+            return "Error: Failed to encode image for upload"
+
         try:
             # Prepare the multipart form data
             boundary = 'wL36Yn8afVp8Ag7AmP8qZ0SA4n1v9T'
             data = []
             data.append(f'--{boundary}'.encode())
-            data.append(b'Content-Disposition: form-data; name="file"; filename="temp_layer.jpg"')
-            data.append(b'Content-Type: image/jpg')
+            data.append(f'Content-Disposition: form-data; name="file"; filename="temp_layer{encoded.suffix}"'.encode())
+            data.append(f'Content-Type: {encoded.mime}'.encode())
             data.append(b'')
-            with open(temp_file, 'rb') as f:
-                data.append(f.read())
+            data.append(encoded.data)
             data.append(f'--{boundary}--'.encode())
             data.append(b'')
             body = b'\r\n'.join(data)
@@ -660,7 +1695,7 @@ class BriaMaskTools(QDockWidget):
             req = urllib.request.Request(url, data=body, headers=headers, method='POST')
 
             # Log request details if debug mode
-            if self.debug_checkbox.isChecked():
+            if debug:
                 self.log_error(f"Request URL: {url}")
                 self.log_error(f"Request headers: {headers}")
                 self.log_error(f"API key length: {len(api_key)}")
@@ -669,115 +1704,57 @@ class BriaMaskTools(QDockWidget):
                 else:
                     self.log_error(f"API key: {api_key}")
 
-            with urllib.request.urlopen(req, timeout=30, context=context) as response:
-                if response.status == 200:
-                    # Parse the JSON response
-                    try:
-                        response_data = json.loads(response.read().decode('utf-8'))
-                    except json.JSONDecodeError:
-                        return "Error: Invalid JSON response from server"
-
-                    result_url = response_data.get('result_url')
-
-                    if self.debug_checkbox.isChecked():
-                        self.log_error(f"Response data: {response_data}")
-
-                    if result_url:
-                        # Download the image from the URL
-                        result_file = os.path.join(temp_dir, f"result_layer_{unique_id}.png")
-                        try:
-                            urllib.request.urlretrieve(result_url, result_file)
-                        except Exception as e:
-                            return f"Error downloading result: {str(e)}"
-
-                        # Rename layer
-                        new_layer_name = "Cutout"
-
-                        # Get the color space of the original document
-                        original_color_space = document.colorModel()
-
-                        # Create a new layer in the document
-                        new_layer = document.createNode(new_layer_name, "paintlayer")
-                        if not new_layer:
-                            return "Error: Failed to create new layer"
-
-                        # Load the image
-                        image = QImage(result_file)
-                        if image.isNull():
-                            return "Error: Failed to load result image"
-
-                        # Convert image data to bytes safely
-                        raw = qimage_to_bytes(image)
-                        new_layer.setPixelData(raw, 0, 0, image.width(), image.height())
-
-                        # Add the new layer to the document
-                        document.rootNode().addChildNode(new_layer, node)
-
-                        if original_color_space != "RGBA":
-                            # For non-RGBA documents, the layer inherits the document's color space
-                            result = (f"Background removed successfully for {node.name()} "
-                                     f"(Working in {original_color_space} color space)")
-                        else:
-                            result = f"Background removed successfully for {node.name()}"
-
-                        # Hide the original layer
-                        try:
-                            node.setVisible(False)
-                        except Exception:
-                            pass  # Not critical if hiding fails
-
-                        try:
-                            document.refreshProjection()
-                        except Exception:
-                            pass  # Non-critical if refresh fails
-
-                        if self.debug_checkbox.isChecked():
-                            result += f"\nDebug: Temporary files saved at {temp_file} and {result_file}"
-                        else:
-                            try:
-                                os.remove(result_file)
-                            except Exception:
-                                pass
-
-                        return result
-                    else:
-                        return "Error: No result URL in response"
-                else:
+            request_start = time.perf_counter()
+            self.count_request(job, "background_remove", len(body))
+            with net.open_url(req, context=context, token=token, timeout=30) as response:
+                if response.status != 200:
                     return self.handle_error(response.status)
 
-        except urllib.error.HTTPError as e:
-            # Try to read the error response body for more details
-            error_body = ""
-            try:
-                error_body = e.read().decode('utf-8')
-                # Try to parse as JSON for better formatting
+                # Parse the JSON response
                 try:
-                    error_json = json.loads(error_body)
-                    error_body = json.dumps(error_json, indent=2)
-                except:
-                    pass
-            except:
-                pass
+                    response_body = net.read_response(response, token)
+                    response_data = json.loads(response_body.decode('utf-8'))
+                except json.JSONDecodeError:
+                    return "Error: Invalid JSON response from server"
+            self.count_response("background_remove", request_start, len(response_body))
 
-            # Special handling for 401 errors
-            if e.code == 401:
-                error_msg = ("INVALID API KEY\n\n"
-                           "Your API key was rejected by BriaAI.\n\n"
-                           "Please check:\n"
-                           "• You've entered the correct API key\n"
-                           "• No extra spaces or quotes in the key\n"
-                           "• The key hasn't expired\n\n"
-                           "To get a valid API key:\n"
-                           "1. Go to https://www.bria.ai\n"
-                           "2. Sign up for a free account (no credit card)\n"
-                           "3. Copy your API key from the dashboard\n"
-                           "4. Paste it in the API Key field above\n\n"
-                           f"Error details: {error_body}")
-                # Highlight the API key field with error
-                self.highlight_invalid_api_key()
-            else:
-                error_msg = f"{self.handle_error(e.code)} - Details: {error_body}"
+            result_url = response_data.get('result_url')
+
+            if debug:
+                self.log_error(f"Response data: {response_data}")
+
+            if not result_url:
+                return "Error: No result URL in response"
 
+            # Download the image into memory and decode it from the response buffer
+            try:
+                with self.metrics.timer('stage', stage='download'):
+                    result_data = net.fetch(result_url, context=context, token=token)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                return f"Error downloading result: {str(e)}"
+            self.metrics.increment('bytes_received', len(result_data), endpoint="download")
+            if debug:
+                # Keep the downloaded file for inspection
+                result_file = self.scratch.allocate(f"result_layer_{job['unique_id']}", ".png")
+                job['result_file'] = result_file
+                job['temp_files'].append(result_file)
+                with open(result_file, 'wb') as f:
+                    f.write(result_data)
+
+            # Decoding into a QImage is safe off the GUI thread
+            image = QImage.fromData(result_data)
+            if image.isNull():
+                return "Error: Failed to load result image"
+            payload = self.background_payload(job, image)
+            payload['data'] = result_data
+            return payload
+
+        except JobCancelled:
+            raise
+        except urllib.error.HTTPError as e:
+            error_msg, error_body = self.describe_http_error(e)
             self.log_error(f"HTTPError in background removal: Status {e.code}")
             self.log_error(f"URL: {url}")
             self.log_error(f"Response headers: {dict(e.headers)}")
@@ -799,519 +1776,910 @@ class BriaMaskTools(QDockWidget):
             self.log_error(traceback.format_exc())
             return f"Unexpected error: {str(e)}"
 
-        finally:
-            if temp_file and os.path.exists(temp_file) and not self.debug_checkbox.isChecked():
-                try:
-                    os.remove(temp_file)
-                except Exception:
-                    pass  # Ignore cleanup errors
-
-    def process_mask_generation(self, node, api_key, document, context):
-        """Generate masks using /mask_generator endpoint"""
-        # Prepare temporary file
-        temp_dir = tempfile.gettempdir()
-        unique_id = str(uuid.uuid4())[:8]
-        temp_file = os.path.join(temp_dir, f"temp_layer_{unique_id}.jpg")
+    def background_payload(self, job, image):
+        """Convert a decoded cutout to the document's pixel layout while still on the worker thread"""
+        if job.get('atlas') is not None:
+            return {'image': image}  # Converted per layer once sliced
+        started = time.perf_counter()
+        pixels = pixel_data(image, job['color_model'], job['color_depth'], job['color_profile'])
+        if job['debug']:
+            how = "converted" if pixels is not None else "left for Krita to convert"
+            self.log_error(f"Result for {job['node_name']} {how} to {job['color_model']}/{job['color_depth']} "
+                           f"in {(time.perf_counter() - started) * 1000.0:.0f} ms")
+        return {'image': image, 'pixels': pixels}
+
+    def apply_background_removal(self, job, payload, document):
+        """Insert the downloaded cutout as a new layer (GUI thread)"""
+        node = job['node']
+        image = payload['image']
+        if self.outputs_present(document, job.get('resume_outputs')):
+            job['outputs'] = job['resume_outputs']
+            return f"Skipped {job['node_name']}: already processed in an interrupted batch"
+
+        # Rename layer
+        new_layer_name = "Cutout"
+
+        # Get the color space of the original document
+        original_color_space = job['color_model']
+
+        # Create a new layer in the document
+        new_layer = document.createNode(new_layer_name, "paintlayer")
+        if not new_layer:
+            return "Error: Failed to create new layer"
+
+        # Add the new layer to the document, then write pixels already in the document's layout
+        mutations = self.mutations(job, document)
+        mutations.add_node(document.rootNode(), new_layer, node)
+        mutations.call(write_pixels, new_layer, image, payload['pixels'], job['color_model'], job['color_depth'],
+                       job['color_profile'], *job['origin'])
+        job.setdefault('outputs', []).append(new_layer.uniqueId().toString())
+
+        if original_color_space != "RGBA" or job['color_depth'] != "U8":
+            # The layer is in the document's color space
+            result = (f"Background removed successfully for {job['node_name']} "
+                     f"(Working in {original_color_space}/{job['color_depth']} color space)")
+        else:
+            result = f"Background removed successfully for {job['node_name']}"
 
+        # Hide the original layer; the projection is refreshed once when the batch commits
+        mutations.set_visible(node, False)
+        mutations.flush()
+
+        if job['debug']:
+            result += f"\nDebug: Temporary files saved at {job['temp_file']} and {job.get('result_file')}"
+
+        return result
+
+    def describe_http_error(self, e):
+        """Return (message, body) for an HTTPError, with a detailed message for rejected API keys"""
+        # Try to read the error response body for more details
+        error_body = ""
         try:
-            # Export as JPEG
-            export_params = InfoObject()
-            export_params.setProperty("quality", 100)
-            export_params.setProperty("forceSRGB", True)
-            export_params.setProperty("alpha", False)
+            error_body = e.read().decode('utf-8')
+            # Try to parse as JSON for better formatting
             try:
-                # Log export attempt if debug mode
-                if self.debug_checkbox.isChecked():
-                    self.log_error(f"Exporting image to: {temp_file}")
-                    bounds = node.bounds()
-                    self.log_error(f"Node bounds: {bounds.x()}, {bounds.y()}, {bounds.width()}, {bounds.height()}")
+                error_json = json.loads(error_body)
+                error_body = json.dumps(error_json, indent=2)
+            except:
+                pass
+        except:
+            pass
 
-                # Simply save without checking return value like the original
-                node.save(temp_file, 1.0, 1.0, export_params, node.bounds())
+        # Special handling for 401 errors
+        if e.code == 401:
+            error_msg = ("INVALID API KEY\n\n"
+                       "Your API key was rejected by BriaAI.\n\n"
+                       "Please check:\n"
+                       "• You've entered the correct API key\n"
+                       "• No extra spaces or quotes in the key\n"
+                       "• The key hasn't expired\n\n"
+                       "To get a valid API key:\n"
+                       "1. Go to https://www.bria.ai\n"
+                       "2. Sign up for a free account (no credit card)\n"
+                       "3. Copy your API key from the dashboard\n"
+                       "4. Paste it in the API Key field above\n\n"
+                       f"Error details: {error_body}")
+            # Highlight the API key field with error
+            self._main_queue.post(self.highlight_invalid_api_key)
+        else:
+            error_msg = f"{self.handle_error(e.code)} - Details: {error_body}"
+        return error_msg, error_body
 
-                # Verify file was created
-                if not os.path.exists(temp_file):
-                    return "Error: Export file was not created"
+    def prepare_mask_generation(self, node, document, require_export=False):
+        """Export the node losslessly and snapshot the import options (GUI thread)"""
+        try:
+            ladder = self.mask_ladder()
+        except ValueError as e:
+            return f"Error: Invalid mask resolution ladder: {str(e)}"
+        job = self.new_job(node, 1, "png")
+        job['ladder'] = ladder
+        job['progressive'] = self.progressive_checkbox.isChecked() and len(ladder) > 1
+        # Progressive jobs start at the smallest rung; otherwise only the largest is requested
+        job['rung'] = 0 if job['progressive'] else len(ladder) - 1
+        job['keep_export'] = job['progressive']
+        job['rung_timings'] = []
+        bounds = node.bounds()
+        job['layer_width'] = bounds.width()
+        job['layer_height'] = bounds.height()
+        job['layer_bounds'] = (bounds.x(), bounds.y(), bounds.width(), bounds.height())
+        job['import_mode'] = self.get_selected_mask_import_mode()
+        job['add_to_new_layer'] = self.add_to_new_layer_checkbox.isChecked()
+        job['pick'] = self.pick_masks_checkbox.isChecked() or job['progressive']
+        job['min_area'] = self.min_area_spinbox.value() / 100.0
+        job['decoded'] = 0
+        job['filtered'] = 0
+        job['dedupe_iou'] = self.dedupe_spinbox.value() if self.dedupe_checkbox.isChecked() else 0.0
+        job['kept'] = []
+        job['merged'] = 0
+        # Clean-up radii are entered in layer pixels
+        job['morphology'] = MorphologySettings(self.grow_spinbox.value(), self.shrink_spinbox.value(),
+                                               self.fill_holes_checkbox.isChecked(), self.feather_spinbox.value())
+        # Label maps stay at mask resolution, so there is nothing to upsample
+        job['guided'] = (self.edge_aware_checkbox.isChecked() and guided_upsample.is_available()
+                         and job['import_mode'] != "labels")
+        job['document'] = document
+        # Masks are imported from this stream while the download is still in progress
+        job['stream'] = self.new_mask_stream()
+        temp_file = job['temp_file']
+
+        # The pixel fingerprint keys the rung cache; masks downloaded for the unchanged layer are found without
+        # export. When the layer is exported anyway, the export's own digest keys the cache instead.
+        job['layer_fingerprint'] = None
+        if not (job['guided'] or job['keep_export'] or require_export):
+            fingerprint_start = time.perf_counter()
+            reused, sampled, rehashed = (self._fingerprints.hits, self._fingerprints.sampled,
+                                         self._fingerprints.rehashed_tiles)
+            try:
+                job['layer_fingerprint'] = self._fingerprints.fingerprint(node)
+            except Exception as e:
+                self.log_error(f"Could not fingerprint {job['node_name']}: {str(e)}")
+        if job['layer_fingerprint'] is not None:
+            self.metrics.increment('cache_hits' if self._fingerprints.hits > reused else 'cache_misses',
+                                   cache="fingerprint")
+            job['export_digest'] = job['layer_fingerprint']
+            if job['debug']:
+                how = ("clean, sample matched" if self._fingerprints.sampled > sampled else
+                       f"{self._fingerprints.rehashed_tiles - rehashed} tile(s) re-hashed")
+                self.log_error(f"Fingerprint for {job['node_name']}: "
+                               f"{(time.perf_counter() - fingerprint_start) * 1000:.1f}ms ({how})")
+            # Nothing else reads the export, so a cache hit skips it
+            cached = self._rung_cache.get((job['export_digest'], job['ladder'][job['rung']]))
+            if cached is not None:
+                job['cached_pieces'] = cached
+                return job
+
+        # Export as PNG; the upload codec is picked per rung from the content
+        export_params = InfoObject()
+        export_params.setProperty("compression", 1)
+        export_params.setProperty("forceSRGB", True)
+        export_params.setProperty("alpha", False)
+        try:
+            # Log export attempt if debug mode
+            if job['debug']:
+                self.log_error(f"Exporting image to: {temp_file}")
+                self.log_error(f"Node bounds: {bounds.x()}, {bounds.y()}, {bounds.width()}, {bounds.height()}")
 
-                file_size = os.path.getsize(temp_file)
-                if file_size == 0:
-                    return "Error: Export file is empty"
+            # Simply save without checking return value like the original
+            node.save(temp_file, 1.0, 1.0, export_params, bounds)
 
-                if self.debug_checkbox.isChecked():
-                    self.log_error(f"Export successful, file size: {file_size} bytes")
+            # Verify file was created
+            if not os.path.exists(temp_file):
+                return "Error: Export file was not created"
 
-            except Exception as e:
-                return f"Error exporting image: {str(e)}"
+            file_size = os.path.getsize(temp_file)
+            if file_size == 0:
+                self.cleanup_job(job)
+                return "Error: Export file is empty"
 
-            # Prepare API request
-            # The mask_generator endpoint requires JSON format with base64-encoded file
-            url = "https://engine.prod.bria-api.com/v1/objects/mask_generator"
+            if job['debug']:
+                self.log_error(f"Export successful, file size: {file_size} bytes")
 
-            # Load the exported image to check dimensions and scale if needed
-            export_img = QImage(temp_file)
-            if export_img.isNull():
-                return "Error: Failed to load exported image"
+        except Exception as e:
+            self.cleanup_job(job)
+            return f"Error exporting image: {str(e)}"
+        return job
+
+    def request_mask_generation(self, job, api_key, context, token):
+        """Generate masks using /mask_generator endpoint and decode them (worker thread)"""
+        import base64
+        import hashlib
+        import urllib.error
+        import urllib.request
+        from . import net
+        temp_file = job['temp_file']
+        unique_id = job['unique_id']
+        debug = job['debug']
+
+        cached = job.pop('cached_pieces', None)
+        if cached is not None:
+            # Found through the layer fingerprint; the layer was not exported
+            return self.emit_cached_masks(job, cached, time.time(), token)
+
+        # Prepare API request
+        # The mask_generator endpoint requires JSON format with base64-encoded file
+        url = "https://engine.prod.bria-api.com/v1/objects/mask_generator"
+
+        # Load the exported image to check dimensions and scale if needed
+        export_img = QImage(temp_file)
+        if export_img.isNull():
+            return "Error: Failed to load exported image"
+
+        original_width = export_img.width()
+        original_height = export_img.height()
+        if job['guided'] and not job.get('prefetch'):
+            # Full-resolution guide for edge-aware upsampling; grayscale keeps it at one byte per pixel
+            job['guide'] = export_img.convertToFormat(QImage.Format_Grayscale8)
+
+        if debug:
+            self.log_error(f"Original exported dimensions: {original_width}x{original_height}")
+
+        # Masks for an unchanged export at this rung may already have been downloaded
+        rung_size = job['ladder'][job['rung']]
+        rung_start = time.time()
+        if job.get('export_digest') is None:
+            with open(temp_file, 'rb') as f:
+                job['export_digest'] = hashlib.sha1(f.read()).hexdigest()
+        cache_key = (job['export_digest'], rung_size)
+        # Atlas jobs have no single layer, so no prefetch can be pending for them
+        pending = self._prefetch_pending.get(job.get('node_id'))
+        if pending is not None and not job.get('prefetch'):
+            # A speculative request for this layer is in flight; its masks land in the rung cache
+            while not pending.wait(0.1):
+                token.check()
+        cached = self._rung_cache.get(cache_key)
+        if cached is not None:
+            return self.emit_cached_masks(job, cached, rung_start, token)
+        self.metrics.increment('cache_misses', cache="masks")
+        job['pieces'] = []
+
+        # Scale the longer dimension to the current ladder rung
+        scaled_width, scaled_height = proxy_size(original_width, original_height, rung_size)
+
+        if debug:
+            self.log_error(f"Scaling to: {scaled_width}x{scaled_height}")
+
+        # Scale the image
+        scaled_img = export_img.scaled(scaled_width, scaled_height,
+                                      Qt.KeepAspectRatio, Qt.SmoothTransformation)  # type: ignore
+
+        # Encode with the codec and quality that suit the content
+        encoded = self.encode_upload(job, scaled_img)
+        if encoded is None:
+            return "Error: Failed to encode scaled image"
+        if debug:
+            # Keep the uploaded file for inspection
+            scaled_temp_file = self.scratch.allocate(f"scaled_{unique_id}", encoded.suffix)
+            job['temp_files'].append(scaled_temp_file)
+            with open(scaled_temp_file, 'wb') as f:
+                f.write(encoded.data)
+
+        # Encode the scaled image as base64
+        encoded_file = base64.b64encode(encoded.data).decode('utf-8')
+        if debug:
+            self.log_error(f"Encoded file size: {len(encoded_file)} bytes")
+
+        # Prepare JSON request with base64-encoded file
+        request_data = {
+            "file": encoded_file,
+            "content_moderation": False,
+            "sync": True
+        }
 
-            original_width = export_img.width()
-            original_height = export_img.height()
+        body = json.dumps(request_data).encode('utf-8')
 
-            if self.debug_checkbox.isChecked():
-                self.log_error(f"Original exported dimensions: {original_width}x{original_height}")
+        headers = {
+            'Content-Type': 'application/json',
+            'api_token': api_key,
+            'User-Agent': 'Krita-Bria-MaskTools/1.0'
+        }
 
-            # Scale to 800px on longer dimension
-            if original_width >= original_height:
-                scaled_width = 800
-                scaled_height = round(original_height * (800.0 / original_width))
-            else:
-                scaled_height = 800
-                scaled_width = round(original_width * (800.0 / original_height))
+        # Send request with retry
+        job['sent'] = True  # Speculative requests count against the prefetch quota
+        for attempt in range(2):
+            try:
+                req = urllib.request.Request(url, data=body, headers=headers, method='POST')
+
+                # Log request details if debug mode
+                if debug:
+                    self.log_error(f"Mask generation request URL: {url}")
+                    self.log_error(f"Request headers: {headers}")
+                    self.log_error(f"Scaled image file size: {len(encoded.data)} bytes")
+
+                request_start = time.perf_counter()
+                self.count_request(job, "mask_generator", len(body))
+                with net.open_url(req, context=context, token=token, timeout=30) as response:
+                    if response.status != 200:
+                        return self.handle_error(response.status)
+                    try:
+                        response_body = net.read_response(response, token)
+                        response_data = json.loads(response_body.decode('utf-8'))
+                    except json.JSONDecodeError:
+                        return "Error: Invalid JSON response from server"
+                self.count_response("mask_generator", request_start, len(response_body))
+
+                if debug:
+                    self.log_error(f"Response data: {response_data}")
+
+                with self.metrics.timer('stage', stage='download'):
+                    result = self.download_masks(job, response_data, context, token)
+                self.record_rung(job, rung_size, rung_start)
+                if result is None:
+                    self.journal_downloaded(job, pieces=job['pieces'])
+                    self._rung_cache.put(cache_key, job.pop('pieces'))
+                return result
+
+            except JobCancelled:
+                raise
+            except urllib.error.HTTPError as e:
+                if attempt == 0:
+                    self.log_error(f"First attempt failed for mask generation: {e.code}")
+                    self.metrics.increment('retries', endpoint="mask_generator")
+                    token.sleep(1)
+                    continue
+                error_msg, error_body = self.describe_http_error(e)
+                self.log_error(f"HTTPError in mask generation: {e.code}")
+                self.log_error(f"URL: {url}")
+                self.log_error(f"Error body: {error_body}")
+                return error_msg
+            except Exception as e:
+                if attempt == 0:
+                    self.log_error(f"First attempt error in mask generation: {str(e)}")
+                    self.metrics.increment('retries', endpoint="mask_generator")
+                    token.sleep(1)
+                    continue
+                self.log_error(f"Error in mask generation: {str(e)}")
+                import traceback
+                self.log_error(traceback.format_exc())
+                return f"Error: {str(e)}"
+
+    def count_request(self, job, endpoint, nbytes):
+        """Count an API request against the quota along with its upload (worker thread)"""
+        self.metrics.increment('api_requests', endpoint=endpoint, kind="prefetch" if job.get('prefetch') else "user")
+        self.metrics.increment('bytes_sent', nbytes, endpoint=endpoint)
+
+    def count_response(self, endpoint, started, nbytes):
+        """Record the latency and size of an API response (worker thread)"""
+        self.metrics.observe('request', (time.perf_counter() - started) * 1000.0, endpoint=endpoint)
+        self.metrics.increment('bytes_received', nbytes, endpoint=endpoint)
+
+    def emit_cached_masks(self, job, pieces, started, token):
+        """Import masks downloaded earlier for the same layer pixels and rung (worker thread)"""
+        self.metrics.increment('cache_hits', cache="masks")
+        if job.get('prefetch'):
+            return None  # Already downloaded
+        for mask_name, data in pieces:
+            token.check()
+            self.emit_mask(job, mask_name, data)
+        self.record_rung(job, job['ladder'][job['rung']], started, cached=True)
+        self.journal_downloaded(job, pieces=pieces)
+        return None
 
-            if self.debug_checkbox.isChecked():
-                self.log_error(f"Scaling to: {scaled_width}x{scaled_height}")
+    def download_masks(self, job, response_data, context, token):
+        """
+        Download the masks referenced by a mask_generator response and push each one into
+        job['stream'] as soon as its bytes are decoded (worker thread).
+        Returns None on success or an error string.
+        """
+        import urllib.error
+        import urllib.request
+        from . import net
+        from .zipstream import ZipStream, LOCAL_HEADER_SIGNATURE
+        unique_id = job['unique_id']
+        debug = job['debug']
+
+        # Check for different response formats
+        objects_masks_url = response_data.get('objects_masks')
+        masks_list = response_data.get('masks', [])
+
+        if objects_masks_url:
+            # Stream the file (could be ZIP or image) and import entries as they complete
+            req = urllib.request.Request(objects_masks_url, headers={'User-Agent': 'Krita-Bria-MaskTools/1.0'})
+            try:
+                with net.open_url(req, context=context, token=token, timeout=60) as response:
+                    archive = ZipStream(net.chunk_reader(response, token), max_entry_size=MAX_MASK_FILE_BYTES,
+                                        max_total_size=MAX_MASKS_ZIP_BYTES)
+                    if archive.peek(4) == LOCAL_HEADER_SIGNATURE:
+                        result = self.stream_zip_masks(job, archive, token)
+                    else:
+                        result = self.decode_single_mask(job, archive.raw_bytes())
+                    self.metrics.increment('bytes_received', archive.received, endpoint="download")
+                    if debug:
+                        # Keep the raw download around for inspection
+                        download_file = self.scratch.allocate(f"masks_{unique_id}_download")
+                        job['temp_files'].append(download_file)
+                        with open(download_file, 'wb') as f:
+                            f.write(archive.raw_bytes())
+                        self.log_error(f"Masks download saved to: {download_file}")
+                    return result
+            except JobCancelled:
+                raise
+            except urllib.error.URLError as e:
+                return f"Error downloading masks file: {str(e)}"
+            except Exception as e:
+                return f"Error processing file: {str(e)}"
+
+        elif masks_list and isinstance(masks_list, list):
+            # Fetch and decode all masks concurrently into memory; one round trip instead of one per mask
+            from concurrent.futures import ThreadPoolExecutor
+            job['expected_masks'] = len(masks_list)
+            urls = [(idx, url) for idx, url in enumerate(masks_list) if url and isinstance(url, str)]
+
+            def fetch_and_decode(idx, url):
+                token.check()
+                data = net.fetch(url, context=context, token=token)
+                self.metrics.increment('bytes_received', len(data), endpoint="download")
+                return data, self.decode_mask(job, f"Mask {idx + 1}", data)
+
+            executor = ThreadPoolExecutor(max_workers=max(1, min(MASK_DOWNLOAD_WORKERS, len(urls))),
+                                          thread_name_prefix="bria-fetch")
+            try:
+                futures = [(idx, executor.submit(fetch_and_decode, idx, url)) for idx, url in urls]
+                # Hand masks to the importer in index order while later ones keep downloading
+                for idx, future in futures:
+                    try:
+                        data, info = future.result()
+                    except JobCancelled:
+                        raise
+                    except Exception:
+                        continue
+                    self.submit_mask(job, f"Mask {idx + 1}", data, info)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
 
-            # Scale the image
-            scaled_img = export_img.scaled(scaled_width, scaled_height,
-                                          Qt.KeepAspectRatio, Qt.SmoothTransformation)  # type: ignore
+            if job['decoded'] == 0:
+                return "Error: Failed to process any masks"
+            return None
+        else:
+            return "Error: No masks data in response"
 
-            # Save scaled image to temp file
-            scaled_temp_file = os.path.join(temp_dir, f"scaled_{unique_id}.jpg")
-            if not scaled_img.save(scaled_temp_file, "JPEG", 90):
-                return "Error: Failed to save scaled image"
+    def stream_zip_masks(self, job, archive, token):
+        """Emit the masks of a ZIP archive entry by entry while it downloads (worker thread)"""
+        import zipfile
+        from .zipstream import ArchiveTooLarge, UnsupportedStream
+        debug = job['debug']
 
-            # Read and encode the scaled image file as base64
+        def entries():
             try:
-                with open(scaled_temp_file, 'rb') as f:
-                    file_data = f.read()
-                    encoded_file = base64.b64encode(file_data).decode('utf-8')
+                yield from archive.entries()
+            except (UnsupportedStream, zipfile.BadZipFile) as e:
+                # Fall back to reading the whole archive through its central directory
+                if debug:
+                    self.log_error(f"Streaming ZIP read failed ({str(e)}), reading complete archive")
+                yield from archive.fallback_entries()
+
+        # The archive enforces the size limits while it inflates, before an oversized entry is built
+        try:
+            for filename, data in entries():
+                token.check()
+                # Check for suspicious filenames
+                if os.path.isabs(filename) or ".." in filename:
+                    return f"Error: Suspicious filename in ZIP: {filename}"
+
+                basename = os.path.basename(filename)
+
+                # Skip the panoptic map as it's not useful as a mask
+                if 'panoptic' in basename.lower():
+                    if debug:
+                        self.log_error(f"Skipping panoptic map: {basename}")
+                    continue
+
+                # Entries over the size limit arrive without their data
+                if data is None:
+                    if debug:
+                        self.log_error(f"Skipping suspiciously large file: {basename} "
+                                       f"(more than {MAX_MASK_FILE_BYTES} bytes)")
+                    continue
+
+                # Extract mask number from filename if available
+                match = re.search(r'_(\d+)\.', basename)
+                if match:
+                    mask_name = f"Object Mask {int(match.group(1))}"
+                else:
+                    mask_name = f"Mask {job['decoded'] + 1}"
+                self.emit_mask(job, mask_name, data)
+        except ArchiveTooLarge:
+            return f"Error: ZIP file too large (more than {MAX_MASKS_ZIP_BYTES} bytes extracted)"
 
-                if self.debug_checkbox.isChecked():
-                    self.log_error(f"Encoded file size: {len(encoded_file)} bytes")
-            except Exception as e:
-                return f"Error encoding image: {str(e)}"
+        if job['decoded'] == 0:
+            return "Error: No valid masks found in ZIP file"
+        return None
 
-            # Prepare JSON request with base64-encoded file
-            request_data = {
-                "file": encoded_file,
-                "content_moderation": False,
-                "sync": True
-            }
+    def decode_single_mask(self, job, data):
+        """Handle a masks download that is a single image rather than a ZIP (worker thread)"""
+        if job['debug']:
+            self.log_error("File is not a ZIP, trying as single image")
 
-            body = json.dumps(request_data).encode('utf-8')
+        # Check file size
+        if len(data) > MAX_MASK_FILE_BYTES:
+            return f"Error: Downloaded file too large ({len(data)} bytes)"
 
-            headers = {
-                'Content-Type': 'application/json',
-                'api_token': api_key,
-                'User-Agent': 'Krita-Bria-MaskTools/1.0'
-            }
+        if not self.emit_mask(job, "Generated Mask", data):
+            return f"Error: Downloaded file is not a valid image"
+        return None
 
-            # Send request with retry
-            for attempt in range(2):
-                try:
-                    req = urllib.request.Request(url, data=body, headers=headers, method='POST')
-
-                    # Log request details if debug mode
-                    if self.debug_checkbox.isChecked():
-                        self.log_error(f"Mask generation request URL: {url}")
-                        self.log_error(f"Request headers: {headers}")
-                        self.log_error(f"Scaled image file size: {os.path.getsize(scaled_temp_file)} bytes")
-
-                    with urllib.request.urlopen(req, timeout=30, context=context) as response:
-                        if response.status == 200:
-                            try:
-                                response_data = json.loads(response.read().decode('utf-8'))
-                            except json.JSONDecodeError:
-                                return "Error: Invalid JSON response from server"
-
-                            # Check for different response formats
-                            objects_masks_url = response_data.get('objects_masks')
-                            masks_list = response_data.get('masks', [])
-
-                            if self.debug_checkbox.isChecked():
-                                self.log_error(f"Response data: {response_data}")
-
-                            mask_count = 0
-
-                            import_mode = self.get_selected_mask_import_mode()
-                            node_type = {
-                                "layers": "paintlayer",
-                                "transparency": "transparencymask",
-                                "selection": "selectionmask",
-                            }[import_mode]
-
-                            parent_node_for_masks = node
-                            if import_mode == "selection" and self.add_to_new_layer_checkbox.isChecked():
-                                new_layer = document.createNode("Generated Masks Layer", "paintlayer")
-                                grandparent = node.parentNode()
-                                if grandparent:
-                                    grandparent.addChildNode(new_layer, node)
-                                else:
-                                    document.rootNode().addChildNode(new_layer, None)
-                                parent_node_for_masks = new_layer
-
-                            if objects_masks_url:
-                                # Download the file (could be ZIP or image)
-                                download_file = os.path.join(temp_dir, f"masks_{unique_id}_download")
-                                try:
-                                    urllib.request.urlretrieve(objects_masks_url, download_file)
-                                except Exception as e:
-                                    return f"Error downloading masks file: {str(e)}"
-
-                                # Check if it's a ZIP file or an image
-                                try:
-                                    # Try to open as ZIP first
-                                    with zipfile.ZipFile(download_file, 'r') as zip_ref:
-                                        # Validate ZIP contents before extraction
-                                        total_size = sum(zinfo.file_size for zinfo in zip_ref.filelist)
-                                        if total_size > 100 * 1024 * 1024:  # 100MB limit for total extracted size
-                                            return f"Error: ZIP file too large ({total_size} bytes)"
-
-                                        # Check for suspicious filenames
-                                        for zinfo in zip_ref.filelist:
-                                            if os.path.isabs(zinfo.filename) or ".." in zinfo.filename:
-                                                return f"Error: Suspicious filename in ZIP: {zinfo.filename}"
-
-                                        # Extract all files to temp directory
-                                        extract_dir = os.path.join(temp_dir, f"masks_{unique_id}_extracted")
-                                        zip_ref.extractall(extract_dir)
-
-                                        if self.debug_checkbox.isChecked():
-                                            self.log_error(f"ZIP contains files: {zip_ref.namelist()}")
-
-                                        # Process each extracted mask (walk recursively)
-                                        mask_files = []
-                                        if self.debug_checkbox.isChecked():
-                                            self.log_error(f"Walking directory: {extract_dir}")
-
-                                        for root, dirs, files in os.walk(extract_dir):
-                                            if self.debug_checkbox.isChecked() and files:
-                                                self.log_error(f"Found {len(files)} files in {root}")
-
-                                            for filename in files:
-                                                filepath = os.path.join(root, filename)
-
-                                                # Skip directories (not needed with os.walk but kept for safety)
-                                                if os.path.isdir(filepath):
-                                                    continue
-
-                                                # Validate it's actually an image file
-                                                try:
-                                                    # Use QImage to check if it's a valid image
-                                                    test_img = QImage(filepath)
-                                                    if test_img.isNull():
-                                                        if self.debug_checkbox.isChecked():
-                                                            self.log_error(f"Skipping invalid image file: {filename}")
-                                                        continue
-
-                                                    # Log successful load
-                                                    if self.debug_checkbox.isChecked():
-                                                        self.log_error(f"Successfully loaded {filename}: "
-                                                                     f"{test_img.width()}x{test_img.height()}")
-                                                except Exception as e:
-                                                    if self.debug_checkbox.isChecked():
-                                                        self.log_error(
-                                                            f"Error checking file type for {filename}: {str(e)}")
-                                                    continue
-
-                                                # Skip the panoptic map as it's not useful as a mask
-                                                if 'panoptic' in filename.lower():  # type: ignore
-                                                    if self.debug_checkbox.isChecked():
-                                                        self.log_error(f"Skipping panoptic map: {filename}")
-                                                    continue
-
-                                                # Also validate file size (skip suspiciously large files)
-                                                file_size = os.path.getsize(filepath)
-                                                if file_size > 50 * 1024 * 1024:  # 50MB limit
-                                                    if self.debug_checkbox.isChecked():
-                                                        self.log_error(
-                                                            f"Skipping suspiciously large file: {filename} "
-                                                            f"({file_size} bytes)")
-                                                    continue
-
-                                                mask_files.append((filepath, filename))
-
-                                        # Sort masks numerically if they have numbers
-                                        def extract_number(item):
-                                            filepath, filename = item
-                                            match = re.search(r'_(\d+)\.', filename)
-                                            return int(match.group(1)) if match else 999
-
-                                        mask_files.sort(key=extract_number)
-
-                                        # Iterate through list and create per-mask nodes
-                                        for idx, (mask_file, filename) in enumerate(mask_files):
-                                            # Extract mask number from filename if available
-                                            mask_num = extract_number((mask_file, filename))
-                                            if mask_num != 999:
-                                                mask_name = f"Object Mask {mask_num}"
-                                            else:
-                                                mask_name = f"Mask {idx + 1}"
-
-                                            mask_layer = document.createNode(mask_name, node_type)
-
-                                            if not mask_layer:
-                                                continue  # Skip if layer creation fails
-
-                                            # Load mask image
-                                            if self.debug_checkbox.isChecked():
-                                                self.log_error(f"Loading mask from: {mask_file}")
-
-                                            mask_image = QImage(mask_file)
-                                            if not mask_image.isNull():
-                                                if self.debug_checkbox.isChecked():
-                                                    self.log_error(
-                                                        f"Mask loaded successfully: "
-                                                        f"{mask_image.width()}x{mask_image.height()}")
-                                                    self.log_error(
-                                                        f"Original layer bounds: "
-                                                        f"{node.bounds().width()}x{node.bounds().height()}")
-
-                                                # Use helper functions for mask creation
-                                                if node_type == "transparencymask":
-                                                    # create and attach transparency mask
-                                                    # remove placeholder layer and use helper
-                                                    document.rootNode().removeChildNode(mask_layer)
-                                                    mask_layer = create_transparency_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                                elif node_type == "selectionmask":
-                                                    # remove placeholder layer and use helper
-                                                    document.rootNode().removeChildNode(mask_layer)
-                                                    mask_layer = create_selection_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                                else:
-                                                    # paintlayer: scale to original layer size and prepare pixel data
-                                                    lw = node.bounds().width()
-                                                    lh = node.bounds().height()
-                                                    mask_image = mask_image.scaled(
-                                                        lw, lh,
-                                                        Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-                                                    raw, w, h = prepare_mask_bytes(node_type, mask_image)
-                                                    mask_layer.setPixelData(raw, 0, 0, w, h)
-
-                                                # Add to document according to preference
-                                                if import_mode == "layers":
-                                                    parent = node.parentNode() or document.rootNode()
-                                                    parent.addChildNode(mask_layer, node)
-                                                else:
-                                                    parent_node_for_masks.addChildNode(mask_layer, None)
-
-                                                # Scale masks for separate layers mode
-                                                if node_type == "paintlayer":
-                                                    lw = node.bounds().width()
-                                                    lh = node.bounds().height()
-                                                    mask_image = mask_image.scaled(lw, lh,
-                                                                          Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-
-                                                mask_count += 1
-
-                                                if self.debug_checkbox.isChecked():
-                                                    self.log_error(f"Added mask: {filename}")
-                                            else:
-                                                if self.debug_checkbox.isChecked():
-                                                    self.log_error(f"Failed to load mask image: {mask_file}")
-                                except zipfile.BadZipFile:
-                                    # Not a ZIP file, try as single image
-                                    if self.debug_checkbox.isChecked():
-                                        self.log_error("File is not a ZIP, trying as single image")
-
-                                    # Validate it's actually an image file using QImage
-                                    test_img = QImage(download_file)
-                                    if test_img.isNull():
-                                        return f"Error: Downloaded file is not a valid image"
-
-                                    # Check file size
-                                    file_size = os.path.getsize(download_file)
-                                    if file_size > 50 * 1024 * 1024:  # 50MB limit
-                                        return f"Error: Downloaded file too large ({file_size} bytes)"
-
-                                    # Try to load as image
-                                    mask_image = QImage(download_file)
-                                    if not mask_image.isNull():
-                                        # Create single mask according to preference
-                                        mask_name = "Generated Mask"
-                                        mask_layer = document.createNode(mask_name, node_type)
-                                        if mask_layer:
-                                            # Use helpers for mask creation
-                                            if node_type == "transparencymask":
-                                                document.rootNode().removeChildNode(mask_layer)
-                                                mask_layer = create_transparency_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                            elif node_type == "selectionmask":
-                                                document.rootNode().removeChildNode(mask_layer)
-                                                mask_layer = create_selection_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                            else:
-                                                # paintlayer: scale to original layer size and prepare pixel data
-                                                lw = node.bounds().width()
-                                                lh = node.bounds().height()
-                                                mask_image = mask_image.scaled(
-                                                    lw, lh,
-                                                    Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-                                                raw, w, h = prepare_mask_bytes(node_type, mask_image)
-                                                mask_layer.setPixelData(raw, 0, 0, w, h)
-
-                                            # Add to document according to preference
-                                            if import_mode == "layers":
-                                                parent = node.parentNode() or document.rootNode()
-                                                parent.addChildNode(mask_layer, node)
-                                            else:
-                                                parent_node_for_masks.addChildNode(mask_layer, None)
-                                            mask_count = 1
-
-                                    # Cleanup
-                                    if not self.debug_checkbox.isChecked():
-                                        try:
-                                            os.remove(download_file)
-                                        except Exception:
-                                            pass
-                                except Exception as e:
-                                    return f"Error processing file: {str(e)}"
-                                finally:
-                                    # Cleanup ZIP and extracted files
-                                    if not self.debug_checkbox.isChecked():
-                                        try:
-                                            shutil.rmtree(extract_dir)
-                                            os.remove(download_file)
-                                        except Exception:
-                                            pass
-
-                                if mask_count > 0:
-                                    try:
-                                        document.refreshProjection()
-                                    except Exception:
-                                        pass  # Non-critical if refresh fails
-                                    return f"Generated {mask_count} masks for {node.name()}"
-                                else:
-                                    return "Error: No valid masks found in ZIP file"
-                            elif masks_list and isinstance(masks_list, list):
-                                # Iterate through list and create per-mask nodes
-                                for idx, mask_url in enumerate(masks_list):
-                                    if not mask_url or not isinstance(mask_url, str):
-                                        continue
-                                    mask_file = os.path.join(temp_dir, f"mask_{unique_id}_{idx}.png")
-                                    try:
-                                        urllib.request.urlretrieve(mask_url, mask_file)
-                                    except Exception:
-                                        continue
-
-                                    # Create a mask node for each URL
-                                    mask_name = f"Mask {idx + 1}"
-                                    mask_layer = document.createNode(mask_name, node_type)
-                                    if not mask_layer:
-                                        continue
-
-                                    # Load and scale mask image
-                                    mask_image = QImage(mask_file)
-                                    if mask_image.isNull():
-                                        continue
-                                    layer_width = node.bounds().width()
-                                    layer_height = node.bounds().height()
-                                    mask_image = mask_image.scaled(
-                                        layer_width, layer_height,
-                                        Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-
-                                    # Use helpers for mask creation
-                                    if node_type == "transparencymask":
-                                        document.rootNode().removeChildNode(mask_layer)
-                                        mask_layer = create_transparency_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                    elif node_type == "selectionmask":
-                                        document.rootNode().removeChildNode(mask_layer)
-                                        mask_layer = create_selection_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image)
-                                    else:
-                                        # paintlayer: scale to original layer size and prepare pixel data
-                                        lw = node.bounds().width()
-                                        lh = node.bounds().height()
-                                        mask_image = mask_image.scaled(
-                                            lw, lh,
-                                            Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-                                        raw, w, h = prepare_mask_bytes(node_type, mask_image)
-                                        mask_layer.setPixelData(raw, 0, 0, w, h)
-
-                                    # Add to document according to preference
-                                    if import_mode == "layers":
-                                        parent = node.parentNode() or document.rootNode()
-                                        parent.addChildNode(mask_layer, node)
-                                    else:
-                                        parent_node_for_masks.addChildNode(mask_layer, None)
-
-                                    # Scale masks for separate layers mode
-                                    if node_type == "paintlayer":
-                                        lw = node.bounds().width()
-                                        lh = node.bounds().height()
-                                        mask_image = mask_image.scaled(lw, lh,
-                                                                      Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-
-                                    mask_count += 1
-                                    if not self.debug_checkbox.isChecked():
-                                        try:
-                                            os.remove(mask_file)
-                                        except Exception:
-                                            pass
-
-                                if mask_count > 0:
-                                    try:
-                                        document.refreshProjection()
-                                    except Exception:
-                                        pass
-                                    return f"Generated {mask_count} masks for {node.name()}"
-                                else:
-                                    return "Error: Failed to process any masks"
-                            else:
-                                return "Error: No masks data in response"
-                        else:
-                            return self.handle_error(response.status)
-
-                except urllib.error.HTTPError as e:
-                    if attempt == 0:
-                        self.log_error(f"First attempt failed for mask generation: {e.code}")
-                        time.sleep(1)
-                        continue
-                    error_body = ""
-                    try:
-                        error_body = e.read().decode('utf-8')
-                        # Try to parse as JSON for better formatting
-                        try:
-                            error_json = json.loads(error_body)
-                            error_body = json.dumps(error_json, indent=2)
-                        except:
-                            pass
-                    except:
-                        pass
+    def emit_mask(self, job, mask_name, data):
+        """Decode and analyse mask bytes, then hand them to the streaming importer, largest objects first"""
+        if job.get('atlas') is not None:
+            return self.slice_atlas_mask(job, mask_name, data, self.decode_mask(job, mask_name, data))
+        return self.submit_mask(job, mask_name, data, self.decode_mask(job, mask_name, data))
+
+    def decode_mask(self, job, mask_name, data):
+        """
+        Decode, clean up and analyse one mask; returns a MaskInfo, or None for invalid data.
+        Touches no shared job state, so several masks can be decoded in parallel (worker threads).
+        """
+        if job.get('prefetch'):
+            return None  # Prefetched masks are decoded when the user asks for them
+        decode_start = time.perf_counter()
+        # Decoding into a QImage is safe off the GUI thread
+        mask_image = QImage.fromData(data)
+        if mask_image.isNull():
+            if job['debug']:
+                self.log_error(f"Skipping invalid image data: {mask_name}")
+            return None
+
+        settings = job['morphology']
+        if not settings.is_noop() and job['layer_width']:
+            # One vectorized pass on the compact mask instead of Krita filters on full-canvas nodes
+            cleanup_start = time.time()
+            mask_image = postprocess_mask(mask_image, settings.scaled(mask_image.width() / float(job['layer_width'])))
+            if job['debug']:
+                self.log_error(f"Mask cleanup ({backend_name()}) for {mask_name}: "
+                               f"{int((time.time() - cleanup_start) * 1000)}ms")
+
+        info = analyze_mask(mask_name, mask_image)
+        self.metrics.observe('stage', (time.perf_counter() - decode_start) * 1000.0, stage='decode')
+        if job['debug']:
+            self.log_error(f"Mask decoded: {mask_name} {mask_image.width()}x{mask_image.height()}, "
+                           f"{info.area:.1%} area, bbox {info.bbox}, {info.components} region(s)")
+        return info
+
+    def submit_mask(self, job, mask_name, data, info):
+        """Filter, merge and queue a decoded mask; calls for one job must come in order from one thread"""
+        if job.get('prefetch'):
+            # Speculative download: only the bytes are kept, for the rung cache
+            job['decoded'] += 1
+            job['pieces'].append((mask_name, data))
+            return True
+        if info is None:
+            return False
+        job['decoded'] += 1
+        if job.get('pieces') is not None:
+            job['pieces'].append((mask_name, data))
+
+        if info.area < job['min_area'] or info.area == 0:
+            # Fragments below the threshold never become Krita nodes
+            job['filtered'] += 1
+            return True
+        if job.get('refine_targets') is not None:
+            # Refining: keep only the higher-resolution versions of the masks picked in the preview
+            target = self.match_refine_target(job, info)
+            if target is None:
+                job['unmatched'] += 1
+                return True
+            info.name = target.name
+
+        if job['dedupe_iou']:
+            # Greedy clustering: compare against the masks kept so far for this layer
+            duplicate = find_duplicate(info, job['kept'], job['dedupe_iou'])
+            if duplicate is not None:
+                merged = union_masks(duplicate, info)
+                if job['stream'].replace(duplicate, merged, priority=merged.area):
+                    job['kept'][job['kept'].index(duplicate)] = merged
+                # If the kept mask was already imported the duplicate is dropped instead
+                job['merged'] += 1
+                if job['debug']:
+                    self.log_error(f"Merged near-duplicate {mask_name} into {duplicate.name}")
+                return True
+            job['kept'].append(info)
+
+        job['stream'].put(info, priority=info.area)
+        return True
+
+    def new_mask_stream(self):
+        """Stream feeding decoded masks to a running import generator"""
+        return ResultStream(notify=lambda: self._main_queue.post(self._import_scheduler.wake))
+
+    def record_rung(self, job, size, started, cached=False):
+        """Record how long one ladder rung took from request to last decoded mask (worker thread)"""
+        elapsed_ms = int((time.time() - started) * 1000)
+        job['rung_timings'].append((size, elapsed_ms, cached))
+        if job['debug']:
+            self.log_error(f"Rung {size}px for {job['node_name']}: {elapsed_ms}ms" + (" (cached)" if cached else ""))
+
+    def match_refine_target(self, job, info):
+        """Return the picked preview mask that info refines, removing it from the targets, or None"""
+        targets = job.get('refine_analysis')
+        if targets is None:
+            # Compare at the refined size so both analysis bitmaps have the same shape
+            w, h = info.image.width(), info.image.height()
+            targets = [analyze_mask(t.name, t.image.scaled(w, h, Qt.IgnoreAspectRatio,
+                                                           Qt.SmoothTransformation))  # type: ignore
+                       for t in job['refine_targets']]
+            job['refine_analysis'] = targets
+        target = find_duplicate(info, targets, REFINE_MATCH_IOU)
+        if target is not None:
+            targets.remove(target)
+        return target
+
+    def upsample_mask(self, job, mask_image):
+        """Upsample a mask to full layer resolution guided by the layer's edges, if enabled (at import)"""
+        guide = job.get('guide')
+        if guide is None or mask_image.size() == guide.size():
+            return mask_image
+        upsample_start = time.time()
+        mask_image = guided_upsample.guided_upsample(mask_image, guide)
+        if job['debug']:
+            self.log_error(f"Guided upsample to {guide.width()}x{guide.height()}: "
+                           f"{int((time.time() - upsample_start) * 1000)}ms")
+        return mask_image
+
+    def upsampled_bands(self, job, mask_image, document):
+        """
+        Document-sized bands of a guided upsample of mask_image for the banded mask writers, or None
+        to let them scale it plainly. A guide covering the whole canvas is filtered band by band as
+        the bands are written, so no full-resolution mask is built.
+        """
+        guide = job.get('guide')
+        if guide is None or mask_image.size() == guide.size():
+            return None
+        width, height = document.width(), document.height()
+        if (guide.width(), guide.height()) == (width, height):
+            return guided_upsample.iter_guided_bands(mask_image, guide)
+        return iter_scaled_bands(self.upsample_mask(job, mask_image), width, height)
+
+    def apply_mask_generation(self, job, stream, document):
+        """
+        Create one Krita node per decoded mask (GUI thread).
+        This is a generator driven by the ImportScheduler: masks are imported from the stream
+        while the download is still running, yielding (done, total) after each one, None after
+        each band of its pixels and WAIT while no new mask is available yet.
+        """
+        node_type = MASK_NODE_TYPES[job['import_mode']]
+        labels = []
+        failed_before = self.mutations(job, document).failed
+
+        if job['debug']:
+            self.log_error(f"Original layer bounds: {job['layer_width']}x{job['layer_height']}")
+
+        mask_count = 0
+        while True:
+            info = stream.take()
+            if info is None:
+                if stream.exhausted():
+                    break
+                yield WAIT
+                continue
+
+            if mask_count == 0 and self.outputs_present(document, job.get('resume_outputs')):
+                job['outputs'] = job['resume_outputs']
+                return f"Skipped {job['node_name']}: already processed in an interrupted batch"
+            if job['pick']:
+                # Preview only: the user decides which masks become nodes
+                self.mask_picker.add_mask(job, info)
+                mask_count += 1
+            elif node_type is None:
+                # Painted into the label map once every mask is in
+                labels.append(info)
+                mask_count += 1
+            elif self.import_mask(document, job, self.mask_parent(job, document), node_type, info.name, info.image):
+                mask_count += 1
+                if job['debug']:
+                    self.log_error(f"Added mask: {info.name}")
+            if mask_count == 1 and 'first_mask_ms' not in job:
+                job['first_mask_ms'] = int((time.time() - job['started']) * 1000)
+            # One scheduler step per band of the mask's canvas-sized write
+            yield from self.mutations(job, document).iter_flush()
+            total = job.get('expected_masks') or mask_count + stream.pending()
+            yield mask_count, max(total, mask_count)
+
+        if mask_count == 0:
+            job['keep_export'] = False
+            if job['filtered'] and not stream.error:
+                return f"Error: All {job['filtered']} masks were below the minimum area for {job['node_name']}"
+            return stream.error or "Error: Failed to process any masks"
+
+        rungs = describe_timings(job['rung_timings'])
+        if job['pick']:
+            return (f"{mask_count} masks ready to pick for {job['node_name']} "
+                    f"(first preview after {job['first_mask_ms']}ms, {job['filtered']} below minimum area, "
+                    f"rungs: {rungs})")
+        if node_type is None:
+            result = yield from self.build_label_map(job, labels)
+            return f"{result}, rungs: {rungs}" + (f" - incomplete: {stream.error}" if stream.error else "")
+
+        yield from self.mutations(job, document).iter_flush()  # Committed with the rest of the batch
+        result = (f"Generated {mask_count} masks for {job['node_name']} "
+                  f"(first mask after {job['first_mask_ms']}ms, "
+                  f"total {int((time.time() - job['started']) * 1000)}ms)")
+        if job['filtered']:
+            result += f", {job['filtered']} below minimum area skipped"
+        if job['merged']:
+            result += f", {job['merged']} near-duplicates merged"
+        if job.get('unmatched'):
+            result += f", {job['unmatched']} unpicked masks dropped"
+        failed = self.mutations(job, document).failed - failed_before
+        if failed:
+            result += f", {failed} document changes failed (see log)"
+        result += f", rungs: {rungs}"
+        if stream.error:
+            result += f" - incomplete: {stream.error}"
+        return result
+
+    def mutations(self, job, document):
+        """Return the DocumentBatch collecting the job's document changes"""
+        if job.get('mutations') is None:
+            job['mutations'] = DocumentBatch(document, log_error=self.log_error)
+        return job['mutations']
+
+    def mask_parent(self, job, document):
+        """Return the node masks are attached to, creating the optional masks layer on first use"""
+        if job.get('mask_parent') is None:
+            node = job['node']
+            job['mask_parent'] = node
+            if job['import_mode'] == "selection" and job['add_to_new_layer']:
+                new_layer = document.createNode("Generated Masks Layer", "paintlayer")
+                grandparent = node.parentNode()
+                if grandparent:
+                    self.mutations(job, document).add_node(grandparent, new_layer, node)
+                else:
+                    self.mutations(job, document).add_node(document.rootNode(), new_layer, None)
+                job['mask_parent'] = new_layer
+        return job['mask_parent']
+
+    def import_picked_masks(self, entries):
+        """Materialize the masks ticked in the picker, one scheduler task per source layer"""
+        by_job = {}
+        for job, info in entries:
+            by_job.setdefault(id(job), (job, []))[1].append(info)
+        refine = []
+        for job, infos in by_job.values():
+            if job.get('progressive') and job['rung'] + 1 < len(job['ladder']):
+                refine.append((job, infos))
+            else:
+                self._import_scheduler.submit(self.import_mask_infos(job, infos),
+                                              lambda result: self.status_label.append(result), lane=INTERACTIVE)
+        if refine:
+            self.refine_picked_masks(refine)
+
+    def release_picked_masks(self, entries):
+        """Drop the exports kept for refining masks that were discarded from the picker"""
+        for job in {id(job): job for job, _ in entries}.values():
+            if job.get('keep_export'):
+                job['keep_export'] = False
+                self.cleanup_job(job)
+
+    def prepare_refine(self, job, infos):
+        """Derive the next-rung job for masks picked from a progressive preview (GUI thread)"""
+        refine = dict(job)
+        refine['rung'] = job['rung'] + 1
+        final = refine['rung'] == len(job['ladder']) - 1
+        # Intermediate rungs go back to the picker; the last one is imported
+        refine['pick'] = not final
+        refine['keep_export'] = not final
+        refine['refine_targets'] = infos
+        refine['refine_analysis'] = None
+        refine['unmatched'] = 0
+        refine['decoded'] = refine['filtered'] = refine['merged'] = 0
+        refine['kept'] = []
+        refine['rung_timings'] = list(job['rung_timings'])
+        refine['started'] = time.time()
+        refine['stream'] = self.new_mask_stream()
+        for key in ('guide', 'pieces', 'first_mask_ms', 'expected_masks', 'cached_pieces'):
+            refine.pop(key, None)
+        # The refine job holds its own references to the export; the preview lets go of it
+        refine['temp_files'] = list(job['temp_files'])
+        for path in refine['temp_files']:
+            self.scratch.acquire(path)
+        job['keep_export'] = False
+        self.cleanup_job(job)
+        return refine
+
+    def refine_picked_masks(self, items):
+        """Request the next ladder rung for [(job, picked MaskInfo list), ...] and import the matches"""
+        if self._interactive_runner is not None:
+            # Put the picks back so they are not lost
+            for job, infos in items:
+                for info in infos:
+                    self.mask_picker.add_mask(job, info, checked=True)
+            self.status_label.append("Error: Wait for the active layer to finish before refining")
+            return
 
-                    # Special handling for 401 errors
-                    if e.code == 401:
-                        error_msg = ("INVALID API KEY\n\n"
-                                   "Your API key was rejected by BriaAI.\n\n"
-                                   "Please check:\n"
-                                   "• You've entered the correct API key\n"
-                                   "• No extra spaces or quotes in the key\n"
-                                   "• The key hasn't expired\n\n"
-                                   "To get a valid API key:\n"
-                                   "1. Go to https://www.bria.ai\n"
-                                   "2. Sign up for a free account (no credit card)\n"
-                                   "3. Copy your API key from the dashboard\n"
-                                   "4. Paste it in the API Key field above\n\n"
-                                   f"Error details: {error_body}")
-                        # Highlight the API key field with error
-                        self.highlight_invalid_api_key()
-                    else:
-                        error_msg = f"{self.handle_error(e.code)} - Details: {error_body}"
-
-                    self.log_error(f"HTTPError in mask generation: {e.code}")
-                    self.log_error(f"URL: {url}")
-                    self.log_error(f"Error body: {error_body}")
-                    return error_msg
-                except Exception as e:
-                    if attempt == 0:
-                        self.log_error(f"First attempt error in mask generation: {str(e)}")
-                        time.sleep(1)
-                        continue
-                    self.log_error(f"Error in mask generation: {str(e)}")
-                    import traceback
-                    self.log_error(traceback.format_exc())
-                    return f"Error: {str(e)}"
+        self.load_api_key()
+        try:
+            from . import net
+            context, _ = net.session_ssl_context()
+        except Exception as e:
+            self.status_label.append(f"Error creating SSL context: {str(e)}")
+            return
+        api_key = self.api_key
+
+        def on_result(item, result):
+            self.status_label.append(result)
+
+        # One deferred projection refresh per document once every refinement is imported
+        mutations = {}
+
+        def prepare(item):
+            document = item[0]['document']
+            refine = self.prepare_refine(*item)
+            refine['mutations'] = mutations.setdefault(id(document),
+                                                       DocumentBatch(document, log_error=self.log_error))
+            return refine
+
+        def on_finished(cancelled):
+            self._interactive_runner = None
+            for batch in mutations.values():
+                batch.commit()
+            if cancelled:
+                self.status_label.append("Refinement cancelled.")
+            self.save_metrics()
+            self.enable_ui()
 
-        finally:
-            if temp_file and os.path.exists(temp_file) and not self.debug_checkbox.isChecked():
-                try:
-                    os.remove(temp_file)
-                except Exception:
-                    pass  # Ignore cleanup errors
+        self.action_button.setEnabled(False)
+        self.status_label.append(f"Refining {sum(len(infos) for _, infos in items)} picked masks...")
+        self._interactive_runner = BatchRunner(
+            self._main_queue, items,
+            prepare=prepare,
+            work=lambda job, token: self.request_mask_generation(job, api_key, context, token),
+            apply=lambda job, payload: self.apply_mask_generation(job, payload, job['document']),
+            cleanup=self.cleanup_job,
+            on_result=on_result,
+            on_finished=on_finished,
+            max_workers=len(items),
+            scheduler=self._import_scheduler,
+            on_job_result=self.record_job_result,
+            lane=INTERACTIVE)
+        self._interactive_runner.start()
+
+    def import_mask_infos(self, job, infos):
+        """Generator importing a list of MaskInfo for one job, yielding (done, total) per mask and None per band"""
+        document = job['document']
+        node_type = MASK_NODE_TYPES[job['import_mode']]
+        if node_type is None:
+            return (yield from self.build_label_map(job, infos))
+        mask_count = 0
+        for idx, info in enumerate(infos):
+            if self.import_mask(document, job, self.mask_parent(job, document), node_type, info.name, info.image):
+                mask_count += 1
+            yield from self.mutations(job, document).iter_flush()
+            yield idx + 1, len(infos)
+        self.mutations(job, document).commit()
+        return f"Imported {mask_count} picked masks for {job['node_name']}"
+
+    def build_label_map(self, job, infos):
+        """
+        Generator painting a layer's masks into its label map, largest first, yielding (done, total)
+        per mask and None per band of map rows
+        """
+        build_start = time.perf_counter()
+        infos = sorted(infos, key=lambda info: info.area, reverse=True)
+        first = infos[0].image
+        label_map = LabelMap(first.width(), first.height(), job['layer_bounds'])
+        for idx, info in enumerate(infos):
+            yield from label_map.iter_add(info.name, info.image)
+            yield idx + 1, len(infos)
+        self._label_maps.put(job['node_id'], label_map)
+        if job['debug']:
+            self.log_error(f"Label map for {job['node_name']}: {label_map.width}x{label_map.height}, "
+                           f"{label_map.nbytes // 1024} KiB, {int((time.perf_counter() - build_start) * 1000)}ms")
+        return (f"Stored a label map of {len(label_map)} objects for {job['node_name']}; "
+                f"click an object with 'Click to select objects' checked to select it")
+
+    def import_mask(self, document, job, parent_node_for_masks, node_type, mask_name, mask_image):
+        """Create a single mask node of node_type from a decoded mask image"""
+        node = job['node']
+        mutations = self.mutations(job, document)
+
+        # Use helper functions for mask creation; they queue the attach on the job's mutations
+        if node_type == "transparencymask":
+            mask_layer = create_transparency_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image,
+                                                              batch=mutations,
+                                                              bands=self.upsampled_bands(job, mask_image, document))
+        elif node_type == "selectionmask":
+            mask_layer = create_selection_mask_from_qimage(document, parent_node_for_masks, mask_name, mask_image,
+                                                           batch=mutations,
+                                                           bands=self.upsampled_bands(job, mask_image, document))
+        else:
+            mask_layer = document.createNode(mask_name, node_type)
+            if not mask_layer:
+                return None  # Skip if layer creation fails
+            mask_image = self.upsample_mask(job, mask_image)
+            # paintlayer: scale to original layer size and convert to the document's pixel layout
+            mask_image = mask_image.scaled(
+                job['layer_width'], job['layer_height'],
+                Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
+            color = (document.colorModel(), document.colorDepth(), document.colorProfile())
+            pixels = pixel_data(mask_image, *color)
+
+            # Add to document according to preference
+            if job['import_mode'] == "layers":
+                mutations.add_node(node.parentNode() or document.rootNode(), mask_layer, node)
+            else:
+                mutations.add_node(parent_node_for_masks, mask_layer, None)
+            mutations.call(write_pixels, mask_layer, mask_image, pixels, *color)
+        job.setdefault('outputs', []).append(mask_layer.uniqueId().toString())
+        return mask_layer
 
     def handle_error(self, status_code):
         error_messages = {
@@ -1344,8 +2712,14 @@ class BriaMaskTools(QDockWidget):
         # Also print to stdout for better visibility
         print(full_message)
 
-        # Also append to status label if in debug mode
-        if hasattr(self, 'debug_checkbox') and self.debug_checkbox.isChecked():
+        # Also append to status label if in debug mode; widgets may only be touched on the GUI thread
+        if threading.current_thread() is not getattr(self, '_gui_thread', threading.current_thread()):
+            self._main_queue.post(self.append_debug_message, message)
+        else:
+            self.append_debug_message(message)
+
+    def append_debug_message(self, message):
+        if self.debug_enabled():
             self.status_label.append(f"DEBUG: {message}")
 
     def highlight_invalid_api_key(self):
@@ -1357,17 +2731,44 @@ class BriaMaskTools(QDockWidget):
             self.api_key_input.setStyleSheet("QLineEdit { border: 2px solid red; }")  # type: ignore
 
     def enable_ui(self):
-        """Re-enable all UI elements after processing"""
-        self.action_button.setEnabled(True)
-        self.batch_checkbox.setEnabled(True)
+        """Re-enable the UI elements whose lane is free after processing"""
+        interactive_free = self._interactive_runner is None
+        self.action_button.setEnabled(interactive_free)
+        self.batch_checkbox.setEnabled(self._runner is None)
         for button in [self.remove_bg_radio, self.generate_mask_radio]:
-            button.setEnabled(True)
+            button.setEnabled(interactive_free)
+
+    def toggle_batch_pause(self):
+        """Pause or resume exporting new layers of the running batch"""
+        if self._runner is None:
+            return
+        if self._runner.is_paused():
+            self._runner.resume()
+            self.pause_button.setText("Pause Batch")
+            self.status_label.append("Batch resumed.")
+        else:
+            self._runner.pause()
+            self.pause_button.setText("Resume Batch")
+            self.status_label.append("Batch paused; layers already sent will still finish.")
 
     def canvasChanged(self, canvas):
-        pass
+        """The active view changed: forget the fingerprints of layers resized or converted since they were taken"""
+        try:
+            document = Krita.instance().activeDocument()
+            changed = self._fingerprints.invalidate_changed(document) if document else 0
+        except Exception:
+            return
+        if changed and self.debug_enabled():
+            self.log_error(f"{changed} layer fingerprint(s) invalidated after bounds or colour space changes")
+        if self._ui_built:
+            self.watch_canvas_widgets()  # A new view brings its own canvas widget
 
     def showEvent(self, event):
+        if not self._ui_built:
+            self.build_ui()
+            self.watch_canvas_widgets()
         super().showEvent(event)
+        self.toggle_prefetch()
         # Register with current canvas when shown
         try:
             window = Krita.instance().activeWindow()
@@ -1381,6 +2782,7 @@ class BriaMaskTools(QDockWidget):
 
     def hideEvent(self, event):
         super().hideEvent(event)
+        self.toggle_prefetch()
         # Unregister from canvas when hidden
         try:
             if hasattr(self, '_canvas') and self._canvas:
@@ -1389,22 +2791,115 @@ class BriaMaskTools(QDockWidget):
         except Exception:
             pass
 
+    # ------------------------------------------------------------
+    # Label maps: select the object under a point
+    # ------------------------------------------------------------
+    def watch_canvas_widgets(self):
+        """
+        Filter the active window's canvas widgets: strokes and key presses mark the active layer's
+        fingerprint dirty, and clicks select objects while click-to-select is checked
+        """
+        for widget in self._canvas_widgets:
+            try:
+                widget.removeEventFilter(self)
+            except RuntimeError:
+                pass  # Widget already deleted with its view
+        self._canvas_widgets = []
+        try:
+            window = Krita.instance().activeWindow()
+            if window is None:
+                return
+            self._canvas_widgets = [widget for widget in window.qwindow().findChildren(QWidget)
+                                    if widget.metaObject().className() in CANVAS_WIDGET_CLASSES]
+        except Exception:
+            return
+        for widget in self._canvas_widgets:
+            widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        kind = event.type()
+        if kind in (QEvent.MouseButtonPress, QEvent.TabletPress, QEvent.KeyPress) and obj in self._canvas_widgets:
+            if (kind == QEvent.MouseButtonPress and self.click_select_checkbox.isChecked()
+                    and event.button() == Qt.LeftButton and event.modifiers() == Qt.NoModifier):
+                self.select_object_at_widget(obj, event.pos())
+                return True  # The click selects instead of starting a stroke
+            self.mark_active_layer_dirty()
+        return super().eventFilter(obj, event)
+
+    def mark_active_layer_dirty(self):
+        """A stroke or shortcut may edit the active layer; its next fingerprint lookup reads its tiles"""
+        try:
+            document = Krita.instance().activeDocument()
+            node = document.activeNode() if document else None
+            if node is not None:
+                self._fingerprints.mark_dirty(node.uniqueId().toString())
+        except Exception:
+            pass
+
+    def select_object_at_cursor(self):
+        """Select the object under the mouse cursor (for the shortcut action)"""
+        position = QCursor.pos()
+        widget = QApplication.widgetAt(position)
+        if widget is None or widget.metaObject().className() not in CANVAS_WIDGET_CLASSES:
+            self.status_label.append("Error: Move the cursor over the canvas to select an object")
+            return
+        self.select_object_at_widget(widget, widget.mapFromGlobal(position))
+
+    def select_object_at_widget(self, widget, pos):
+        """Map a canvas widget position to image pixels through the active view and select the object there"""
+        window = Krita.instance().activeWindow()
+        view = window.activeView() if window else None
+        if view is None or view.document() is None:
+            return
+        if not hasattr(view, 'flakeToImageTransform'):
+            self.status_label.append("Error: Selecting objects on the canvas requires Krita 5.2 or newer")
+            return
+        canvas_to_flake, invertible = view.flakeToCanvasTransform().inverted()
+        if not invertible:
+            return
+        point = view.flakeToImageTransform().map(canvas_to_flake.map(QPointF(pos)))
+        self.select_object_at(view.document(), point.x(), point.y())
+
+    def select_object_at(self, document, x, y):
+        """Replace the selection with the label-map object at image pixel (x, y); returns its name or None"""
+        active = document.activeNode()
+        active_map = self._label_maps.get(active.uniqueId().toString()) if active is not None else None
+        candidates = [active_map] if active_map is not None else []
+        # Then any other labelled layer of this document under the point
+        candidates += [label_map for node_id, label_map in self._label_maps.items()
+                       if label_map not in candidates and document.nodeByUniqueID(QUuid(node_id))]
+        for label_map in candidates:
+            label = label_map.pick(x, y)
+            if label:
+                image, rect = label_map.object_mask(label)
+                document.setSelection(create_selection_from_qimage(document, image, *rect))
+                self.status_label.append(f"Selected {label_map.names[label]}")
+                return label_map.names[label]
+        if not candidates:
+            self.status_label.append("Error: No label map for this document; generate masks with the "
+                                     "'Label map' import mode first")
+        else:
+            self.status_label.append("No object under the cursor")
+        return None
+
     # ------------------------------------------------------------
     # Helper: determine the desired mask import mode
     # ------------------------------------------------------------
     def get_selected_mask_import_mode(self):
-        """Return one of 'selection', 'transparency', 'layers' depending on UI choice"""
+        """Return one of 'selection', 'transparency', 'layers', 'labels' depending on UI choice"""
         idx = 0
         try:
             idx = self.mask_import_combo.currentIndex()
         except Exception:
             pass  # Fallback if combo not yet initialised
 
-        # 0 = Selection masks, 1 = Transparency masks, 2 = Layers
+        # 0 = Selection masks, 1 = Transparency masks, 2 = Layers, 3 = Label map
         if idx == 0:
             return "selection"
         elif idx == 1:
             return "transparency"
+        elif idx == 3:
+            return "labels"
         else:
             return "layers"
 
@@ -1443,7 +2938,8 @@ class BriaMaskToolsExtension(krita.Extension):
         self.actions = []
 
     def setup(self):
-        pass
+        # Remove scratch directories left behind by crashed sessions without delaying startup
+        threading.Thread(target=scratch.sweep_stale, daemon=True).start()
 
     def createActions(self, window):
         # Create action for BriaAI settings
@@ -1460,6 +2956,11 @@ class BriaMaskToolsExtension(krita.Extension):
         main_action.triggered.connect(self.toggle_docker)
         self.actions.append(main_action)
 
+        # Selects the label-map object under the cursor; meant for a keyboard shortcut
+        select_action = window.createAction("bria_select_object", "Bria: Select Object Under Cursor", "")
+        select_action.triggered.connect(self.select_object)
+        self.actions.append(select_action)
+
     def show_settings(self):
         """Show the BriaAI settings dialog"""
         # Create a new settings dialog directly
@@ -1499,6 +3000,12 @@ class BriaMaskToolsExtension(krita.Extension):
 
         return None
 
+    def select_object(self):
+        """Select the object under the cursor from the docker's label maps"""
+        docker = self.find_docker()
+        if docker is not None and docker._ui_built:
+            docker.select_object_at_cursor()
+
     # Removed execute_mode since we're not using hotkey actions anymore
 
     # Removed toggle_batch_mode since we're not using hotkey actions anymore
@@ -0,0 +1,165 @@
+"""
+Label maps for Bria Mask Tools.
+In label-map import mode a layer's masks do not become Krita nodes: they are painted into one
+label per pixel at the masks' own resolution (0 is background), and the objects' bounding boxes
+are kept in a coarse grid. Turning the object under a point into a selection is then a label
+lookup plus a scan of that object's box, without another request or any node in the document.
+"""
+
+import re
+from array import array
+from collections import OrderedDict
+
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import Qt  # type: ignore
+
+from .mask_utils import _strip_padding
+
+# Label maps kept in memory (an 800x600 map is 469 KiB, twice that past 255 objects)
+MAX_MAPS = 16
+# Edge of the grid cells indexing object boxes, in map pixels
+GRID_CELL = 32
+# Masks are painted into a map in bands of rows holding about this many pixels
+BAND_PIXELS = 256 * 1024
+
+_OBJECT = bytes(1 if value >= 128 else 0 for value in range(256))
+_RUNS = re.compile(b'\x01+')
+
+
+class LabelMap:
+    """One label per mask pixel for a layer, with the objects' names and a grid index of their boxes."""
+
+    def __init__(self, width, height, bounds):
+        self.width = width
+        self.height = height
+        self.bounds = bounds            # (x, y, w, h) of the layer in image pixels
+        self.labels = bytearray(width * height)
+        self.names = [None]             # Indexed by label
+        self.boxes = [None]             # (x0, y0, x1, y1) in map pixels, exclusive end
+        self._grid = {}                 # (column, row) -> labels whose box touches the cell
+
+    def __len__(self):
+        return len(self.names) - 1
+
+    @property
+    def nbytes(self):
+        return len(self.labels) * self.labels.itemsize if isinstance(self.labels, array) else len(self.labels)
+
+    def add(self, name, image: QImage):
+        """
+        Paint a mask over the map and return its label, or 0 if the mask is empty.
+        Pixels already labelled are taken over, so add larger objects first to keep nested ones reachable.
+        """
+        steps = self.iter_add(name, image)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as stop:
+                return stop.value
+
+    def iter_add(self, name, image: QImage, band_pixels=BAND_PIXELS):
+        """Generator form of add() yielding after each band of rows; returns the label."""
+        if image.width() != self.width or image.height() != self.height:
+            image = image.scaled(self.width, self.height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
+        raw, _, _ = _strip_padding(image.convertToFormat(QImage.Format_Grayscale8))
+        label = len(self.names)
+        if label == 256:
+            self.labels = array('H', iter(self.labels))  # From a bytes-like object array() would reinterpret
+        fill = array('H', [label]) if isinstance(self.labels, array) else bytes((label,))
+
+        # Set pixels come in runs; a run may wrap from one row into the next
+        x0 = y0 = None
+        x1 = y1 = 0
+        band = max(1, band_pixels // self.width) * self.width
+        for offset in range(0, len(raw), band):
+            for run in _RUNS.finditer(raw[offset:offset + band].translate(_OBJECT)):
+                start, end = offset + run.start(), offset + run.end()
+                self.labels[start:end] = fill * (end - start)
+                first, last = start // self.width, (end - 1) // self.width
+                left, right = (start % self.width, (end - 1) % self.width + 1) if first == last else (0, self.width)
+                x0 = left if x0 is None else min(x0, left)
+                x1 = max(x1, right)
+                y0 = first if y0 is None else y0
+                y1 = last + 1
+            yield
+        if x0 is None:
+            return 0
+
+        self.names.append(name)
+        self.boxes.append((x0, y0, x1, y1))
+        for row in range(y0 // GRID_CELL, (y1 - 1) // GRID_CELL + 1):
+            for column in range(x0 // GRID_CELL, (x1 - 1) // GRID_CELL + 1):
+                self._grid.setdefault((column, row), []).append(label)
+        return label
+
+    def to_map(self, image_x, image_y):
+        """Map pixel (x, y) under an image point, or None outside the layer."""
+        x, y, w, h = self.bounds
+        if w <= 0 or h <= 0:
+            return None
+        mx, my = int((image_x - x) * self.width / w), int((image_y - y) * self.height / h)
+        if 0 <= mx < self.width and 0 <= my < self.height:
+            return mx, my
+        return None
+
+    def pick(self, image_x, image_y):
+        """
+        Label of the object at an image point, or 0. On background (a hole or a gap between strands),
+        the smallest object whose box contains the point is picked.
+        """
+        point = self.to_map(image_x, image_y)
+        if point is None:
+            return 0
+        mx, my = point
+        label = self.labels[my * self.width + mx]
+        if label:
+            return label
+        best, best_area = 0, None
+        for candidate in self._grid.get((mx // GRID_CELL, my // GRID_CELL), ()):
+            x0, y0, x1, y1 = self.boxes[candidate]
+            area = (x1 - x0) * (y1 - y0)
+            if x0 <= mx < x1 and y0 <= my < y1 and (best_area is None or area < best_area):
+                best, best_area = candidate, area
+        return best
+
+    def object_mask(self, label):
+        """Return (8-bit QImage of the object's box, (x, y, w, h) the box covers in image pixels)."""
+        x0, y0, x1, y1 = self.boxes[label]
+        if isinstance(self.labels, array):
+            data = bytes(255 if value == label else 0
+                         for y in range(y0, y1) for value in self.labels[y * self.width + x0:y * self.width + x1])
+        else:
+            table = bytes(255 if value == label else 0 for value in range(256))
+            data = b"".join(self.labels[y * self.width + x0:y * self.width + x1].translate(table)
+                            for y in range(y0, y1))
+        image = QImage(data, x1 - x0, y1 - y0, x1 - x0, QImage.Format_Grayscale8).copy()
+
+        x, y, w, h = self.bounds
+        sx, sy = w / float(self.width), h / float(self.height)
+        left, top = x + int(x0 * sx), y + int(y0 * sy)
+        right, bottom = x + int(round(x1 * sx)), y + int(round(y1 * sy))
+        return image, (left, top, max(1, right - left), max(1, bottom - top))
+
+
+class LabelMaps:
+    """Label maps by layer node id, least recently used dropped first; GUI thread only."""
+
+    def __init__(self, max_maps=MAX_MAPS):
+        self.max_maps = max_maps
+        self._maps = OrderedDict()
+
+    def put(self, node_id, label_map):
+        self._maps[node_id] = label_map
+        self._maps.move_to_end(node_id)
+        while len(self._maps) > self.max_maps:
+            self._maps.popitem(last=False)
+
+    def get(self, node_id):
+        label_map = self._maps.get(node_id)
+        if label_map is not None:
+            self._maps.move_to_end(node_id)
+        return label_map
+
+    def items(self):
+        """(node id, map) pairs, most recently used first."""
+        return list(reversed(self._maps.items()))
@@ -0,0 +1,90 @@
+"""
+Thumbnail picker shown in the docker when masks are previewed before import.
+Only the masks the user ticks are materialized as Krita nodes.
+"""
+
+from PyQt5.QtWidgets import (QGroupBox, QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem,
+                             QPushButton, QListView)
+from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtCore import Qt, QSize, pyqtSignal
+
+from .mask_analysis import THUMBNAIL_SIZE
+
+
+class MaskPickerWidget(QGroupBox):
+    """
+    Lists pending masks as checkable thumbnails; emits import_requested([(job, MaskInfo), ...]),
+    and discarded(...) with the entries of layers that are dropped without an import.
+    """
+
+    import_requested = pyqtSignal(list)
+    discarded = pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        super().__init__("Pick Masks", parent)
+        self._entries = []
+
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        self.list_widget = QListWidget()
+        self.list_widget.setViewMode(QListView.IconMode)
+        self.list_widget.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.list_widget.setResizeMode(QListView.Adjust)
+        self.list_widget.setMovement(QListView.Static)
+        self.list_widget.setMinimumHeight(THUMBNAIL_SIZE + 40)
+        layout.addWidget(self.list_widget)
+
+        button_layout = QHBoxLayout()
+        button_layout.setContentsMargins(0, 0, 0, 0)
+        button_layout.setSpacing(5)
+        self.import_button = QPushButton("Import Selected")
+        self.import_button.clicked.connect(self._emit_selected)
+        button_layout.addWidget(self.import_button)
+
+        self.all_button = QPushButton("All")
+        self.all_button.clicked.connect(lambda: self._set_all(Qt.Checked))
+        button_layout.addWidget(self.all_button)
+
+        self.clear_button = QPushButton("Discard")
+        self.clear_button.clicked.connect(self._discard)
+        button_layout.addWidget(self.clear_button)
+        layout.addLayout(button_layout)
+
+        self.setVisible(False)
+
+    def add_mask(self, job, info, checked=False):
+        """Add one analysed mask to the picker."""
+        item = QListWidgetItem(QIcon(QPixmap.fromImage(info.thumbnail)), info.name)
+        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+        item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
+        item.setToolTip(f"{job['node_name']}\n{info.describe()}")
+        self.list_widget.addItem(item)
+        self._entries.append((job, info))
+        self.setVisible(True)
+
+    def clear(self):
+        self.list_widget.clear()
+        self._entries = []
+        self.setVisible(False)
+
+    def _discard(self):
+        entries = self._entries
+        self.clear()
+        self.discarded.emit(entries)
+
+    def _set_all(self, state):
+        for row in range(self.list_widget.count()):
+            self.list_widget.item(row).setCheckState(state)
+
+    def _emit_selected(self):
+        picked = [entry for row, entry in enumerate(self._entries)
+                  if self.list_widget.item(row).checkState() == Qt.Checked]
+        if picked:
+            # Layers without a ticked mask are finished with: release them like a discard
+            picked_jobs = {id(job) for job, _ in picked}
+            unpicked = [entry for entry in self._entries if id(entry[0]) not in picked_jobs]
+            self.clear()
+            if unpicked:
+                self.discarded.emit(unpicked)
+            self.import_requested.emit(picked)
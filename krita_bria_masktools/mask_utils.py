@@ -1,7 +1,26 @@
-from PyQt5.QtGui import QImage
-from PyQt5.QtCore import Qt  # type: ignore
+import functools
+
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import QRectF, Qt  # type: ignore
 from krita import Selection  # type: ignore
 
+from .mutations import DocumentBatch
+
+# Masks are upscaled to the canvas in bands of rows holding about this many pixels
+BAND_PIXELS = 256 * 1024
+# Selection masks are strict black/white: 8-bit values from 128 up are selected
+_BINARY = bytes(255 if value >= 128 else 0 for value in range(256))
+
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """Import NumPy on first use (it is too heavy to load at Krita startup); None if not installed."""
+    try:
+        import numpy  # type: ignore
+    except ImportError:
+        return None
+    return numpy
+
 # ------------------------------------------------------------
 # Utility: convert QImage pixel buffer safely to Python bytes
 # ------------------------------------------------------------
@@ -47,12 +66,7 @@ def prepare_mask_bytes(node_type: str, img: QImage):
         # Selection masks require strict black/white 8-bit grayscale, stripped of padding
         grayscale = img.convertToFormat(QImage.Format_Grayscale8)
         raw_data, w, h = _strip_padding(grayscale)
-        data = bytearray(raw_data)
-        # Threshold to binary
-        threshold = 128
-        for i in range(len(data)):
-            data[i] = 255 if data[i] >= threshold else 0
-        return bytes(data), w, h
+        return _threshold(raw_data), w, h
 
     # Paint layers expect ARGB32
     elif node_type == "paintlayer":
@@ -64,95 +78,141 @@ def prepare_mask_bytes(node_type: str, img: QImage):
     else:
         raise ValueError(f"Unsupported node type for mask_utils: {node_type}")
 
+def _threshold(data):
+    """Binarize 8-bit grayscale bytes (white = selected) in one C-level pass."""
+    return data.translate(_BINARY)
+
+# ------------------------------------------------------------
+# Streaming upscale: one band of canvas rows at a time
+# ------------------------------------------------------------
+
+def iter_scaled_bands(img: QImage, width, height, band_pixels=BAND_PIXELS):
+    """
+    Yield (y, rows, bytes) for img scaled to width x height as unpadded 8-bit grayscale, band by band.
+    Only one band is in memory at a time, whatever the canvas size.
+    """
+    if img.width() > width or img.height() > height:
+        # Bands are filtered bilinearly, which aliases when shrinking; shrink with Qt's smooth
+        # scaling first (the result is no larger than the source)
+        img = img.scaled(min(width, img.width()), min(height, img.height()),
+                         Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
+    rows = max(1, min(height, band_pixels // max(1, width)))
+    band = None
+    for y in range(0, height, rows):
+        band_rows = min(rows, height - y)
+        if band is None or band.height() != band_rows:
+            band = QImage(width, band_rows, QImage.Format_RGB32)
+        painter = QPainter(band)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        # The whole mask is drawn at canvas size, offset so only this band's rows land on the band;
+        # the raster engine clips to the band, and filtering matches across band edges
+        painter.drawImage(QRectF(0, -y, width, height), img, QRectF(img.rect()))
+        painter.end()
+        raw, _, _ = _strip_padding(band.convertToFormat(QImage.Format_Grayscale8))
+        yield y, band_rows, raw
+
+
+def iter_write_bands(target, img, width, height, binary=False, x=0, y=0, bands=None):
+    """
+    Upscale img to width x height and write it into target (a node or Selection) at (x, y),
+    yielding after each band so a scheduler can spread a canvas-sized write over several frames.
+    bands, if given, is an iterable of width x height bands (see iter_scaled_bands) written instead.
+    """
+    if bands is None:
+        bands = iter_scaled_bands(img, width, height)
+    for band_y, rows, raw in bands:
+        target.setPixelData(_threshold(raw) if binary else raw, x, y + band_y, width, rows)
+        yield
+
+
+def _write_bands(target, img, width, height, binary=False, x=0, y=0):
+    """Like iter_write_bands, all bands at once."""
+    for _ in iter_write_bands(target, img, width, height, binary, x, y):
+        pass
+
+
+def _iter_fill_selection(mask_node, sel, img, width, height, bands=None):
+    """Write img into sel band by band, then hand it to the selection mask."""
+    yield from iter_write_bands(sel, img, width, height, binary=True, bands=bands)
+    mask_node.setSelection(sel)
+
 # ------------------------------------------------------------
 # Create and attach a Krita mask node from a QImage
 # ------------------------------------------------------------
 
-def create_transparency_mask_from_qimage(document, parent_node, mask_name, img: QImage, add_to_new_layer: bool = False):
+def _attach_target(document, parent_node, mask_name, add_to_new_layer, batch):
+    """Return the node a mask is attached to, queueing the optional new paint layer."""
+    if not add_to_new_layer:
+        return parent_node
+    new_layer = document.createNode(f"{mask_name} Layer", "paintlayer")
+    grandparent = parent_node.parentNode()
+    if grandparent:
+        batch.add_node(grandparent, new_layer, parent_node)
+    else:
+        batch.add_node(document.rootNode(), new_layer, None)
+    return new_layer
+
+
+def create_transparency_mask_from_qimage(document, parent_node, mask_name, img: QImage, add_to_new_layer: bool = False,
+                                         batch=None, bands=None):
     """
     Create and attach a transparency mask node from a QImage.
+    The mutations are queued on batch (a DocumentBatch); without one they are committed right away.
+    bands optionally supplies the document-sized pixels band by band instead of scaling img.
     Returns the created mask node.
     """
+    own_batch = batch is None
+    if own_batch:
+        batch = DocumentBatch(document)
     # Determine full document dimensions
     w, h = document.width(), document.height()
-    # Scale input image to match document size
-    scaled = img.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-    # Convert to 8-bit grayscale and strip padding
-    gray = scaled.convertToFormat(QImage.Format_Grayscale8)
-    raw, _, _ = _strip_padding(gray)
 
     # Create a true transparency mask via PyKrita API
     mask_node = document.createTransparencyMask(mask_name)
+    attach_to = _attach_target(document, parent_node, mask_name, add_to_new_layer, batch)
 
-    if add_to_new_layer:
-        new_layer = document.createNode(f"{mask_name} Layer", "paintlayer")
-        grandparent = parent_node.parentNode()
-        if grandparent:
-            grandparent.addChildNode(new_layer, parent_node)
-        else:
-            document.rootNode().addChildNode(new_layer, None)
-        attach_to = new_layer
-    else:
-        attach_to = parent_node
-
-    # Attach and apply mask data
-    attach_to.addChildNode(mask_node, None)
-    mask_node.setPixelData(raw, 0, 0, w, h)
+    # Attach, then upscale to the document size and write band by band when the batch is flushed,
+    # so no canvas-sized image or byte buffer is ever built
+    batch.add_node(attach_to, mask_node, None)
+    batch.call(iter_write_bands, mask_node, img, w, h, False, 0, 0, bands)
 
     # Start mask as invisible so users can toggle visibility via the eye icon
-    try:
-        mask_node.setVisible(False)
-    except Exception:
-        pass
+    batch.set_visible(mask_node, False)
 
-    try:
-        document.refreshProjection()
-    except Exception:
-        pass
+    if own_batch:
+        batch.commit()
     return mask_node
 
-def create_selection_mask_from_qimage(document, parent_node, mask_name, img: QImage, add_to_new_layer: bool = False):
+def create_selection_mask_from_qimage(document, parent_node, mask_name, img: QImage, add_to_new_layer: bool = False,
+                                      batch=None, bands=None):
     """
     Create and attach a selection mask node from a QImage.
+    The mutations are queued on batch (a DocumentBatch); without one they are committed right away.
+    bands optionally supplies the document-sized pixels band by band instead of scaling img.
     Returns the created mask node.
     """
+    own_batch = batch is None
+    if own_batch:
+        batch = DocumentBatch(document)
     # Determine full document dimensions
     w, h = document.width(), document.height()
-    # Scale input image to match document size
-    scaled = img.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)  # type: ignore
-    # Convert to 8-bit grayscale and strip padding
-    gray = scaled.convertToFormat(QImage.Format_Grayscale8)
-    raw_data, _, _ = _strip_padding(gray)
-    # Threshold to binary selection mask (white = selected)
-    data = bytearray(raw_data)
-    threshold = 128
-    for i in range(len(data)):
-        data[i] = 255 if data[i] >= threshold else 0
-
-    # Create using createSelectionMask to ensure proper type
+
+    # Create using createSelectionMask to ensure proper type; the mask is upscaled to the
+    # document size and thresholded to binary (white = selected) one band at a time when the
+    # batch is flushed
     try:
         mask_node = document.createSelectionMask(mask_name)
     except Exception as e:
         # Fallback if createSelectionMask not available
         mask_node = document.createNode(mask_name, "selectionmask")
         # For fallback, use setPixelData directly since setSelection may not be available
-        mask_node.setPixelData(bytes(data), 0, 0, w, h)
+        batch.call(iter_write_bands, mask_node, img, w, h, True, 0, 0, bands)
     else:
         # For normal case, use intermediate Selection
-        sel = Selection(document)
-        sel.setPixelData(bytes(data), 0, 0, w, h)
-        mask_node.setSelection(sel)
-
-    if add_to_new_layer:
-        new_layer = document.createNode(f"{mask_name} Layer", "paintlayer")
-        grandparent = parent_node.parentNode()
-        if grandparent:
-            grandparent.addChildNode(new_layer, parent_node)
-        else:
-            document.rootNode().addChildNode(new_layer, None)
-        attach_to = new_layer
-    else:
-        attach_to = parent_node
+        batch.call(_iter_fill_selection, mask_node, Selection(document), img, w, h, bands)
+
+    attach_to = _attach_target(document, parent_node, mask_name, add_to_new_layer, batch)
 
     # Detach from any existing parent to avoid assert
     try:
@@ -162,23 +222,20 @@ def create_selection_mask_from_qimage(document, parent_node, mask_name, img: QIm
     except Exception:
         pass
 
-    # Attach to the target parent layer
-    attach_to.addChildNode(mask_node, None)
+    # Attach to the target parent layer, visible by default
+    batch.add_node(attach_to, mask_node, None)
+    batch.set_visible(mask_node, True)
 
-    # Wait for document to stabilize
-    try:
-        document.waitForDone()
-    except Exception:
-        pass
+    if own_batch:
+        batch.commit()
+    return mask_node
 
-    # Make visible by default
-    try:
-        mask_node.setVisible(True)
-    except Exception:
-        pass
 
-    try:
-        document.refreshProjection()
-    except Exception:
-        pass
-    return mask_node
+def create_selection_from_qimage(document, img: QImage, x, y, width, height):
+    """
+    Return a Selection holding img scaled into the rectangle (x, y, width, height) and thresholded
+    to binary (white = selected); nothing outside the rectangle is selected.
+    """
+    sel = Selection(document)
+    _write_bands(sel, img, width, height, binary=True, x=x, y=y)
+    return sel
@@ -0,0 +1,106 @@
+"""
+Memory budgeting for Bria Mask Tools batches.
+Every in-flight job holds its export, upload buffer, download and decoded images at once.
+BatchRunner asks a MemoryBudget before exporting the next layer and waits for running jobs
+to finish when the estimated footprint would exceed it, so large batches do not push Krita
+into swap. The docker shares one budget between its bulk and interactive runners; the default
+is a share of the memory available when it is created.
+"""
+
+import os
+import sys
+
+# Share of the currently available memory a batch may hold in flight
+BUDGET_FRACTION = 0.5
+MIN_BUDGET_BYTES = 256 * 1024 * 1024
+MAX_BUDGET_BYTES = 16 * 1024 * 1024 * 1024
+# Used when available memory cannot be determined
+FALLBACK_BUDGET_BYTES = 1024 * 1024 * 1024
+# Rough peak bytes per layer pixel while a job is in flight:
+# background removal: decoded export 4, upload buffer ~2, download ~2, decoded cutout 4, converted pixels 4-16
+BACKGROUND_BYTES_PER_PIXEL = 20
+# mask generation: decoded export 4, guide 1, one mask upsampled at import (bands, or the layer when it is
+# smaller than the canvas); decoded masks stay at proxy size
+MASK_BYTES_PER_PIXEL = 6
+
+
+def available_memory():
+    """Bytes of physical memory available without swapping, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):  # type: ignore
+            return status.ullAvailPhys
+        return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        # macOS has no figure for available pages; assume half of physical memory is free
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_budget(available=None):
+    """Budget for in-flight pixel data derived from available memory."""
+    if available is None:
+        available = available_memory()
+    if not available:
+        return FALLBACK_BUDGET_BYTES
+    return int(min(MAX_BUDGET_BYTES, max(MIN_BUDGET_BYTES, available * BUDGET_FRACTION)))
+
+
+def format_bytes(nbytes):
+    return f"{nbytes / (1024.0 * 1024.0):.0f} MiB"
+
+
+class MemoryBudget:
+    """Byte budget for the jobs in flight, shared by the runners of a docker; GUI thread only."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.deferred = 0
+        self._waiters = []
+
+    def try_acquire(self, nbytes, force=False):
+        """Reserve nbytes; returns False when that would exceed the budget unless force is set."""
+        if not force and self.in_use + nbytes > self.limit:
+            self.deferred += 1
+            return False
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+        return True
+
+    def release(self, nbytes):
+        self.in_use = max(0, self.in_use - nbytes)
+        waiters, self._waiters = self._waiters, []
+        for callback in waiters:
+            callback()
+
+    def notify_on_release(self, callback):
+        """Call callback once, the next time any reservation is released."""
+        self._waiters.append(callback)
+
+    def describe(self):
+        return (f"peak in flight {format_bytes(self.peak)} of {format_bytes(self.limit)}, "
+                f"{self.deferred} export(s) deferred")
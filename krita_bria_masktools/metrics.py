@@ -0,0 +1,216 @@
+"""
+Persistent performance metrics for Bria Mask Tools.
+Durations of pipeline stages, requests per endpoint and whole jobs are kept as bounded sample
+reservoirs so p50/p95/p99 can be reported; counters cover bytes sent and received, cache hits
+and misses, retries and API requests (quota use). The registry is saved as JSON in the plugin's
+data directory, so the figures accumulate across sessions, and can be written as a Prometheus
+text-format file for node_exporter's textfile collector.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_FILE = "metrics.json"
+PREFIX = "bria_masktools"
+# Samples kept per histogram; beyond that new samples replace old ones at random (reservoir sampling)
+MAX_SAMPLES = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+HELP = {
+    'stage': "Duration of a pipeline stage",
+    'request': "Duration of an API request including the response body",
+    'job': "Duration of a job from export to applied result",
+    'bytes_sent': "Bytes uploaded",
+    'bytes_received': "Bytes downloaded",
+    'cache_hits': "Cache lookups that found a result",
+    'cache_misses': "Cache lookups that found nothing",
+    'retries': "Requests retried after a failure",
+    'api_requests': "API requests sent (counted against the account quota)",
+    'jobs': "Finished jobs by outcome",
+}
+
+
+def _key(name, labels):
+    return name + json.dumps(labels, sort_keys=True)
+
+
+def _split(key):
+    name, _, labels = key.partition('{')
+    return name, json.loads('{' + labels)
+
+
+class Histogram:
+    """Count, sum and a bounded reservoir of samples (milliseconds)."""
+
+    def __init__(self, count=0, total=0.0, samples=None):
+        self.count = count
+        self.total = total
+        self.samples = list(samples or [])
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < MAX_SAMPLES:
+                self.samples[index] = value
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'samples': self.samples}
+
+
+class MetricsRegistry:
+    """Histograms and counters shared by the GUI and worker threads; loaded on first use."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.prometheus_path = None
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        # Called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.directory:
+            return
+        try:
+            with open(os.path.join(self.directory, METRICS_FILE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.prometheus_path = state.get('prometheus_path')
+        self._counters.update(state.get('counters', {}))
+        for key, value in state.get('histograms', {}).items():
+            self._histograms[key] = Histogram(value['count'], value['total'], value['samples'])
+
+    def observe(self, name, value_ms, **labels):
+        with self._lock:
+            self._load()
+            key = _key(name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value_ms)
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self._load()
+            key = _key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of a with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - started) * 1000.0, **labels)
+
+    def counter(self, name, **labels):
+        """Sum of a counter over all label sets matching labels."""
+        with self._lock:
+            self._load()
+            return sum(value for key, value in self._counters.items()
+                       if _split(key)[0] == name and labels.items() <= _split(key)[1].items())
+
+    def cache_hit_ratio(self, **labels):
+        hits = self.counter('cache_hits', **labels)
+        lookups = hits + self.counter('cache_misses', **labels)
+        return hits / float(lookups) if lookups else None
+
+    def save(self):
+        """Persist to the data directory and refresh the Prometheus file if one was exported."""
+        with self._lock:
+            self._load()
+            state = {
+                'prometheus_path': self.prometheus_path,
+                'counters': dict(self._counters),
+                'histograms': {key: h.to_dict() for key, h in self._histograms.items()},
+            }
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, METRICS_FILE)
+            with open(path + ".part", 'w') as f:
+                json.dump(state, f)
+            os.replace(path + ".part", path)
+        if self.prometheus_path:
+            self.export_prometheus(self.prometheus_path)
+
+    def reset(self):
+        with self._lock:
+            self._loaded = True
+            self._histograms.clear()
+            self._counters.clear()
+
+    def export_prometheus(self, path):
+        """Write the registry in the Prometheus text exposition format (atomically, for scrapers)."""
+        with open(path + ".part", 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".part", path)
+
+    def to_prometheus(self):
+        with self._lock:
+            self._load()
+            histograms = sorted((_split(key) + (h,) for key, h in self._histograms.items()), key=repr)
+            counters = sorted((_split(key) + (value,) for key, value in self._counters.items()), key=repr)
+
+        def labels_text(labels, **extra):
+            pairs = sorted(labels.items()) + list(extra.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        declared = set()
+        for name, labels, h in histograms:
+            metric = f"{PREFIX}_{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines += [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} summary"]
+            for q in QUANTILES:
+                lines.append(f"{metric}{labels_text(labels, quantile=q)} {h.quantile(q) / 1000.0:.6f}")
+            lines.append(f"{metric}_sum{labels_text(labels)} {h.total / 1000.0:.6f}")
+            lines.append(f"{metric}_count{labels_text(labels)} {h.count}")
+        for name, labels, value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines += [f"# HELP {metric} {HELP.get(name, name)}", f"# TYPE {metric} counter"]
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Human-readable lines for the stats panel."""
+        with self._lock:
+            self._load()
+            histograms = sorted((_split(key) + (h,) for key, h in self._histograms.items()), key=repr)
+        lines = []
+        for name, labels, h in histograms:
+            label = " ".join(str(v) for _, v in sorted(labels.items()))
+            lines.append(f"{name} {label}: p50 {h.quantile(0.5):.0f} / p95 {h.quantile(0.95):.0f} / "
+                         f"p99 {h.quantile(0.99):.0f} ms (n={h.count})")
+        sent, received = self.counter('bytes_sent'), self.counter('bytes_received')
+        lines.append(f"Transferred: {sent / 1048576.0:.1f} MiB up, {received / 1048576.0:.1f} MiB down")
+        ratio = self.cache_hit_ratio()
+        lines.append("Cache hit ratio: " + (f"{ratio:.0%}" if ratio is not None else "n/a"))
+        lines.append(f"API requests: {self.counter('api_requests')} "
+                     f"({self.counter('api_requests', kind='prefetch')} prefetch), "
+                     f"retries: {self.counter('retries')}")
+        lines.append(f"Jobs: {self.counter('jobs', outcome='ok')} ok, {self.counter('jobs', outcome='error')} "
+                     f"failed, {self.counter('jobs', outcome='cancelled')} cancelled")
+        return lines
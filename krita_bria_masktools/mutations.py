@@ -0,0 +1,81 @@
+"""
+Batched document mutations for Bria Mask Tools.
+Node inserts, pixel writes and visibility changes are queued on a DocumentBatch and applied
+in order by flush(); commit() flushes and then waits for Krita and recomputes the projection
+once, instead of once per created node. Import generators drain the batch with iter_flush()
+before they yield, so nodes still appear slice by slice while the projection is refreshed only
+when the batch is done. A mutation queued with call() may itself be a generator (a canvas-sized
+pixel write, band by band); iter_flush() yields between its steps, so a scheduler step stays
+one band long instead of one mask. A mutation that fails is skipped and reported through the
+batch's log_error callback, so the rest of the import still goes through.
+"""
+
+import types
+from collections import deque
+
+
+class DocumentBatch:
+    """Ordered queue of mutations for one document with a single deferred refresh."""
+
+    def __init__(self, document, log_error=None):
+        self.document = document
+        self.log_error = log_error
+        self._ops = deque()
+        self._dirty = False
+        self.applied = 0
+        self.failed = 0
+        self.refreshes = 0
+
+    def add_node(self, parent, node, above=None):
+        self._ops.append((parent.addChildNode, (node, above)))
+
+    def set_pixels(self, node, data, x, y, width, height):
+        self._ops.append((node.setPixelData, (data, x, y, width, height)))
+
+    def set_visible(self, node, visible):
+        self._ops.append((node.setVisible, (visible,)))
+
+    def set_selection(self, node, selection):
+        self._ops.append((node.setSelection, (selection,)))
+
+    def call(self, fn, *args):
+        """Queue any other mutation, e.g. pixel_convert.write_pixels or a generator like mask_utils.iter_write_bands."""
+        self._ops.append((fn, args))
+
+    def flush(self):
+        """Apply the queued mutations in order; failures of single mutations are logged and skipped."""
+        for _ in self.iter_flush():
+            pass
+
+    def iter_flush(self):
+        """Generator form of flush() yielding between the steps of generator mutations."""
+        while self._ops:
+            fn, args = self._ops.popleft()
+            try:
+                steps = fn(*args)
+                if isinstance(steps, types.GeneratorType):
+                    for _ in steps:
+                        yield
+            except Exception as e:
+                self.failed += 1
+                if self.log_error is not None:
+                    self.log_error(f"Error applying {getattr(fn, '__name__', fn)}: {str(e)}")
+                continue
+            self.applied += 1
+            self._dirty = True
+
+    def commit(self):
+        """Flush, then let Krita settle and refresh the projection once if anything changed."""
+        self.flush()
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            self.document.waitForDone()
+        except Exception:
+            pass
+        try:
+            self.document.refreshProjection()
+        except Exception:
+            pass  # Non-critical if refresh fails
+        self.refreshes += 1
@@ -0,0 +1,135 @@
+"""
+Cancellable HTTP helpers for Bria Mask Tools.
+Requests are made through urllib so proxies and redirects keep working, but every
+connection is registered with a CancelToken so Cancel can tear it down mid-request.
+"""
+
+import http.client
+import os
+import socket
+import ssl
+import sys
+import threading
+import urllib.request
+
+from .jobs import JobCancelled
+
+CHUNK_SIZE = 64 * 1024
+CERT_FILE = '/etc/ssl/cert.pem'
+
+_ssl_context = None
+_ssl_lock = threading.Lock()
+
+
+def session_ssl_context():
+    """
+    Return (context, warning): the SSL context shared by all requests of this Krita session.
+    On macOS and Linux SSL_CERT_FILE is pointed at the system bundle once, before the context
+    is built; warning is set only on that first call when the bundle is missing.
+    Raises ssl.SSLError/OSError if the context cannot be created.
+    """
+    global _ssl_context
+    with _ssl_lock:
+        if _ssl_context is not None:
+            return _ssl_context, None
+        warning = None
+        if sys.platform.startswith('darwin') or sys.platform.startswith('linux'):
+            if os.path.exists(CERT_FILE):
+                os.environ['SSL_CERT_FILE'] = CERT_FILE
+            else:
+                warning = f"Warning: Certificate file {CERT_FILE} not found."
+        _ssl_context = ssl.create_default_context()
+        return _ssl_context, warning
+
+# ------------------------------------------------------------
+# Opener that registers its connections with a CancelToken
+# ------------------------------------------------------------
+
+def _connection_class(base, token):
+    class _RegisteredConnection(base):
+        def connect(self):
+            super().connect()
+            if token is not None:
+                token.register(self)
+    return _RegisteredConnection
+
+
+class _CancellableHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, token):
+        super().__init__()
+        self._token = token
+
+    def http_open(self, req):
+        return self.do_open(_connection_class(http.client.HTTPConnection, self._token), req)
+
+
+class _CancellableHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, token, context=None):
+        super().__init__(context=context)
+        self._token = token
+
+    def https_open(self, req):
+        return self.do_open(_connection_class(http.client.HTTPSConnection, self._token), req,
+                            context=self._context)
+
+
+def abort_connection(conn):
+    """Shut down the socket of an http.client connection so blocked reads return immediately."""
+    sock = getattr(conn, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def open_url(req, context=None, token=None, timeout=30):
+    """urlopen() replacement whose connection is aborted when token is cancelled."""
+    if token is not None:
+        token.check()
+    opener = urllib.request.build_opener(_CancellableHTTPHandler(token),
+                                         _CancellableHTTPSHandler(token, context))
+    try:
+        return opener.open(req, timeout=timeout)
+    except OSError:
+        # A shut-down socket surfaces as a connection error; report it as a cancel instead
+        if token is not None and token.is_cancelled():
+            raise JobCancelled()
+        raise
+
+
+def chunk_reader(response, token=None):
+    """Return a callable that reads the next chunk of response (b'' at the end), honouring token."""
+    def read_chunk():
+        if token is not None:
+            token.check()
+        try:
+            return response.read(CHUNK_SIZE)
+        except (OSError, ValueError, http.client.HTTPException):
+            if token is not None and token.is_cancelled():
+                raise JobCancelled()
+            raise
+    return read_chunk
+
+
+def read_response(response, token=None):
+    """Read a response body in chunks, stopping as soon as token is cancelled."""
+    read_chunk = chunk_reader(response, token)
+    chunks = []
+    while True:
+        chunk = read_chunk()
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def fetch(url, context=None, token=None, timeout=60):
+    """Download url into memory and return its bytes."""
+    req = urllib.request.Request(url, headers={'User-Agent': 'Krita-Bria-MaskTools/1.0'})
+    with open_url(req, context=context, token=token, timeout=timeout) as response:
+        return read_response(response, token)
@@ -0,0 +1,90 @@
+"""
+Conversion of decoded 8-bit sRGB images to the pixel layout of a Krita layer.
+setPixelData expects the layer's own channel order and depth: BGRA for 8/16-bit integer RGBA,
+RGBA for half and float, gray+alpha for GRAYA. RGBA and GRAYA layers of any depth are converted
+here in one vectorized NumPy pass over a zero-copy view of the QImage; other colour models
+(CMYK, Lab, XYZ, YCbCr), and any non-8-bit layer when NumPy is missing, are converted by Krita
+itself from 8-bit sRGB.
+"""
+
+from PyQt5.QtGui import QImage
+
+from .mask_utils import load_numpy, qimage_to_bytes
+
+SRGB_PROFILE = "sRGB-elle-V2-srgbtrc.icc"
+FAST_MODELS = ("RGBA", "GRAYA")
+DEPTH_DTYPES = {"U8": "uint8", "U16": "uint16", "F16": "float16", "F32": "float32"}
+# Source channel (in QImage ARGB32 memory order: B, G, R, A) for each destination channel
+_CHANNELS = {
+    ("RGBA", False): (0, 1, 2, 3),  # integer RGBA is stored as BGRA
+    ("RGBA", True): (2, 1, 0, 3),   # half and float RGBA are stored as RGBA
+}
+
+
+def is_linear_profile(profile):
+    """True for linear-light profiles (Krita's default for half/float documents)."""
+    name = (profile or "").lower()
+    return "g10" in name or "linear" in name or "scrgb" in name
+
+
+def _lut(np, dtype, linear):
+    """256-entry table mapping 8-bit sRGB-encoded values to the destination depth."""
+    values = np.arange(256, dtype=np.float64) / 255.0
+    if linear:
+        values = np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+    if np.dtype(dtype).kind == 'f':
+        return values.astype(dtype)
+    return np.rint(values * np.iinfo(dtype).max).astype(dtype)
+
+
+def pixel_data(image, model, depth, profile=""):
+    """
+    Return image's pixels as setPixelData bytes for a layer in (model, depth, profile),
+    or None when Krita has to convert them (see write_pixels).
+    """
+    if image.format() != QImage.Format_ARGB32:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+    if model == "RGBA" and depth == "U8":
+        return qimage_to_bytes(image)  # ARGB32 is BGRA in memory, like Krita's 8-bit RGBA
+    np = load_numpy()
+    dtype = DEPTH_DTYPES.get(depth)
+    if np is None or model not in FAST_MODELS or dtype is None:
+        return None
+
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.byteCount())  # type: ignore
+    # ARGB32 rows are never padded, so this is a zero-copy (height, width, 4) view
+    bgra = np.frombuffer(bits, dtype=np.uint8).reshape(height, width, 4)
+    is_float = np.dtype(dtype).kind == 'f'
+    color_lut = _lut(np, dtype, is_float and is_linear_profile(profile))
+    alpha_lut = _lut(np, dtype, False)
+
+    if model == "RGBA":
+        out = np.empty((height, width, 4), dtype=dtype)
+        for dst, src in enumerate(_CHANNELS[("RGBA", is_float)]):
+            np.take(alpha_lut if src == 3 else color_lut, bgra[..., src], out=out[..., dst], mode='clip')
+    else:
+        # Integer luma with Qt's qGray() weights
+        gray = (bgra[..., 2].astype(np.uint16) * 11 + bgra[..., 1].astype(np.uint16) * 16
+                + bgra[..., 0].astype(np.uint16) * 5) >> 5
+        out = np.empty((height, width, 2), dtype=dtype)
+        np.take(color_lut, gray, out=out[..., 0], mode='clip')
+        np.take(alpha_lut, bgra[..., 3], out=out[..., 1], mode='clip')
+    return out.tobytes()
+
+
+def write_pixels(node, image, pixels, model, depth, profile="", x=0, y=0):
+    """
+    Write image into node at (x, y); the node must already be in the document.
+    pixels is pixel_data()'s result; when it is None the 8-bit sRGB pixels are written to the
+    node in 8-bit sRGB and Krita converts the node to the document's colour space.
+    """
+    if pixels is not None:
+        node.setPixelData(pixels, x, y, image.width(), image.height())
+        return
+    if image.format() != QImage.Format_ARGB32:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+    node.setColorSpace("RGBA", "U8", SRGB_PROFILE)
+    node.setPixelData(qimage_to_bytes(image), x, y, image.width(), image.height())
+    node.setColorSpace(model, depth, profile)
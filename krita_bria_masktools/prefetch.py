@@ -0,0 +1,70 @@
+"""
+Speculative mask prefetch for Bria Mask Tools.
+When enabled, a layer that stays active and unedited for a few seconds has its mask request
+sent in the background and the downloaded masks are kept in the rung cache, so clicking Generate
+imports them without waiting for the round trip. Edits are spotted with the cheap sampled
+layer digest: they restart the idle time, cancel a request in flight and drop masks prefetched
+for the old pixels. Speculative requests are capped per hour.
+"""
+
+import time
+from collections import deque
+
+DEFAULT_IDLE_SECONDS = 3
+DEFAULT_HOURLY_LIMIT = 10
+POLL_INTERVAL_MS = 500
+WINDOW_SECONDS = 60 * 60
+
+
+class RequestBudget:
+    """Sliding one-hour window limiting how many speculative requests are sent."""
+
+    def __init__(self, per_hour=DEFAULT_HOURLY_LIMIT):
+        self.per_hour = per_hour
+        self._sent = deque()
+
+    def _expire(self, now):
+        while self._sent and now - self._sent[0] >= WINDOW_SECONDS:
+            self._sent.popleft()
+
+    def used(self, now=None):
+        self._expire(now or time.time())
+        return len(self._sent)
+
+    def allow(self, now=None):
+        return self.used(now) < self.per_hour
+
+    def spend(self, now=None):
+        self._sent.append(now or time.time())
+
+
+class IdleTracker:
+    """
+    Tracks how long the active node has stayed active and unchanged; each such idle stretch is
+    prefetched at most once.
+    """
+
+    def __init__(self, idle_seconds=DEFAULT_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.node_id = None
+        self.state = None
+        self._since = 0.0
+        self._done = False
+
+    def update(self, node_id, state=None, now=None):
+        """
+        Feed the current active node id and a digest of its content; True while both have stayed
+        the same long enough and the stretch is not done yet.
+        """
+        now = now or time.time()
+        if node_id != self.node_id or state != self.state:
+            self.node_id = node_id
+            self.state = state
+            self._since = now
+            self._done = False
+            return False
+        return node_id is not None and not self._done and now - self._since >= self.idle_seconds
+
+    def done(self):
+        """Mark the current idle stretch handled; switching layers or editing starts a new one."""
+        self._done = True
@@ -0,0 +1,121 @@
+"""
+Per-job CPU and memory profiling for Bria Mask Tools.
+In profiling mode every job gets a JobProfiler: its prepare, work and apply stages run under
+their own cProfile.Profile (apply generators are profiled step by step), and a tracemalloc
+snapshot taken when the job starts is compared with one taken when it finishes. The stage
+profiles are written as .prof files (for snakeviz, pstats...) next to a text summary with the
+hottest functions and the top allocations.
+tracemalloc traces the whole process, so allocations of jobs running at the same time show up
+in each other's summaries, and from Python 3.12 only one stage can be profiled at a time; run a
+single thread for clean figures.
+The profilers are imported when profiling starts, so the module costs nothing while the mode is off.
+"""
+
+import os
+import re
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 30
+TRACE_FRAMES = 10
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def start_tracing():
+    """Start tracemalloc for a profiled run; runs may overlap, the last one to stop ends tracing."""
+    global _tracing_users
+    import tracemalloc
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        _tracing_users += 1
+
+
+def stop_tracing():
+    global _tracing_users
+    import tracemalloc
+    with _tracing_lock:
+        _tracing_users = max(0, _tracing_users - 1)
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class JobProfiler:
+    """CPU profiles per stage and the allocations of one job."""
+
+    def __init__(self, directory, name):
+        import tracemalloc
+        self.directory = directory
+        self.name = name
+        self.file_prefix = re.sub(r'[^\w.-]+', '_', name)[:40] + time.strftime("_%H%M%S_") + str(id(self) % 10000)
+        self.profiles = {}
+        self.started = time.perf_counter()
+        self.snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    @contextmanager
+    def stage(self, stage):
+        """Profile a with-block as part of stage (accumulates over several blocks)."""
+        import cProfile
+        profile = self.profiles.setdefault(stage, cProfile.Profile())
+        try:
+            profile.enable()
+            active = True
+        except ValueError:
+            # Another profiler is already active (a nested stage, or any other thread on Python 3.12+)
+            active = False
+        try:
+            yield
+        finally:
+            if active:
+                profile.disable()
+
+    def steps(self, result, stage="apply"):
+        """Profile each step of a generator apply stage; other results are returned unchanged."""
+        if not isinstance(result, types.GeneratorType):
+            return result
+        return self._steps(result, stage)
+
+    def _steps(self, generator, stage):
+        while True:
+            with self.stage(stage):
+                try:
+                    step = next(generator)
+                except StopIteration as stop:
+                    return stop.value
+            yield step
+
+    def write(self):
+        """Write the .prof files and the text summary; returns the summary path."""
+        import io
+        import pstats
+        import tracemalloc
+        os.makedirs(self.directory, exist_ok=True)
+        out = io.StringIO()
+        out.write(f"Profile of {self.name}: {(time.perf_counter() - self.started) * 1000:.0f}ms from prepare "
+                  f"to cleanup\n")
+        for stage, profile in self.profiles.items():
+            path = os.path.join(self.directory, f"{self.file_prefix}_{stage}.prof")
+            profile.dump_stats(path)
+            out.write(f"\n== {stage} ({os.path.basename(path)}) ==\n")
+            try:
+                pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            except TypeError:
+                out.write("(no calls recorded)\n")
+
+        if self.snapshot is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            out.write(f"\n== Allocations (all threads) ==\ntraced now {current / 1048576.0:.1f} MiB, "
+                      f"peak {peak / 1048576.0:.1f} MiB\n")
+            diff = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')
+            for stat in diff[:TOP_ALLOCATIONS]:
+                out.write(f"{stat}\n")
+
+        summary_path = os.path.join(self.directory, f"{self.file_prefix}_summary.txt")
+        with open(summary_path, 'w') as f:
+            f.write(out.getvalue())
+        return summary_path
@@ -0,0 +1,91 @@
+"""
+Resolution ladder for progressive mask generation in Bria Mask Tools.
+A job first requests masks at the smallest rung for a quick preview; each confirmation in the
+picker climbs one rung, and the last rung produces the masks that are imported.
+Downloaded mask bytes are cached per (export digest, rung) so unchanged layers and repeated
+rungs skip the network.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_LADDER = (320, 800)
+MIN_RUNG = 64
+MAX_RUNG = 4096
+CACHE_BUDGET_BYTES = 64 * 1024 * 1024
+# Minimum IoU for a refined mask to count as the higher-resolution version of a picked preview mask
+REFINE_MATCH_IOU = 0.5
+
+
+def parse_ladder(text):
+    """Parse '320, 800' into an ascending list of unique sizes; raises ValueError on bad input."""
+    sizes = set()
+    for part in text.replace(';', ',').split(','):
+        part = part.strip().lower().rstrip('px').strip()
+        if not part:
+            continue
+        size = int(part)
+        if not MIN_RUNG <= size <= MAX_RUNG:
+            raise ValueError(f"{size}px is outside {MIN_RUNG}-{MAX_RUNG}px")
+        sizes.add(size)
+    if not sizes:
+        raise ValueError("no sizes given")
+    return sorted(sizes)
+
+
+def format_ladder(sizes):
+    return ", ".join(str(size) for size in sizes)
+
+
+def proxy_size(width, height, long_side):
+    """Return (w, h) with the longer dimension scaled to long_side, keeping the aspect ratio."""
+    if width >= height:
+        return long_side, max(1, round(height * (long_side / float(width))))
+    return max(1, round(width * (long_side / float(height)))), long_side
+
+
+def describe_timings(timings):
+    """Format [(size, ms, cached), ...] as '320px 850ms, 800px 40ms (cached)'."""
+    return ", ".join(f"{size}px {ms}ms" + (" (cached)" if cached else "") for size, ms, cached in timings)
+
+
+class RungCache:
+    """Thread-safe LRU of downloaded mask bytes keyed by (export digest, rung size)."""
+
+    def __init__(self, budget_bytes=CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached [(mask name, bytes), ...] for key, or None."""
+        with self._lock:
+            pieces = self._entries.get(key)
+            if pieces is not None:
+                self._entries.move_to_end(key)
+            return pieces
+
+    def put(self, key, pieces):
+        cost = sum(len(data) for _, data in pieces)
+        if cost > self.budget_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= sum(len(data) for _, data in self._entries.pop(key))
+            self._entries[key] = list(pieces)
+            self._size += cost
+            while self._size > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= sum(len(data) for _, data in evicted)
+
+    def discard(self, key):
+        with self._lock:
+            pieces = self._entries.pop(key, None)
+            if pieces is not None:
+                self._size -= sum(len(data) for _, data in pieces)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,184 @@
+"""
+Scratch-space manager for Bria Mask Tools.
+All temporary files of a Krita session live in one session directory, preferably on a
+memory-backed filesystem (/dev/shm) when it has room, otherwise under the system temp dir.
+Files are reference counted: each holder calls release() and the file is removed when the
+last reference goes. The session directories are removed at exit, and directories left
+behind by crashed sessions are swept on the next startup.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+SESSION_PREFIX = "bria-masktools-"
+MEMORY_ROOTS = ("/dev/shm",)
+# Headroom left on the memory-backed filesystem after an allocation
+MEMORY_RESERVE_BYTES = 256 * 1024 * 1024
+MEMORY_RESERVE_FRACTION = 0.10
+# Size assumed for allocations without a size hint
+DEFAULT_SIZE_HINT = 64 * 1024 * 1024
+# Sessions whose owner cannot be checked are considered stale after this long without use
+STALE_AFTER_SECONDS = 24 * 60 * 60
+
+
+def _memory_root():
+    """Return a writable memory-backed directory, or None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    for root in MEMORY_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK | os.X_OK):
+            return root
+    return None
+
+
+def _owner_alive(pid):
+    """True if process pid is running; None when that cannot be checked on this platform."""
+    if os.name != 'posix':
+        return None  # os.kill(pid, 0) sends CTRL_C_EVENT on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return None
+    return True
+
+
+def sweep_stale(roots=None, now=None):
+    """Remove session directories left behind by sessions that are no longer running; returns the count."""
+    now = now or time.time()
+    if roots is None:
+        roots = [root for root in (_memory_root(), tempfile.gettempdir()) if root]
+    removed = 0
+    for root in roots:
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.name.startswith(SESSION_PREFIX) or not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                pid = int(entry.name[len(SESSION_PREFIX):].split('-', 1)[0])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            alive = _owner_alive(pid)
+            if alive is None:
+                try:
+                    alive = now - entry.stat(follow_symlinks=False).st_mtime < STALE_AFTER_SECONDS
+                except OSError:
+                    continue
+            if not alive:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+    return removed
+
+
+class ScratchSpace:
+    """Per-session scratch directories with reference-counted files."""
+
+    def __init__(self, prefer_memory=True):
+        self.prefer_memory = prefer_memory
+        self._dirs = {}     # 'memory' / 'disk' -> session directory
+        self._refs = {}     # path -> reference count
+        self._lock = threading.Lock()
+
+    def directory(self, memory=False):
+        """Return (creating on first use) the session directory on memory or disk."""
+        root = _memory_root() if memory else None
+        kind = 'memory' if root else 'disk'
+        with self._lock:
+            path = self._dirs.get(kind)
+            if path is None or not os.path.isdir(path):
+                path = tempfile.mkdtemp(prefix=f"{SESSION_PREFIX}{os.getpid()}-", dir=root or tempfile.gettempdir())
+                self._dirs[kind] = path
+            return path
+
+    def _fits_in_memory(self, size_hint):
+        root = _memory_root()
+        if not self.prefer_memory or root is None:
+            return False
+        try:
+            usage = shutil.disk_usage(root)
+        except OSError:
+            return False
+        reserve = max(MEMORY_RESERVE_BYTES, int(usage.total * MEMORY_RESERVE_FRACTION))
+        return usage.free - size_hint >= reserve
+
+    def allocate(self, prefix, suffix="", size_hint=0):
+        """
+        Return a new unique path in the session directory holding one reference.
+        The file itself is not created; size_hint (bytes) decides between memory and disk.
+        """
+        memory = self._fits_in_memory(size_hint or DEFAULT_SIZE_HINT)
+        path = os.path.join(self.directory(memory=memory), f"{prefix}_{uuid.uuid4().hex[:8]}{suffix}")
+        with self._lock:
+            self._refs[path] = 1
+        return path
+
+    def acquire(self, path):
+        """Add a reference to an allocated path."""
+        with self._lock:
+            self._refs[path] = self._refs.get(path, 0) + 1
+
+    def release(self, path):
+        """Drop a reference; the file (or directory) is removed when none are left."""
+        with self._lock:
+            count = self._refs.get(path, 0) - 1
+            if count > 0:
+                self._refs[path] = count
+                return
+            self._refs.pop(path, None)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass  # Ignore cleanup errors; the session directory goes at exit
+
+    def usage(self):
+        """Return (live files, bytes on disk) for the session directories."""
+        files = size = 0
+        for path in list(self._dirs.values()):
+            for dirpath, _, filenames in os.walk(path):
+                for name in filenames:
+                    try:
+                        size += os.path.getsize(os.path.join(dirpath, name))
+                        files += 1
+                    except OSError:
+                        pass
+        return files, size
+
+    def close(self):
+        """Remove the session directories and everything left in them."""
+        with self._lock:
+            dirs = list(self._dirs.values())
+            self._dirs.clear()
+            self._refs.clear()
+        for path in dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """Return the scratch space shared by the whole plugin for this Krita session."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = ScratchSpace()
+            atexit.register(_session.close)
+        return _session
@@ -0,0 +1,42 @@
+"""
+Startup-cost tracking for Bria Mask Tools.
+Records how long importing the plugin and building the docker take so the plugin's share of
+Krita's launch time is visible in the debug log and flagged on stderr when it exceeds budget.
+"""
+
+import sys
+import time
+
+# Import plus docker construction at Krita launch should stay below this
+STARTUP_BUDGET_MS = 50.0
+
+_timings = {}
+
+
+def record(stage, started):
+    """Store the time since started (a time.perf_counter() value) under stage; returns ms."""
+    elapsed_ms = (time.perf_counter() - started) * 1000.0
+    _timings[stage] = _timings.get(stage, 0.0) + elapsed_ms
+    return elapsed_ms
+
+
+def timings():
+    return dict(_timings)
+
+
+def launch_cost_ms():
+    """Cost paid at Krita launch: plugin import and docker creation (the UI is built when first shown)."""
+    return _timings.get("import", 0.0) + _timings.get("docker", 0.0)
+
+
+def describe():
+    parts = [f"{stage} {ms:.1f}ms" for stage, ms in _timings.items()]
+    return ", ".join(parts) + f" (launch {launch_cost_ms():.1f}ms, budget {STARTUP_BUDGET_MS:.0f}ms)"
+
+
+def check_budget():
+    """Warn on stderr when the launch cost is over budget; returns True if within budget."""
+    if launch_cost_ms() <= STARTUP_BUDGET_MS:
+        return True
+    sys.stderr.write(f"Bria Mask Tools: startup cost over budget: {describe()}\n")
+    return False
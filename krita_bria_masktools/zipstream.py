@@ -0,0 +1,189 @@
+"""
+Front-to-back reader for ZIP archives that are still downloading.
+Local file headers are parsed as bytes arrive, so each entry can be handed on as soon as
+it is complete instead of waiting for the central directory at the end of the archive.
+Entries are inflated in bounded pieces, so size limits hold even for entries whose size is
+only known from the data descriptor that follows them.
+"""
+
+import io
+import struct
+import zipfile
+import zlib
+
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+
+# Largest piece of an entry read or inflated at once
+PIECE_SIZE = 1024 * 1024
+
+
+class UnsupportedStream(Exception):
+    """Raised when an archive cannot be read front-to-back; use ZipStream.fallback_entries()."""
+
+
+class ArchiveTooLarge(Exception):
+    """Raised when the entries of an archive add up to more than the total size limit."""
+
+
+class ZipStream:
+    """
+    Parse a ZIP archive from read_chunk(), a callable returning b'' at end of stream.
+    Entries larger than max_entry_size are read to their end but yielded with data None;
+    ArchiveTooLarge is raised as soon as all entries together exceed max_total_size.
+    """
+
+    def __init__(self, read_chunk, max_entry_size=None, max_total_size=None):
+        self._read_chunk = read_chunk
+        self._buffer = bytearray()
+        self._raw = bytearray()
+        self._eof = False
+        self._emitted = set()
+        self.max_entry_size = max_entry_size
+        self.max_total_size = max_total_size
+        self.total_size = 0
+
+    def _fill(self, size):
+        while len(self._buffer) < size and not self._eof:
+            chunk = self._read_chunk()
+            if not chunk:
+                self._eof = True
+                break
+            self._buffer += chunk
+            self._raw += chunk
+        return len(self._buffer) >= size
+
+    def _take(self, size):
+        if not self._fill(size):
+            raise UnsupportedStream("Archive ended unexpectedly")
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def peek(self, size):
+        """Return up to size leading bytes without consuming them."""
+        self._fill(size)
+        return bytes(self._buffer[:size])
+
+    @property
+    def received(self):
+        """Number of bytes read from the stream so far."""
+        return len(self._raw)
+
+    def raw_bytes(self):
+        """Drain the rest of the stream and return every byte received."""
+        while not self._eof:
+            self._fill(len(self._buffer) + 1)
+        return bytes(self._raw)
+
+    def entries(self):
+        """Yield (filename, data) for each file as soon as it has been fully received; data is None if too large."""
+        while True:
+            if self.peek(4) != LOCAL_HEADER_SIGNATURE:
+                return  # Central directory (or end of archive) reached
+            (_, _, flags, method, _, _, crc, comp_size, size,
+             name_len, extra_len) = _LOCAL_HEADER.unpack(self._take(_LOCAL_HEADER.size))
+            filename = self._take(name_len).decode('utf-8', 'replace')
+            self._take(extra_len)
+
+            if flags & _FLAG_ENCRYPTED:
+                raise UnsupportedStream(f"Encrypted entry: {filename}")
+            has_descriptor = bool(flags & _FLAG_DATA_DESCRIPTOR)
+
+            if method == zipfile.ZIP_STORED:
+                if has_descriptor:
+                    raise UnsupportedStream(f"Stored entry without size: {filename}")
+                pieces = self._stored(comp_size)
+            elif method == zipfile.ZIP_DEFLATED:
+                pieces = self._inflate(None if has_descriptor else comp_size)
+            else:
+                raise UnsupportedStream(f"Unsupported compression method {method}")
+
+            data, actual_crc = self._collect(pieces)
+            if has_descriptor:
+                crc = self._skip_data_descriptor()
+            if actual_crc != crc:
+                raise zipfile.BadZipFile(f"CRC mismatch for {filename}")
+
+            if filename.endswith('/'):
+                continue
+            self._emitted.add(filename)
+            yield filename, data
+
+    def fallback_entries(self):
+        """Read the complete archive with zipfile and yield the entries not emitted yet."""
+        with zipfile.ZipFile(io.BytesIO(self.raw_bytes())) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename in self._emitted:
+                    continue
+                self._emitted.add(info.filename)
+                # zipfile reads no more than the declared size, so the limits can be checked up front
+                self._count(info.file_size)
+                if self.max_entry_size is not None and info.file_size > self.max_entry_size:
+                    yield info.filename, None
+                else:
+                    yield info.filename, archive.read(info)
+
+    def _count(self, size):
+        self.total_size += size
+        if self.max_total_size is not None and self.total_size > self.max_total_size:
+            raise ArchiveTooLarge(f"Archive inflates to more than {self.max_total_size} bytes")
+
+    def _collect(self, pieces):
+        """Join an entry's pieces within the size limits; returns (data or None if too large, crc)."""
+        kept, size, crc = [], 0, 0
+        for piece in pieces:
+            self._count(len(piece))
+            size += len(piece)
+            crc = zlib.crc32(piece, crc)
+            if kept is not None and self.max_entry_size is not None and size > self.max_entry_size:
+                kept = None  # Still read to its end for the CRC and the next header, but not kept
+            if kept is not None:
+                kept.append(piece)
+        return (None if kept is None else b''.join(kept)), crc & 0xffffffff
+
+    def _stored(self, size):
+        while size > 0:
+            piece = self._take(min(size, PIECE_SIZE))
+            size -= len(piece)
+            yield piece
+
+    def _inflate(self, comp_size):
+        """Yield the inflated entry in pieces of at most PIECE_SIZE bytes; comp_size None reads to the stream end."""
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        remaining = comp_size
+        pending = b''
+        while not decompressor.eof:
+            if not pending:
+                if remaining is None:
+                    # Size unknown until the data descriptor: inflate until the deflate stream ends
+                    if not self._buffer and not self._fill(1):
+                        raise UnsupportedStream("Archive ended inside a compressed entry")
+                    pending = bytes(self._buffer)
+                    self._buffer.clear()
+                elif remaining > 0:
+                    pending = self._take(min(remaining, PIECE_SIZE))
+                    remaining -= len(pending)
+                else:
+                    yield decompressor.flush()
+                    return
+            piece = decompressor.decompress(pending, PIECE_SIZE)
+            pending = decompressor.unconsumed_tail
+            if piece:
+                yield piece
+        if remaining is None:
+            # Hand back whatever followed the end of the deflate stream
+            self._buffer[:0] = decompressor.unused_data
+        elif remaining:
+            self._take(remaining)
+
+    def _skip_data_descriptor(self):
+        first = self._take(4)
+        if first == DATA_DESCRIPTOR_SIGNATURE:
+            first = self._take(4)
+        self._take(8)
+        return struct.unpack('<I', first)[0]
@@ -0,0 +1,218 @@
+"""
+Shared fixtures for the plugin's test suite.
+Krita's `krita` module only exists inside Krita, so a small stand-in is installed before the
+plugin modules are imported, and the plugin package is registered without running its
+__init__ (which would create the docker). Documents and nodes are recording fakes.
+"""
+
+import os
+import sys
+import time
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(ROOT, "krita_bria_masktools")
+# Multiply every time budget, e.g. BRIA_PERF_BUDGET_SCALE=3 on slow CI machines
+BUDGET_SCALE = float(os.environ.get("BRIA_PERF_BUDGET_SCALE", "1"))
+
+
+class FakeSelection:
+    def __init__(self, document=None):
+        self.writes = []  # (nbytes, x, y, w, h) per setPixelData call
+
+    def setPixelData(self, data, x, y, w, h):
+        assert len(data) >= w * h, "pixel data shorter than the rectangle"
+        self.writes.append((len(data), x, y, w, h))
+
+
+class FakeNode:
+    """Records what the plugin writes into it."""
+
+    def __init__(self, name, node_type):
+        self._name = name
+        self.node_type = node_type
+        self.children = []
+        self.parent = None
+        self.visible = True
+        self.selection = None
+        self.writes = []  # (nbytes, x, y, w, h) per setPixelData call
+
+    def name(self):
+        return self._name
+
+    def type(self):
+        return self.node_type
+
+    def parentNode(self):
+        return self.parent
+
+    def addChildNode(self, node, above):
+        node.parent = self
+        self.children.append(node)
+        return True
+
+    def removeChildNode(self, node):
+        self.children.remove(node)
+        node.parent = None
+
+    def setVisible(self, visible):
+        self.visible = visible
+
+    def setSelection(self, selection):
+        self.selection = selection
+
+    def setPixelData(self, data, x, y, w, h):
+        assert len(data) >= w * h, "pixel data shorter than the rectangle"
+        self.writes.append((len(data), x, y, w, h))
+
+
+class FakeDocument:
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+        self.root = FakeNode("root", "grouplayer")
+        self.refreshes = 0
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def rootNode(self):
+        return self.root
+
+    def createNode(self, name, node_type):
+        return FakeNode(name, node_type)
+
+    def createTransparencyMask(self, name):
+        return FakeNode(name, "transparencymask")
+
+    def createSelectionMask(self, name):
+        return FakeNode(name, "selectionmask")
+
+    def waitForDone(self):
+        pass
+
+    def refreshProjection(self):
+        self.refreshes += 1
+
+
+class _FakeKrita:
+    """Krita.instance(): enough for the plugin module to register its extension and docker."""
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def addExtension(self, extension):
+        pass
+
+    def addDockWidgetFactory(self, factory):
+        pass
+
+
+class _Placeholder:
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def _install_krita_stub():
+    if "krita" in sys.modules:
+        return
+    krita = types.ModuleType("krita")
+    krita.Selection = FakeSelection
+    krita.Krita = _FakeKrita
+    krita.Extension = _Placeholder
+    krita.InfoObject = _Placeholder
+    krita.DockWidgetFactory = _Placeholder
+    krita.DockWidgetFactoryBase = types.SimpleNamespace(DockRight=2)
+    sys.modules["krita"] = krita
+
+
+def _register_plugin_package():
+    """Make `krita_bria_masktools.<module>` importable without the docker in __init__."""
+    if "krita_bria_masktools" in sys.modules:
+        return
+    package = types.ModuleType("krita_bria_masktools")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules["krita_bria_masktools"] = package
+
+
+_install_krita_stub()
+_register_plugin_package()
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: large-canvas cases (100 MP); deselect with -m 'not slow'")
+
+
+def _read_peak_rss():
+    """Peak resident set size in bytes (Linux), or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current RSS; False where the kernel does not allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Measurement:
+    """
+    Wall time and peak resident memory growth of a block.
+    Resident memory covers Qt's image buffers as well as Python objects; it is only measured
+    where the kernel lets the peak be reset (Linux), elsewhere memory budgets are not checked.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rss_growth = None
+
+    def __enter__(self):
+        import gc
+        gc.collect()
+        self._rss_start = _read_peak_rss() if _reset_peak_rss() else None
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._started
+        if self._rss_start is not None:
+            self.rss_growth = max(0, _read_peak_rss() - self._rss_start)
+        return False
+
+    def check(self, seconds, rss_bytes):
+        """Assert the budgets; seconds is scaled by BRIA_PERF_BUDGET_SCALE."""
+        assert self.seconds <= seconds * BUDGET_SCALE, \
+            f"took {self.seconds:.2f}s, budget {seconds * BUDGET_SCALE:.2f}s"
+        if self.rss_growth is not None:
+            assert self.rss_growth <= rss_bytes, \
+                f"peak memory grew {self.rss_growth / 1e6:.1f} MB, budget {rss_bytes / 1e6:.1f} MB"
+
+
+@pytest.fixture
+def measure():
+    return Measurement
+
+
+@pytest.fixture
+def fake_document():
+    return FakeDocument
@@ -0,0 +1,136 @@
+"""
+Tests for atlas jobs going through the per-layer request path of the docker.
+The docker widget is created without its Qt initialisation; only plain attributes are set.
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip("PyQt5.QtWidgets")
+
+from PyQt5.QtCore import QRect  # noqa: E402
+from PyQt5.QtGui import QImage  # noqa: E402
+
+from krita_bria_masktools import krita_bria_masktools as plugin  # noqa: E402
+from krita_bria_masktools.jobs import CancelToken  # noqa: E402
+from krita_bria_masktools.journal import DOWNLOADED, JobJournal, fingerprint_file  # noqa: E402
+from krita_bria_masktools.resolution_ladder import RungCache  # noqa: E402
+
+
+@pytest.fixture
+def docker():
+    docker = plugin.BriaMaskTools.__new__(plugin.BriaMaskTools)
+    docker._prefetch_pending = {"{some-layer}": threading.Event()}
+    docker._rung_cache = RungCache()
+    docker.emitted = []
+    docker.emit_cached_masks = lambda job, pieces, started, token: docker.emitted.append((job, pieces))
+    return docker
+
+
+def save_image(path, width, height, color):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(color)
+    assert image.save(str(path), "PNG")
+    return str(path)
+
+
+def atlas_job(tmp_path):
+    """A mask job shaped like the one prepare_atlas builds: no node, so no 'node_id'."""
+    path = str(tmp_path / "atlas.png")
+    image = QImage(64, 32, QImage.Format_RGB32)
+    image.fill(0xFFFFFFFF)
+    assert image.save(path, "PNG")
+    return {'mode': 1, 'debug': False, 'pick': False, 'guided': False, 'ladder': [1024], 'rung': 0,
+            'unique_id': "atlas", 'temp_file': path, 'temp_files': [path], 'export_digest': "digest",
+            'node_name': "atlas of 2 layers", 'atlas': [], 'decoded': 0, 'rung_timings': []}
+
+
+def test_atlas_job_skips_the_prefetch_wait(docker, tmp_path):
+    job = atlas_job(tmp_path)
+    pieces = [("Mask 1", b"png")]
+    docker._rung_cache.put(("digest", 1024), pieces)
+    assert docker.request_mask_generation(job, "key", None, CancelToken()) is None
+    assert docker.emitted == [(job, pieces)]
+
+
+@pytest.fixture
+def journaled_atlas(docker, tmp_path):
+    """A background removal atlas of two layers; the first has a result journaled by an earlier run."""
+    journal = docker._journal = JobJournal(str(tmp_path / "journal"))
+    batch_id, _ = journal.begin_batch("batch")
+    subs = []
+    for name, color in (("a", 0xFFFF0000), ("b", 0xFF00FF00)):
+        path = save_image(tmp_path / f"{name}.png", 32, 32, color)
+        subs.append({'mode': 0, 'debug': False, 'batch_id': batch_id, 'item_key': "{%s}" % name,
+                     'temp_file': path, 'node_name': name})
+    result_path = save_image(tmp_path / "a_result.png", 32, 32, 0xFF0000FF)
+    journal.record(batch_id, "{a}", fingerprint_file(subs[0]['temp_file'], "0"), DOWNLOADED,
+                   result_path=result_path)
+    job = {'mode': 0, 'debug': False, 'node_name': "atlas of 2 layers", 'layer_width': 64, 'layer_height': 32,
+           'atlas': [(subs[0], QRect(0, 0, 32, 32)), (subs[1], QRect(32, 0, 32, 32))]}
+
+    docker.requests = 0
+
+    def request_background_removal(job, api_key, context, token):
+        docker.requests += 1
+        image = QImage(64, 32, QImage.Format_ARGB32)
+        image.fill(0xFFFFFFFF)
+        return {'image': image}
+
+    docker.request_background_removal = request_background_removal
+    docker.background_payload = lambda job, image: {'image': image}
+    return job, subs, journal, batch_id
+
+
+def test_atlas_layers_are_journaled_and_resumed_one_by_one(docker, journaled_atlas):
+    job, (a, b), journal, batch_id = journaled_atlas
+    payload = docker.request_atlas(job, "key", None, CancelToken())
+    assert docker.requests == 1
+    (sub_a, payload_a), (sub_b, payload_b) = payload['cells']
+    assert (sub_a, sub_b) == (a, b)
+    assert payload_a['image'].pixel(0, 0) == 0xFF0000FF   # From the journal
+    assert payload_b['image'].pixel(0, 0) == 0xFFFFFFFF   # From the new request
+    assert journal.lookup(batch_id, "{b}")['state'] == DOWNLOADED
+
+    # Running the batch again sends nothing: both layers now have a journaled result
+    for sub in (a, b):
+        sub.pop('resumed', None)
+    docker.request_atlas(job, "key", None, CancelToken())
+    assert docker.requests == 1
+
+
+def test_atlas_layers_with_changed_pixels_are_sent_again(docker, journaled_atlas):
+    job, (a, _), journal, batch_id = journaled_atlas
+    save_image(a['temp_file'], 32, 32, 0xFF123456)
+    docker.request_atlas(job, "key", None, CancelToken())
+    assert docker.requests == 1
+    assert not a.get('resumed')
+    entry = journal.lookup(batch_id, "{a}")
+    assert entry['state'] == DOWNLOADED
+    assert entry['fingerprint'] == fingerprint_file(a['temp_file'], "0")
+
+
+class Unchecked:
+    def isChecked(self):
+        return False
+
+
+class Layer:
+    def __init__(self, width, height):
+        self.size = QRect(0, 0, width, height)
+
+    def bounds(self):
+        return self.size
+
+
+def test_typical_small_layers_are_packed_for_masks(docker):
+    docker.pick_masks_checkbox = docker.progressive_checkbox = Unchecked()
+    docker._settings_built = False  # Default ladder: the atlas is sent at 800px
+    icons = [Layer(128, 128) for _ in range(6)] + [Layer(200, 150) for _ in range(3)]
+    large = [Layer(512, 512), Layer(1920, 1080)]
+    items = docker.plan_atlases(icons + large, 1)
+    groups = [item for item in items if isinstance(item, plugin.AtlasGroup)]
+    assert len(groups) == 1 and groups[0].max_size == 800
+    assert sorted(id(node) for group in groups for node in group.nodes) == sorted(map(id, icons))
+    assert items[len(groups):] == large
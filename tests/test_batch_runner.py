@@ -0,0 +1,212 @@
+"""
+Tests for BatchRunner and ImportScheduler. Items are exported only when a worker is free, so pausing
+or cancelling a batch leaves little exported work behind; results, cleanup and the memory budget
+follow every job. The runner posts to a recording queue that the test pumps in place of Krita's
+event loop, and scheduler slices are run by calling _run_slice() directly.
+"""
+
+import queue
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("PyQt5.QtCore")
+
+from krita_bria_masktools.import_scheduler import BULK, INTERACTIVE, WAIT, ImportScheduler  # noqa: E402
+from krita_bria_masktools.jobs import BatchRunner  # noqa: E402
+from krita_bria_masktools.memory import MemoryBudget  # noqa: E402
+
+
+class FakeQueue:
+    """MainThreadQueue stand-in: callables posted from any thread run when the test pumps."""
+
+    def __init__(self):
+        self._posted = queue.Queue()
+
+    def post(self, fn, *args):
+        self._posted.put((fn, args))
+
+    def pump(self, until=None, idle=0.1, timeout=10):
+        """Run posted callables until until() is true, or until nothing was posted for idle seconds."""
+        deadline = time.time() + timeout
+        while until is None or not until():
+            try:
+                fn, args = self._posted.get(timeout=idle if until is None else 0.01)
+            except queue.Empty:
+                if until is None:
+                    return
+                assert time.time() < deadline, "timed out pumping the queue"
+                continue
+            fn(*args)
+
+
+class Batch:
+    """
+    A runner over range(count) whose work stage blocks until released or cancelled; items in quick
+    return at once, and prepare returns an error string for items in broken.
+    """
+
+    def __init__(self, count, max_workers=2, quick=(), broken=(), **kwargs):
+        self.queue = FakeQueue()
+        self.release = threading.Event()
+        self.quick, self.broken = set(quick), set(broken)
+        self.prepared, self.worked, self.results, self.cleaned = [], [], [], []
+        self.finished = None
+        self.runner = BatchRunner(
+            self.queue, range(count),
+            prepare=self.prepare, work=self.work, apply=lambda job, payload: payload,
+            cleanup=lambda job: self.cleaned.append(job['item']),
+            on_result=lambda item, result: self.results.append((item, result)),
+            on_finished=self.on_finished, max_workers=max_workers, **kwargs)
+
+    def prepare(self, item):
+        self.prepared.append(item)
+        if item in self.broken:
+            return f"Error: cannot export {item}"
+        return {'item': item}
+
+    def work(self, job, token):
+        self.worked.append(job['item'])
+        while job['item'] not in self.quick and not self.release.wait(0.01):
+            token.check()
+        return f"done {job['item']}"
+
+    def on_finished(self, cancelled):
+        self.finished = cancelled
+
+    def run(self):
+        self.release.set()
+        self.queue.pump(until=lambda: self.finished is not None)
+
+
+def test_items_are_exported_only_when_a_worker_is_free():
+    batch = Batch(10, max_workers=2)
+    batch.runner.start()
+    batch.queue.pump()
+    assert batch.prepared == [0, 1]
+    batch.runner.cancel()
+    batch.queue.pump(until=lambda: batch.finished is not None)
+    assert batch.finished is True
+    # Nothing beyond the two running exports had to be thrown away
+    assert batch.prepared == sorted(batch.cleaned) == [0, 1]
+    assert sorted(batch.results) == [(0, "Cancelled"), (1, "Cancelled")]
+
+
+def test_results_are_reported_in_order_with_one_worker():
+    batch = Batch(5, max_workers=1, broken={2})
+    batch.runner.start()
+    batch.run()
+    assert batch.finished is False
+    assert batch.results == [(0, "done 0"), (1, "done 1"), (2, "Error: cannot export 2"),
+                             (3, "done 3"), (4, "done 4")]
+    # A job that failed to prepare never reaches a worker or cleanup
+    assert batch.worked == batch.cleaned == [0, 1, 3, 4]
+
+
+def test_pause_stops_exporting_until_resumed():
+    batch = Batch(6, max_workers=2)
+    batch.runner.start()
+    batch.queue.pump()
+    batch.runner.pause()
+    batch.release.set()
+    batch.queue.pump(until=lambda: len(batch.results) == 2)
+    batch.queue.pump()
+    # The jobs in flight finished, but nothing new was exported while paused
+    assert batch.prepared == [0, 1] and batch.finished is None
+    batch.runner.resume()
+    batch.run()
+    assert batch.prepared == list(range(6)) and batch.finished is False
+
+
+def test_cancel_keeps_finished_results_and_cancels_the_rest():
+    batch = Batch(4, max_workers=2, quick={0})
+    batch.runner.start()
+    batch.queue.pump(until=lambda: batch.results)
+    batch.runner.cancel()
+    batch.queue.pump(until=lambda: batch.finished is not None)
+    assert batch.finished is True
+    # Whatever was exported after the finished item is reported as cancelled and cleaned up
+    assert batch.results[0] == (0, "done 0")
+    assert sorted(batch.results[1:]) == [(item, "Cancelled") for item in batch.prepared[1:]]
+    assert batch.prepared == sorted(batch.cleaned) and len(batch.prepared) <= 3
+
+
+def test_runners_sharing_a_budget_wait_for_each_other():
+    budget = MemoryBudget(100)
+    first = Batch(1, budget=budget, estimate=lambda item: 80)
+    second = Batch(2, budget=budget, estimate=lambda item: 60)
+    first.runner.start()
+    first.queue.pump()
+    second.runner.start()
+    second.queue.pump()
+    # A lone item of the second runner is only forced through when nothing of its own is in flight
+    assert second.prepared == [0] and budget.in_use == 140
+    first.run()
+    assert budget.in_use == 60
+    second.run()
+    assert second.prepared == [0, 1] and second.finished is False
+    assert budget.in_use == 0 and budget.peak == 140
+
+
+def test_budget_blocks_exports_until_a_job_finishes():
+    budget = MemoryBudget(100)
+    batch = Batch(3, max_workers=3, budget=budget, estimate=lambda item: 60)
+    batch.runner.start()
+    batch.queue.pump()
+    assert batch.prepared == [0] and budget.deferred >= 1
+    batch.run()
+    assert batch.prepared == [0, 1, 2] and budget.peak == 60 and budget.in_use == 0
+
+
+def steps(log, name, count, seconds=0.0):
+    for i in range(count):
+        if seconds:
+            time.sleep(seconds)
+        log.append((name, i))
+        yield i + 1, count
+    return f"{name} done"
+
+
+def test_interactive_lane_steps_before_bulk():
+    scheduler = ImportScheduler(frame_budget_ms=1000)
+    log, done = [], []
+    scheduler.submit(steps(log, "bulk", 3), done.append, lane=BULK)
+    scheduler.submit(steps(log, "interactive", 2), done.append, lane=INTERACTIVE)
+    scheduler._run_slice()
+    assert log == [("interactive", 0), ("interactive", 1), ("bulk", 0), ("bulk", 1), ("bulk", 2)]
+    assert done == ["interactive done", "bulk done"] and scheduler.pending() == 0
+
+
+def test_slices_stay_within_the_frame_budget():
+    scheduler = ImportScheduler(frame_budget_ms=10)
+    log, progress = [], []
+    scheduler.submit(steps(log, "bulk", 20, seconds=0.004), lambda result: None,
+                     on_progress=lambda done, total: progress.append(done))
+    scheduler._run_slice()
+    assert 1 < len(log) < 20
+    # A slice stops after the step that crosses the deadline
+    assert scheduler.last_slice_ms < 10 + 4 * 5
+    assert progress == list(range(1, len(log) + 1))
+    while scheduler.pending():
+        scheduler._run_slice()
+    assert len(log) == 20
+
+
+def test_waiting_task_is_parked_until_woken():
+    scheduler = ImportScheduler()
+    ready = []
+    results = []
+
+    def task():
+        while not ready:
+            yield WAIT
+        return "imported"
+
+    scheduler.submit(task(), results.append)
+    scheduler._run_slice()
+    assert scheduler.pending() == 1 and not any(scheduler._lanes)
+    ready.append(True)
+    scheduler.wake()
+    scheduler._run_slice()
+    assert results == ["imported"] and scheduler.pending() == 0
@@ -0,0 +1,69 @@
+"""
+Tests for the upload encoder: the format picked from a trial encode must decode back to the image,
+exactly for PNG and within JPEG's loss for photographic content.
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip("PyQt5.QtGui")
+
+from PyQt5.QtGui import QColor, QImage, QPainter  # noqa: E402
+
+from krita_bria_masktools import encoder  # noqa: E402
+
+
+def flat_artwork(width=300, height=200):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(240, 240, 235))
+    painter = QPainter(image)
+    painter.fillRect(20, 30, 120, 80, QColor(200, 40, 40))
+    painter.fillRect(150, 60, 100, 110, QColor(30, 90, 200))
+    painter.end()
+    return image
+
+
+def photo(width=300, height=200):
+    rng = random.Random(7)
+    image = QImage(width, height, QImage.Format_RGB32)
+    for y in range(height):
+        for x in range(width):
+            base = (x * 255 // width + y * 255 // height) // 2
+            image.setPixel(x, y, QColor(*(min(255, max(0, base + rng.randint(-12, 12))) for _ in range(3))).rgb())
+    return image
+
+
+def decode(encoded):
+    image = QImage.fromData(encoded.data, encoded.format)
+    assert not image.isNull()
+    return image.convertToFormat(QImage.Format_RGB32)
+
+
+def mean_difference(a, b):
+    """Mean absolute channel difference over a grid of sample pixels."""
+    diffs = [abs(((a.pixel(x, y) >> shift) & 0xFF) - ((b.pixel(x, y) >> shift) & 0xFF))
+             for y in range(0, a.height(), 3) for x in range(0, a.width(), 3) for shift in (0, 8, 16)]
+    return sum(diffs) / float(len(diffs))
+
+
+def test_flat_artwork_is_sent_as_png_and_decodes_exactly():
+    image = flat_artwork()
+    encoded = encoder.encode(image)
+    assert (encoded.format, encoded.mime, encoded.suffix) == ("PNG", "image/png", ".png")
+    assert decode(encoded) == image
+
+
+def test_photographic_content_is_sent_as_jpeg_within_budget():
+    image = photo()
+    encoded = encoder.encode(image, budget_kb_per_mp=1024)
+    assert encoded.format == "JPEG" and encoded.quality in encoder.JPEG_QUALITIES
+    decoded = decode(encoded)
+    assert decoded.size() == image.size()
+    assert mean_difference(decoded, image) < 8
+    assert len(encoded.data) <= 1.5 * 1024 * 1024 * image.width() * image.height() / 1e6
+
+
+def test_png_can_be_ruled_out():
+    encoded = encoder.encode(flat_artwork(), allow_png=False)
+    assert encoded.format == "JPEG" and decode(encoded).size() == flat_artwork().size()
@@ -0,0 +1,109 @@
+"""
+Tests for layer fingerprints: clean layers are answered from the sample, every pixel edit of a
+dirty layer changes the fingerprint, and only the tiles an edit touched are hashed again.
+"""
+
+import pytest
+
+pytest.importorskip("PyQt5.QtCore")
+
+from PyQt5.QtCore import QRect  # noqa: E402
+from PyQt5.QtGui import QImage  # noqa: E402
+
+from krita_bria_masktools import fingerprint  # noqa: E402
+
+
+class FakeUuid:
+    def __init__(self, value):
+        self.value = value
+
+    def toString(self):
+        return self.value
+
+
+class FakeLayer:
+    """An 8-bit RGBA layer whose pixels are a bytearray."""
+
+    def __init__(self, width, height, node_id="{layer}"):
+        self.width, self.height = width, height
+        self.pixels = bytearray(width * height * 4)
+        self.node_id = node_id
+        self.reads = 0  # pixelData calls
+
+    def bounds(self):
+        return QRect(0, 0, self.width, self.height)
+
+    def colorModel(self):
+        return "RGBA"
+
+    def colorDepth(self):
+        return "U8"
+
+    def colorProfile(self):
+        return "sRGB"
+
+    def uniqueId(self):
+        return FakeUuid(self.node_id)
+
+    def pixelData(self, x, y, w, h):
+        self.reads += 1
+        return b"".join(bytes(self.pixels[((y + row) * self.width + x) * 4:((y + row) * self.width + x + w) * 4])
+                        for row in range(h))
+
+    def thumbnail(self, w, h):
+        return QImage()
+
+    def paint(self, x, y, value=255):
+        offset = (y * self.width + x) * 4
+        self.pixels[offset:offset + 4] = bytes((value,) * 4)
+
+
+SAMPLE_READS = fingerprint.SAMPLE_GRID ** 2
+
+
+def test_clean_layer_is_answered_from_the_sample():
+    layer = FakeLayer(1100, 600)
+    fingerprints = fingerprint.LayerFingerprints()
+    first = fingerprints.fingerprint(layer)
+    assert fingerprints.rehashed_tiles == 3 * 2
+    layer.reads = 0
+    assert fingerprints.fingerprint(layer) == first
+    assert layer.reads == SAMPLE_READS  # No tile was read
+    assert (fingerprints.hits, fingerprints.sampled, fingerprints.rehashed_tiles) == (1, 1, 6)
+
+
+def test_sampled_edit_of_a_clean_layer_is_noticed():
+    layer = FakeLayer(1100, 600)
+    fingerprints = fingerprint.LayerFingerprints()
+    first = fingerprints.fingerprint(layer)
+    layer.paint(0, 0)  # Inside the first sampled tile
+    assert fingerprints.fingerprint(layer) != first
+    assert fingerprints.rehashed_tiles == 6 + 1
+
+
+def test_dirty_layer_rehashes_only_the_edited_tiles():
+    layer = FakeLayer(1100, 600)
+    fingerprints = fingerprint.LayerFingerprints()
+    first = fingerprints.fingerprint(layer)
+    sample = fingerprint.sample_digest(layer)
+    layer.paint(700, 300)  # Between the sampled tiles
+    assert fingerprint.sample_digest(layer) == sample
+    fingerprints.mark_dirty(layer.node_id)
+    second = fingerprints.fingerprint(layer)
+    assert second != first
+    assert fingerprints.rehashed_tiles == 6 + 1  # Only the edited tile
+    layer.paint(700, 300, value=0)
+    fingerprints.mark_all_dirty()
+    assert fingerprints.fingerprint(layer) == first
+    layer.reads = 0
+    assert fingerprints.fingerprint(layer) == first  # Clean again
+    assert layer.reads == SAMPLE_READS
+
+
+def test_layers_are_fingerprinted_by_content():
+    fingerprints = fingerprint.LayerFingerprints()
+    a, b = FakeLayer(64, 64, "{a}"), FakeLayer(64, 64, "{b}")
+    assert fingerprints.fingerprint(a) == fingerprints.fingerprint(b)
+    b.paint(1, 1)
+    assert fingerprints.fingerprint(a) != fingerprints.fingerprint(b)
+    assert fingerprints.fingerprint(FakeLayer(0, 0, "{empty}")) is None
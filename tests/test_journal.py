@@ -0,0 +1,62 @@
+"""
+Tests for the job journal surviving a restart: items recorded in one session are read back after
+the database is closed and reopened, as when a batch is started again after a crash.
+"""
+
+import os
+
+from krita_bria_masktools.journal import (APPLIED, DOWNLOADED, FAILED, SUBMITTED, JobJournal, batch_key,
+                                          fingerprint_file)
+
+
+def test_reopened_journal_resumes_the_pending_items(tmp_path):
+    key = batch_key("document.kra", 1, ["{a}", "{b}", "{c}", "{d}"])
+    journal = JobJournal(str(tmp_path))
+    batch_id, resumed = journal.begin_batch(key)
+    assert not resumed
+    result_path = journal.result_path(batch_id, "{b}", ".png")
+    with open(result_path, 'wb') as f:
+        f.write(b"mask")
+    journal.record(batch_id, "{a}", "fa", APPLIED, outputs=["{mask-a}"])
+    journal.record(batch_id, "{b}", "fb", SUBMITTED)
+    journal.record(batch_id, "{b}", "fb", DOWNLOADED, result_path=result_path)
+    journal.record(batch_id, "{c}", "fc", FAILED)
+    journal.close()
+
+    journal = JobJournal(str(tmp_path))
+    assert journal.begin_batch(key) == (batch_id, True)
+    states = {item: (journal.lookup(batch_id, item) or {}).get('state') for item in ("{a}", "{b}", "{c}", "{d}")}
+    assert states == {"{a}": APPLIED, "{b}": DOWNLOADED, "{c}": FAILED, "{d}": None}
+    pending = [item for item, state in states.items() if state != APPLIED]
+    assert pending == ["{b}", "{c}", "{d}"]
+    # The downloaded result is re-applied from disk; the applied item keeps its outputs
+    assert journal.lookup(batch_id, "{b}")['result_path'] == result_path
+    assert journal.lookup(batch_id, "{a}")['outputs'] == ["{mask-a}"]
+
+    journal.finish_batch(batch_id)
+    journal.close()
+    assert not os.path.exists(result_path)
+    journal = JobJournal(str(tmp_path))
+    assert journal.begin_batch(key)[1] is False
+    journal.close()
+
+
+def test_missing_result_file_is_sent_again(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    batch_id, _ = journal.begin_batch("batch")
+    result_path = journal.result_path(batch_id, "{a}", ".zip")
+    journal.record(batch_id, "{a}", "fa", DOWNLOADED, result_path=result_path)
+    journal.close()
+
+    journal = JobJournal(str(tmp_path))
+    assert journal.lookup(batch_id, "{a}")['result_path'] is None
+    journal.close()
+
+
+def test_fingerprint_covers_the_pixels_and_the_mode(tmp_path):
+    path = tmp_path / "export.png"
+    path.write_bytes(b"pixels")
+    before = fingerprint_file(str(path), "0")
+    assert before != fingerprint_file(str(path), "1")
+    path.write_bytes(b"edited")
+    assert fingerprint_file(str(path), "0") != before
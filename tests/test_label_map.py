@@ -0,0 +1,119 @@
+"""
+Tests for label-map imports: painting masks into labels, point lookups and the selections
+built from one object's box.
+"""
+
+import pytest
+
+pytest.importorskip("PyQt5.QtGui")
+
+from PyQt5.QtGui import QImage  # noqa: E402
+
+from krita_bria_masktools import mask_utils  # noqa: E402
+from krita_bria_masktools.label_map import LabelMap, LabelMaps  # noqa: E402
+
+MAP_SIZE = (80, 60)
+
+
+def rect_mask(x0, y0, x1, y1, size=MAP_SIZE):
+    """A white rectangle (exclusive end) on black, as a decoded mask."""
+    image = QImage(size[0], size[1], QImage.Format_Grayscale8)
+    image.fill(0)
+    for y in range(y0, y1):
+        for x in range(x0, x1):
+            image.setPixel(x, y, 0xFFFFFFFF)
+    return image
+
+
+@pytest.fixture
+def label_map():
+    """A frame with a hole, a box nested inside the hole's neighbour and a separate box."""
+    label_map = LabelMap(MAP_SIZE[0], MAP_SIZE[1], (100, 200, 160, 120))  # Layer at 2x the map size
+    frame = rect_mask(0, 0, 40, 40)
+    for y in range(10, 20):  # Punch a hole
+        for x in range(10, 20):
+            frame.setPixel(x, y, 0xFF000000)
+    assert label_map.add("frame", frame) == 1
+    assert label_map.add("nested", rect_mask(25, 25, 35, 35)) == 2
+    assert label_map.add("box", rect_mask(50, 5, 78, 58)) == 3
+    return label_map
+
+
+def test_add_records_boxes(label_map):
+    assert len(label_map) == 3
+    assert label_map.boxes[1:] == [(0, 0, 40, 40), (25, 25, 35, 35), (50, 5, 78, 58)]
+    assert label_map.add("empty", rect_mask(0, 0, 0, 0)) == 0
+    assert len(label_map) == 3
+
+
+def test_pick_maps_image_points_to_labels(label_map):
+    assert label_map.pick(100 + 2 * 5, 200 + 2 * 5) == 1     # Frame
+    assert label_map.pick(100 + 2 * 30, 200 + 2 * 30) == 2   # Nested box painted over the frame
+    assert label_map.pick(100 + 2 * 60, 200 + 2 * 30) == 3
+    assert label_map.pick(100 + 2 * 15, 200 + 2 * 15) == 1   # The hole picks the frame around it
+    assert label_map.pick(100 + 2 * 45, 200 + 2 * 50) == 0   # Background outside every box
+    assert label_map.pick(50, 50) == 0                       # Outside the layer
+
+
+def test_object_mask_covers_only_the_object(label_map):
+    image, rect = label_map.object_mask(2)
+    assert rect == (100 + 50, 200 + 50, 20, 20)
+    assert (image.width(), image.height()) == (10, 10)
+    data, _, _ = mask_utils._strip_padding(image)
+    assert data == b"\xff" * 100
+
+    image, _ = label_map.object_mask(1)
+    data, width, _ = mask_utils._strip_padding(image)
+    assert data[15 * width + 15] == 0    # Hole
+    assert data[30 * width + 30] == 0    # Taken by the nested box
+    assert data[5 * width + 5] == 255
+
+
+def test_many_objects_widen_the_labels():
+    label_map = LabelMap(30, 10, (0, 0, 30, 10))
+    for idx in range(300):
+        x, y = idx % 30, idx // 30
+        assert label_map.add(f"object {idx}", rect_mask(x, y, x + 1, y + 1, size=(30, 10))) == idx + 1
+    assert label_map.nbytes == 30 * 10 * 2
+    assert label_map.pick(29.5, 9.5) == 300
+    image, rect = label_map.object_mask(300)
+    assert rect == (29, 9, 1, 1)
+    assert mask_utils._strip_padding(image)[0] == b"\xff"
+
+
+def test_iter_add_paints_band_by_band():
+    whole, banded = (LabelMap(80, 60, (0, 0, 80, 60)) for _ in range(2))
+    mask = rect_mask(10, 5, 70, 50)
+    assert whole.add("box", mask) == 1
+    steps = banded.iter_add("box", mask, band_pixels=80 * 7)
+    count = 0
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            assert stop.value == 1
+            break
+        count += 1
+    assert count == 9  # 60 rows, 7 per band
+    assert banded.labels == whole.labels and banded.boxes == whole.boxes
+
+
+def test_label_maps_drop_least_recently_used():
+    maps = LabelMaps(max_maps=2)
+    first, second, third = (LabelMap(1, 1, (0, 0, 1, 1)) for _ in range(3))
+    maps.put("a", first)
+    maps.put("b", second)
+    assert maps.get("a") is first
+    maps.put("c", third)
+    assert maps.get("b") is None
+    assert [node_id for node_id, _ in maps.items()] == ["c", "a"]
+
+
+def test_create_selection_from_qimage_writes_the_rectangle(fake_document):
+    document = fake_document(4000, 3000)
+    selection = mask_utils.create_selection_from_qimage(document, rect_mask(0, 0, 10, 10), 1000, 500, 1500, 800)
+    y = 500
+    for nbytes, x, band_y, width, rows in selection.writes:
+        assert (x, band_y, width, nbytes) == (1000, y, 1500, width * rows)
+        y += rows
+    assert y == 500 + 800
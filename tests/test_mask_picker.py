@@ -0,0 +1,46 @@
+"""
+Tests for the mask picker's signals: every layer leaving the picker is either imported or released,
+so the exports kept for refining its masks do not leak. Runs on Qt's offscreen platform.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("PyQt5.QtWidgets")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import Qt  # noqa: E402
+from PyQt5.QtGui import QImage  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from krita_bria_masktools.mask_analysis import MaskInfo  # noqa: E402
+from krita_bria_masktools.mask_picker import MaskPickerWidget  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def mask(name):
+    thumbnail = QImage(8, 8, QImage.Format_Grayscale8)
+    thumbnail.fill(255)
+    return MaskInfo(name, thumbnail, 0.5, (0, 0, 8, 8), 1, thumbnail)
+
+
+def test_layers_without_a_picked_mask_are_released(app):
+    picker = MaskPickerWidget()
+    imported, discarded = [], []
+    picker.import_requested.connect(imported.append)
+    picker.discarded.connect(discarded.append)
+    first, second = {'node_name': "Layer 1"}, {'node_name': "Layer 2"}
+    entries = [(first, mask("Mask 1")), (first, mask("Mask 2")), (second, mask("Mask 1"))]
+    for job, info in entries:
+        picker.add_mask(job, info)
+    picker.list_widget.item(1).setCheckState(Qt.Checked)
+
+    picker.import_button.click()
+    assert imported == [[entries[1]]]
+    assert discarded == [[entries[2]]]
+    assert not picker.isVisible() and picker.list_widget.count() == 0
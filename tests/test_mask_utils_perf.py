@@ -0,0 +1,245 @@
+"""
+Performance regression tests for the pixel paths in mask_utils.
+Synthetic masks at the mask generator's proxy size are turned into canvas-sized mask data
+for canvases of 1 to 100 MP; every case asserts a time budget and a budget for the growth
+of peak resident memory (Linux only).
+Mask creation streams the upscale band by band, so its memory budget is a fixed few MB
+whatever the canvas size. Time budgets are per megapixel with headroom for slow machines; scale them with
+BRIA_PERF_BUDGET_SCALE if needed.
+"""
+
+import pytest
+
+pytest.importorskip("PyQt5.QtGui")
+
+from PyQt5.QtCore import Qt  # noqa: E402
+from PyQt5.QtGui import QImage  # noqa: E402
+
+from krita_bria_masktools import mask_utils  # noqa: E402
+from krita_bria_masktools.mask_morphology import MorphologySettings, postprocess_mask  # noqa: E402
+from krita_bria_masktools.mutations import DocumentBatch  # noqa: E402
+
+MB = 1024 * 1024
+# Canvas sizes with widths that are not a multiple of 4, so Grayscale8 scanlines are padded
+CANVASES = [
+    pytest.param((1001, 999), id="1MP"),
+    pytest.param((3163, 3163), id="10MP"),
+    pytest.param((10001, 9999), id="100MP", marks=pytest.mark.slow),
+]
+# Proxy resolution the mask generator returns masks at
+PROXY_SIZE = (800, 600)
+
+# Budgets: (seconds per MP, peak memory growth in bytes per canvas pixel)
+BUDGETS = {
+    "strip_padding": (0.02, 3.5),
+    "transparencymask": (0.03, 4.5),
+    "selectionmask": (0.03, 5.0),
+    "paintlayer": (0.03, 9.0),
+    "create_transparency_mask": (0.05, 0.0),
+    "create_selection_mask": (0.05, 0.0),
+}
+# Fixed allowance on top of the per-pixel budgets (interpreter noise, small buffers)
+SLACK_BYTES = 8 * MB
+SLACK_SECONDS = 0.05
+
+
+def check_budget(measurement, name, pixels):
+    seconds_per_mp, bytes_per_pixel = BUDGETS[name]
+    measurement.check(seconds=SLACK_SECONDS + seconds_per_mp * pixels / 1e6,
+                      rss_bytes=SLACK_BYTES + bytes_per_pixel * pixels)
+
+
+@pytest.fixture(scope="module")
+def proxy_mask():
+    """An ellipse with a soft edge on black, like a decoded mask_generator result."""
+    width, height = PROXY_SIZE
+    cx, cy, rx, ry = width / 2.0, height / 2.0, width / 3.0, height / 3.0
+    data = bytearray(width * height)
+    for y in range(height):
+        dy = ((y - cy) / ry) ** 2
+        row = y * width
+        for x in range(width):
+            d = ((x - cx) / rx) ** 2 + dy
+            data[row + x] = 255 if d <= 0.95 else (0 if d >= 1.05 else int((1.05 - d) * 2550))
+    image = QImage(bytes(data), width, height, width, QImage.Format_Grayscale8)
+    return image.copy()  # Detach from the Python buffer
+
+
+def canvas_mask(proxy_mask, size):
+    """The proxy mask scaled to the canvas, as the import path produces it."""
+    return proxy_mask.scaled(size[0], size[1], Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def test_strip_padding_removes_scanline_padding():
+    image = QImage(5, 3, QImage.Format_Grayscale8)
+    assert image.bytesPerLine() > 5
+    for y in range(3):
+        for x in range(5):
+            image.setPixel(x, y, 0xFF000000 | (y * 16 + x) * 0x010101)
+    data, width, height = mask_utils._strip_padding(image)
+    assert (width, height) == (5, 3)
+    assert data == bytes(y * 16 + x for y in range(3) for x in range(5))
+
+
+@pytest.mark.parametrize("size", CANVASES)
+def test_strip_padding_budget(proxy_mask, size, measure):
+    gray = canvas_mask(proxy_mask, size).convertToFormat(QImage.Format_Grayscale8)
+    with measure() as m:
+        data, width, height = mask_utils._strip_padding(gray)
+    assert (width, height) == size
+    assert len(data) == width * height
+    check_budget(m, "strip_padding", width * height)
+
+
+@pytest.mark.parametrize("node_type", ["transparencymask", "selectionmask", "paintlayer"])
+@pytest.mark.parametrize("size", CANVASES)
+def test_prepare_mask_bytes_budget(proxy_mask, size, node_type, measure):
+    image = canvas_mask(proxy_mask, size)
+    with measure() as m:
+        data, width, height = mask_utils.prepare_mask_bytes(node_type, image)
+    assert (width, height) == size
+    assert len(data) == width * height * (4 if node_type == "paintlayer" else 1)
+    if node_type == "selectionmask":
+        assert set(data[::997]) <= {0, 255}
+    check_budget(m, node_type, width * height)
+
+
+def covers_canvas(writes, size):
+    """True if writes are full-width bands that tile the canvas from top to bottom."""
+    y = 0
+    for nbytes, x, band_y, width, rows in writes:
+        if (x, band_y, width) != (0, y, size[0]) or nbytes != width * rows:
+            return False
+        y += rows
+    return y == size[1]
+
+
+def test_scaled_bands_match_a_single_band(proxy_mask):
+    size = (1001, 999)
+    whole = [raw for _, _, raw in mask_utils.iter_scaled_bands(proxy_mask, *size, band_pixels=size[0] * size[1])]
+    bands = list(mask_utils.iter_scaled_bands(proxy_mask, *size, band_pixels=10000))
+    assert len(whole) == 1 and len(bands) > 1
+    assert b"".join(raw for _, _, raw in bands) == whole[0]
+
+
+def test_guided_bands_are_written_without_a_full_size_mask(proxy_mask, fake_document):
+    pytest.importorskip("numpy")
+    from krita_bria_masktools import guided_upsample
+    size = (1001, 999)
+    guide = canvas_mask(proxy_mask, size)
+    whole = guided_upsample.guided_upsample(proxy_mask, guide, tile=256)
+    expected, _, _ = mask_utils._strip_padding(whole)
+    bands = list(guided_upsample.iter_guided_bands(proxy_mask, guide, tile=256))
+    assert len(bands) == 4 and b"".join(raw for _, _, raw in bands) == expected
+
+    document = fake_document(*size)
+    parent = document.createNode("Layer", "paintlayer")
+    mask = mask_utils.create_transparency_mask_from_qimage(
+        document, parent, "Mask 1", proxy_mask, bands=guided_upsample.iter_guided_bands(proxy_mask, guide, tile=256))
+    assert len(mask.writes) == 4 and covers_canvas(mask.writes, size)
+
+
+def test_batched_mask_writes_step_one_band_at_a_time(proxy_mask, fake_document):
+    size = (1001, 999)
+    document = fake_document(*size)
+    parent = document.createNode("Layer", "paintlayer")
+    batch = DocumentBatch(document)
+    mask = mask_utils.create_selection_mask_from_qimage(document, parent, "Mask 1", proxy_mask, batch=batch)
+    assert mask.selection is None and mask.parentNode() is None  # Nothing happens before the flush
+    steps = batch.iter_flush()
+    next(steps)
+    assert mask.selection is None
+    writes = 1 + sum(1 for _ in steps)
+    assert mask.selection is not None and covers_canvas(mask.selection.writes, size)
+    assert writes == len(mask.selection.writes) > 1
+    assert mask.parentNode() is parent
+
+
+def test_failed_mutations_are_logged_and_skipped(fake_document):
+    document = fake_document(8, 8)
+    logged = []
+    batch = DocumentBatch(document, log_error=logged.append)
+    parent = document.createNode("Layer", "paintlayer")
+
+    def broken_write():
+        yield
+        raise RuntimeError("node was deleted")
+
+    batch.call(broken_write)
+    batch.set_visible(parent, False)
+    batch.flush()
+    assert (batch.applied, batch.failed) == (1, 1)
+    assert not parent.visible
+    assert logged == ["Error applying broken_write: node was deleted"]
+
+
+def ring_mask(width=101, height=67):
+    """A soft-edged ring with a hole, a dot inside the hole and a fragment touching the border."""
+    data = bytearray(width * height)
+    for y in range(height):
+        for x in range(width):
+            d = ((x - 40) / 30.0) ** 2 + ((y - 33) / 25.0) ** 2
+            value = 255 if 0.3 <= d <= 1.0 else int(max(0.0, 1.0 - abs(d - 0.65) * 2) * 255)
+            if abs(x - 40) <= 2 and abs(y - 33) <= 2 or x >= 90 and y < 10:
+                value = 255
+            data[y * width + x] = value
+    return QImage(bytes(data), width, height, width, QImage.Format_Grayscale8).copy()
+
+
+@pytest.mark.parametrize("settings", [
+    pytest.param(MorphologySettings(fill_holes=True), id="fill_holes"),
+    pytest.param(MorphologySettings(grow=3), id="grow"),
+    pytest.param(MorphologySettings(shrink=4), id="shrink"),
+    pytest.param(MorphologySettings(feather=2.5), id="feather"),
+    pytest.param(MorphologySettings(grow=2, shrink=5), id="grow_shrink"),
+    pytest.param(MorphologySettings(grow=1, shrink=2, fill_holes=True, feather=1.5), id="all"),
+])
+def test_numpy_and_python_backends_agree(settings):
+    pytest.importorskip("numpy")
+    mask = ring_mask()
+    numpy_result = mask_utils._strip_padding(postprocess_mask(mask, settings, backend="numpy"))
+    python_result = mask_utils._strip_padding(postprocess_mask(mask, settings, backend="python"))
+    assert numpy_result == python_result
+    assert numpy_result[0] != mask_utils._strip_padding(mask)[0]
+
+
+def test_prepare_mask_bytes_rejects_unknown_node_type(proxy_mask):
+    with pytest.raises(ValueError):
+        mask_utils.prepare_mask_bytes("filterlayer", proxy_mask)
+
+
+@pytest.mark.parametrize("size", CANVASES)
+def test_create_transparency_mask_budget(proxy_mask, size, fake_document, measure):
+    document = fake_document(*size)
+    parent = document.createNode("Layer", "paintlayer")
+    with measure() as m:
+        mask = mask_utils.create_transparency_mask_from_qimage(document, parent, "Mask 1", proxy_mask)
+    assert mask.parentNode() is parent
+    assert not mask.visible
+    assert len(mask.writes) > 1 and covers_canvas(mask.writes, size)
+    assert document.refreshes == 1
+    check_budget(m, "create_transparency_mask", size[0] * size[1])
+
+
+@pytest.mark.parametrize("size", CANVASES)
+def test_create_selection_mask_budget(proxy_mask, size, fake_document, measure):
+    document = fake_document(*size)
+    parent = document.createNode("Layer", "paintlayer")
+    with measure() as m:
+        mask = mask_utils.create_selection_mask_from_qimage(document, parent, "Mask 1", proxy_mask)
+    assert mask.parentNode() is parent
+    assert mask.visible
+    assert mask.selection is not None and covers_canvas(mask.selection.writes, size)
+    assert document.refreshes == 1
+    check_budget(m, "create_selection_mask", size[0] * size[1])
+
+
+def test_create_mask_on_new_layer(proxy_mask, fake_document):
+    document = fake_document(64, 48)
+    parent = document.createNode("Layer", "paintlayer")
+    document.rootNode().addChildNode(parent, None)
+    mask = mask_utils.create_transparency_mask_from_qimage(document, parent, "Mask 1", proxy_mask,
+                                                           add_to_new_layer=True)
+    new_layer = mask.parentNode()
+    assert new_layer is not parent and new_layer.name() == "Mask 1 Layer"
+    assert new_layer.parentNode() is document.rootNode()
@@ -0,0 +1,27 @@
+"""
+Tests for the prefetch idle tracker: idle time counts from the layer's last edit.
+"""
+
+from krita_bria_masktools.prefetch import IdleTracker
+
+
+def test_idle_restarts_when_the_layer_changes():
+    tracker = IdleTracker(idle_seconds=3)
+    assert not tracker.update("a", "v1", now=100)
+    assert not tracker.update("a", "v1", now=102)
+    assert not tracker.update("a", "v2", now=104)    # Edited: the stretch starts again
+    assert not tracker.update("a", "v2", now=106)
+    assert tracker.update("a", "v2", now=107)
+    tracker.done()
+    assert not tracker.update("a", "v2", now=120)    # Prefetched once per stretch
+    assert not tracker.update("a", "v3", now=121)
+    assert tracker.update("a", "v3", now=124)
+
+
+def test_idle_restarts_when_another_layer_is_active():
+    tracker = IdleTracker(idle_seconds=3)
+    tracker.update("a", "v1", now=100)
+    assert not tracker.update("b", "v1", now=104)
+    assert tracker.update("b", "v1", now=107)
+    assert not tracker.update(None, now=110)
+    assert not tracker.update(None, now=120)
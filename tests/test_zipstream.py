@@ -0,0 +1,69 @@
+"""
+Tests for ZipStream size limits. Archives written to an unseekable stream carry data descriptors,
+so their entry sizes are only known after the entry; the limits must hold while inflating.
+"""
+
+import io
+import zipfile
+
+import pytest
+
+from krita_bria_masktools.zipstream import PIECE_SIZE, ArchiveTooLarge, ZipStream
+
+MB = 1024 * 1024
+
+
+class Unseekable(io.RawIOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def descriptor_zip(entries):
+    out = Unseekable()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            with archive.open(name, 'w') as f:
+                f.write(data)
+    return bytes(out.data)
+
+
+def stream(data, chunk=4096, **limits):
+    pieces = iter(data[i:i + chunk] for i in range(0, len(data), chunk))
+    return ZipStream(lambda: next(pieces, b''), **limits)
+
+
+def test_descriptor_entries_round_trip():
+    entries = [("mask_1.png", b"a" * 5000), ("mask_2.png", bytes(range(256)) * 40)]
+    data = descriptor_zip(entries)
+    assert zipfile.ZipFile(io.BytesIO(data)).infolist()[0].flag_bits & 0x8
+    assert list(stream(data).entries()) == entries
+
+
+def test_oversized_descriptor_entry_is_skipped_without_keeping_its_data():
+    data = descriptor_zip([("big.png", bytes(8 * MB)), ("mask_1.png", b"mask")])
+    archive = stream(data, max_entry_size=MB)
+    assert list(archive.entries()) == [("big.png", None), ("mask_1.png", b"mask")]
+
+
+def test_total_limit_stops_inflating():
+    data = descriptor_zip([(f"mask_{i}.png", bytes(4 * MB)) for i in range(10)])
+    archive = stream(data, max_entry_size=8 * MB, max_total_size=10 * MB)
+    received = []
+    with pytest.raises(ArchiveTooLarge):
+        for name, _ in archive.entries():
+            received.append(name)
+    assert received == ["mask_0.png", "mask_1.png"]
+    assert archive.total_size <= 10 * MB + PIECE_SIZE
+
+
+def test_fallback_entries_respect_the_limits():
+    data = descriptor_zip([("big.png", bytes(2 * MB)), ("mask_1.png", b"mask")])
+    archive = stream(data, max_entry_size=MB)
+    assert list(archive.fallback_entries()) == [("big.png", None), ("mask_1.png", b"mask")]